@@ -32,6 +32,8 @@ INSTALLED_APPS = [
 AUTH_USER_MODEL = 'users.User'
 
 MIDDLEWARE = [
+    'utils.middleware.MetricsMiddleware',
+    'utils.middleware.SlowQueryMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -39,6 +41,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'utils.middleware.ProfilingMiddleware',
 ]
 
 REST_FRAMEWORK = {
@@ -89,6 +92,48 @@ DATABASES = {
     }
 }
 
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', default=''),
+    }
+}
+
+METRICS = {
+    # Networks allowed to scrape /metrics/ without a token.
+    'ALLOWED_IPS': os.getenv('METRICS_ALLOWED_IPS',
+                             default='127.0.0.1,::1').split(','),
+    'TOKEN': os.getenv('METRICS_TOKEN', default=''),
+}
+
+SLOW_QUERY_LOG = {
+    'FILE': os.getenv('SLOW_QUERY_LOG_FILE', default=''),
+    'THRESHOLD_MS': float(os.getenv('SLOW_QUERY_THRESHOLD_MS', default=200)),
+    'EXPLAIN': os.getenv('SLOW_QUERY_EXPLAIN', default='') == 'True',
+    'MAX_BYTES': 10 * 1024 * 1024,
+    'BACKUP_COUNT': 5,
+    'STACK_DEPTH': 10,
+}
+
+PROFILING = {
+    'DIR': os.getenv('PROFILING_DIR',
+                     default=os.path.join(BASE_DIR, 'profiles')),
+    'SAMPLE_RATE': int(os.getenv('PROFILING_SAMPLE_RATE', default=0)),
+    'TRACE_SAMPLED': False,
+    'TOP_ENTRIES': 30,
+    'MAX_PROFILES': 500,
+}
+
+IMAGE_PROCESSING = {
+    'ASYNC': os.getenv('IMAGE_PROCESSING_ASYNC', default='True') == 'True',
+    'WORKERS': int(os.getenv('IMAGE_PROCESSING_WORKERS', default=2)),
+    'MAX_ATTEMPTS': 3,
+    'RETRY_DELAY': 5,
+    'PLACEHOLDER': 'recipes/image-placeholder.svg',
+}
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator', # noqa
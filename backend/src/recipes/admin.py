@@ -2,17 +2,50 @@ from django.contrib import admin
 
 from .models import (Favorite, Ingredient, Recipe, RecipeIngredient, RecipeTag,
                      Tag)
+from .services.shopping_cart_service import ShoppingCartService
+
+
+class RecipeIngredientInline(admin.TabularInline):
+    model = RecipeIngredient
+    extra = 0
 
 
 class RecipeAdmin(admin.ModelAdmin):
-    list_display = ('name', 'author', 'get_favorites_count')
-    list_filter = ('author', 'name', 'tags')
+    list_display = ('name', 'author', 'get_favorites_count', 'image_status')
+    list_filter = ('author', 'name', 'tags', 'image_status')
+    inlines = (RecipeIngredientInline,)
 
     def get_favorites_count(self, obj):
         return obj.favorited_by.count()
 
     get_favorites_count.short_description = 'Number of favorites'
 
+    def save_related(self, request, form, formsets, change):
+        with ShoppingCartService.tracking_recipe_ingredients(
+                [form.instance.pk]):
+            super().save_related(request, form, formsets, change)
+
+
+class RecipeIngredientAdmin(admin.ModelAdmin):
+    """Keeps the shopping lists in sync with edits made here."""
+
+    def save_model(self, request, obj, form, change):
+        recipe_ids = [obj.recipe_id]
+        if change and 'recipe' in form.initial:
+            recipe_ids.append(form.initial['recipe'])
+        with ShoppingCartService.tracking_recipe_ingredients(recipe_ids):
+            super().save_model(request, obj, form, change)
+
+    def delete_model(self, request, obj):
+        with ShoppingCartService.tracking_recipe_ingredients(
+                [obj.recipe_id]):
+            super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        recipe_ids = queryset.values_list('recipe_id', flat=True)
+        with ShoppingCartService.tracking_recipe_ingredients(recipe_ids):
+            super().delete_queryset(request, queryset)
+
 
 class IngredientAdmin(admin.ModelAdmin):
     list_display = ('name', 'measurement_unit')
@@ -22,6 +55,6 @@ class IngredientAdmin(admin.ModelAdmin):
 admin.site.register(Recipe, RecipeAdmin)
 admin.site.register(Ingredient, IngredientAdmin)
 admin.site.register(Tag)
-admin.site.register(RecipeIngredient)
+admin.site.register(RecipeIngredient, RecipeIngredientAdmin)
 admin.site.register(RecipeTag)
 admin.site.register(Favorite)
@@ -1,20 +1,38 @@
 import base64
-import imghdr
+import io
 import mimetypes
 import uuid
 
+from django.conf import settings
 from django.core.files.base import ContentFile
+from django.templatetags.static import static
+from PIL import Image, UnidentifiedImageError
 from rest_framework import serializers
 
+from .services import images
 
-class Base64ImageField(serializers.ImageField):
+
+class PlaceholderImageField(serializers.ImageField):
+    """Points to a placeholder while the recipe image is being processed."""
+
+    def to_representation(self, value):
+        if value:
+            return super().to_representation(value)
+        url = static(settings.IMAGE_PROCESSING['PLACEHOLDER'])
+        request = self.context.get('request')
+        if request is not None:
+            url = request.build_absolute_uri(url)
+        return url
+
+
+class Base64ImageField(PlaceholderImageField):
     def to_internal_value(self, data):
         if isinstance(data, str) and 'data:' in data and ';base64,' in data:
             header, data = data.split(';base64,')
             mime_type = header.split(':')[-1]
             extension = mimetypes.guess_extension(mime_type)
 
-            if extension not in ['.jpg', '.jpeg', '.png', '.bmp']:
+            if extension not in ['.jpg', '.jpeg', '.png', '.bmp', '.webp']:
                 raise serializers.ValidationError('Invalid image type.')
 
             try:
@@ -25,7 +43,14 @@ class Base64ImageField(serializers.ImageField):
             file_name = self.get_file_name(decoded_file)
             data = ContentFile(decoded_file, name=f'{file_name}{extension}')
 
-        return super().to_internal_value(data)
+        # Only the header is checked here; the image is decoded and
+        # validated in full by the background worker.
+        image_file = serializers.FileField.to_internal_value(self, data)
+        try:
+            image_file.image = images.inspect_image(image_file)
+        except images.InvalidImage as error:
+            raise serializers.ValidationError(str(error))
+        return image_file
 
     def get_file_name(self, decoded_file, length=12):
         file_name = str(uuid.uuid4())[:length]
@@ -33,5 +58,8 @@ class Base64ImageField(serializers.ImageField):
         return f'{file_name}.{file_extension}'
 
     def get_file_extension(self, file_name, decoded_file):
-        extension = imghdr.what(file_name, decoded_file)
+        try:
+            extension = Image.open(io.BytesIO(decoded_file)).format.lower()
+        except (UnidentifiedImageError, OSError):
+            return None
         return "jpg" if extension == "jpeg" else extension
@@ -1,9 +1,12 @@
+from django.db.models import Exists, OuterRef
 from django_filters import rest_framework as filters
 
-from .models import Recipe
+from utils.slow_queries import QueryOriginFilterSetMixin
+from .models import Favorite, Recipe, RecipeTag, ShoppingCart
+from .services.catalog_cache import get_tag_ids
 
 
-class RecipeFilter(filters.FilterSet):
+class RecipeFilter(QueryOriginFilterSetMixin, filters.FilterSet):
     is_favorited = filters.BooleanFilter(method='filter_is_favorited')
     is_in_shopping_cart = filters.BooleanFilter(
         method='filter_by_shopping_cart')
@@ -15,16 +18,27 @@ class RecipeFilter(filters.FilterSet):
 
     def filter_is_favorited(self, queryset, name, value):
         if value:
-            return queryset.filter(favorited_by__user=self.request.user)
+            return self._filter_by_user_relation(queryset, Favorite)
         return queryset
 
     def filter_by_shopping_cart(self, queryset, name, value):
         if value:
-            return queryset.filter(in_cart__user=self.request.user)
+            return self._filter_by_user_relation(queryset, ShoppingCart)
         return queryset
 
     def filter_by_tags(self, queryset, name, value):
         tag_slugs = self.request.query_params.getlist('tags')
-        if tag_slugs:
-            return queryset.filter(tags__slug__in=tag_slugs).distinct()
-        return queryset
+        if not tag_slugs:
+            return queryset
+        tag_ids = get_tag_ids(tag_slugs)
+        if not tag_ids:
+            return queryset.none()
+        return queryset.filter(Exists(RecipeTag.objects.filter(
+            recipe=OuterRef('pk'), tag_id__in=tag_ids)))
+
+    def _filter_by_user_relation(self, queryset, model):
+        user = self.request.user
+        if not user.is_authenticated:
+            return queryset.none()
+        return queryset.filter(Exists(model.objects.filter(
+            user=user, recipe=OuterRef('pk'))))
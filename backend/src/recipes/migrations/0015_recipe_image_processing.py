@@ -0,0 +1,33 @@
+# Generated by Django 4.2 on 2026-10-18 11:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0014_shoppinglistitem'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='image_attempts',
+            field=models.PositiveSmallIntegerField(default=0, verbose_name='Попытки обработки изображения'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='image_error',
+            field=models.CharField(blank=True, max_length=255, verbose_name='Ошибка обработки изображения'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='image_status',
+            field=models.CharField(choices=[('ready', 'Обработано'), ('pending', 'Ожидает обработки'), ('failed', 'Ошибка обработки')], default='ready', max_length=10, verbose_name='Статус изображения'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='image_upload',
+            field=models.CharField(blank=True, max_length=255, verbose_name='Необработанное изображение'),
+        ),
+    ]
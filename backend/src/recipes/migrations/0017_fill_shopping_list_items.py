@@ -0,0 +1,35 @@
+from django.db import migrations
+from django.db.models import Sum
+
+BATCH_SIZE = 1000
+
+
+def fill_shopping_list_items(apps, schema_editor):
+    """Totals existing carts the way ShoppingCartService.rebuild does."""
+    RecipeIngredient = apps.get_model('recipes', 'RecipeIngredient')
+    ShoppingListItem = apps.get_model('recipes', 'ShoppingListItem')
+    totals = (
+        RecipeIngredient.objects
+        .filter(recipe__in_cart__isnull=False)
+        .values_list('recipe__in_cart__user_id', 'ingredient_id')
+        .annotate(total_amount=Sum('amount'))
+        .order_by()
+    )
+    ShoppingListItem.objects.all().delete()
+    ShoppingListItem.objects.bulk_create(
+        (ShoppingListItem(user_id=user_id, ingredient_id=ingredient_id,
+                          amount=amount)
+         for user_id, ingredient_id, amount in totals.iterator()),
+        batch_size=BATCH_SIZE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0016_recipetag_tag_recipe_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_shopping_list_items,
+                             migrations.RunPython.noop),
+    ]
@@ -30,11 +30,58 @@ class Ingredient(models.Model):
         return self.name
 
 
+class RecipeQuerySet(models.QuerySet):
+    @staticmethod
+    def related_lookups():
+        return (
+            models.Prefetch(
+                'recipetag_set',
+                queryset=RecipeTag.objects.select_related('tag')),
+            models.Prefetch(
+                'recipeingredient_set',
+                queryset=RecipeIngredient.objects.select_related(
+                    'ingredient')),
+        )
+
+    def with_related(self):
+        return self.select_related('author').prefetch_related(
+            *self.related_lookups())
+
+    def with_user_flags(self, user):
+        if not user.is_authenticated:
+            return self.annotate(
+                is_favorited=models.Value(False),
+                is_in_shopping_cart=models.Value(False),
+            )
+        return self.annotate(
+            is_favorited=models.Exists(Favorite.objects.filter(
+                user=user, recipe=models.OuterRef('pk'))),
+            is_in_shopping_cart=models.Exists(ShoppingCart.objects.filter(
+                user=user, recipe=models.OuterRef('pk'))),
+        )
+
+
 class Recipe(models.Model):
+    class ImageStatus(models.TextChoices):
+        READY = 'ready', 'Обработано'
+        PENDING = 'pending', 'Ожидает обработки'
+        FAILED = 'failed', 'Ошибка обработки'
+
     author = models.ForeignKey(User, on_delete=models.CASCADE,
                                related_name='recipes', verbose_name='Автор')
     name = models.CharField(max_length=200, verbose_name='Название')
     image = models.ImageField(upload_to='recipes/', verbose_name='Изображение')
+    image_upload = models.CharField(
+        max_length=255, blank=True,
+        verbose_name='Необработанное изображение')
+    image_status = models.CharField(
+        max_length=10, choices=ImageStatus.choices,
+        default=ImageStatus.READY, verbose_name='Статус изображения')
+    image_attempts = models.PositiveSmallIntegerField(
+        default=0, verbose_name='Попытки обработки изображения')
+    image_error = models.CharField(
+        max_length=255, blank=True,
+        verbose_name='Ошибка обработки изображения')
     text = models.TextField(verbose_name='Описание')
     ingredients = models.ManyToManyField(
         Ingredient, through='RecipeIngredient', verbose_name='Ингредиенты')
@@ -44,6 +91,10 @@ class Recipe(models.Model):
         verbose_name='Время приготовления')
     created_at = models.DateTimeField(
         auto_now_add=True, verbose_name='Дата создания')
+    updated_at = models.DateTimeField(
+        auto_now=True, verbose_name='Дата изменения')
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         ordering = ('-created_at',)
@@ -84,6 +135,10 @@ class RecipeTag(models.Model):
             models.UniqueConstraint(fields=['recipe', 'tag'],
                                     name='unique_recipe_tag')
         ]
+        indexes = [
+            models.Index(fields=['tag', 'recipe'],
+                         name='recipetag_tag_recipe_idx'),
+        ]
         verbose_name = 'Тег рецепта'
         verbose_name_plural = 'Теги рецептов'
 
@@ -129,3 +184,24 @@ class ShoppingCart(models.Model):
 
     def __str__(self):
         return f'{self.user.username} - {self.recipe.name}'
+
+
+class ShoppingListItem(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE,
+                             related_name='shopping_list_items',
+                             verbose_name='Пользователь')
+    ingredient = models.ForeignKey(Ingredient, on_delete=models.CASCADE,
+                                   related_name='shopping_list_items',
+                                   verbose_name='Ингредиент')
+    amount = models.PositiveIntegerField(verbose_name='Количество')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'ingredient'],
+                                    name='unique_shopping_list_item')
+        ]
+        verbose_name = 'Позиция списка покупок'
+        verbose_name_plural = 'Списки покупок'
+
+    def __str__(self):
+        return f'{self.user.username} - {self.ingredient.name}'
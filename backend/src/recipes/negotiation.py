@@ -0,0 +1,11 @@
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.settings import DEFAULTS, APISettings
+
+
+class FileFormatContentNegotiation(DefaultContentNegotiation):
+    """Leaves ?format= to views that choose the file format themselves.
+
+    Only the Accept header selects the renderer, so formats without a
+    renderer such as txt or csv do not end in 404.
+    """
+    settings = APISettings({'URL_FORMAT_OVERRIDE': None}, DEFAULTS)
@@ -1,6 +1,16 @@
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import CursorPagination, PageNumberPagination
 
 
 class RecipePaginator(PageNumberPagination):
     page_size = 6
     page_size_query_param = 'limit'
+
+
+class RecipeCursorPaginator(CursorPagination):
+    page_size = 6
+    page_size_query_param = 'limit'
+    ordering = ('-created_at', '-id')
+
+    @classmethod
+    def is_requested(cls, request):
+        return cls.cursor_query_param in request.query_params
@@ -0,0 +1,15 @@
+from rest_framework.parsers import FileUploadParser
+
+
+class RawImageParser(FileUploadParser):
+    """Reads an image sent as the raw request body.
+
+    The body goes through Django's upload handlers, so it is written to
+    memory or a temporary file chunk by chunk. The file name is optional;
+    the image type is detected from its content.
+    """
+    media_type = 'image/*'
+
+    def get_filename(self, stream, media_type, parser_context):
+        return super().get_filename(
+            stream, media_type, parser_context) or 'upload'
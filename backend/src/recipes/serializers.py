@@ -1,8 +1,19 @@
+import logging
+
+from django.db import DatabaseError, transaction
+from django.db.models import prefetch_related_objects
 from rest_framework import serializers
+from rest_framework.settings import api_settings
 
 from users.serializers import UserSerializer
-from .fields import Base64ImageField
+from .fields import Base64ImageField, PlaceholderImageField
 from .models import Ingredient, Recipe, RecipeIngredient, RecipeTag, Tag
+from .services import image_processing, images
+from .services.shopping_cart_service import ShoppingCartService
+
+BULK_RECIPES_LIMIT = 100
+
+logger = logging.getLogger(__name__)
 
 
 class TagSerializer(serializers.ModelSerializer):
@@ -48,73 +59,209 @@ class RecipeIngredientWriteSerializer(serializers.ModelSerializer):
         fields = ('id', 'amount')
 
 
-class RecipeRetriveSerializer(serializers.ModelSerializer):
+class ImageVariantsMixin:
+    def get_image_variants(self, obj):
+        return images.get_variant_urls(
+            obj.image.name, self.context.get('request'))
+
+
+class StagedImageMixin:
+    def _stage_image(self, validated_data):
+        """Replaces the upload with fields that queue it for processing.
+
+        A new recipe has no image until the worker is done; an updated one
+        keeps its current image meanwhile.
+        """
+        if 'image' not in validated_data:
+            return
+        image_file = validated_data.pop('image')
+        if self.instance is None:
+            validated_data['image'] = ''
+        validated_data.update(image_processing.stage_image(image_file))
+
+    def _enqueue_image(self, recipe, validated_data):
+        if 'image_upload' in validated_data:
+            image_processing.enqueue(recipe)
+
+
+class RecipeRetriveSerializer(ImageVariantsMixin,
+                              serializers.ModelSerializer):
     tags = RecipeTagSerializer(source='recipetag_set', many=True)
     author = UserSerializer(read_only=True)
     ingredients = RecipeIngredientSerializer(
         source='recipeingredient_set', many=True)
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
+    image = PlaceholderImageField(read_only=True)
+    image_variants = serializers.SerializerMethodField()
 
     class Meta:
         model = Recipe
         fields = ('id', 'tags', 'ingredients', 'author', 'name', 'text',
-                  'image', 'cooking_time', 'is_favorited',
-                  'is_in_shopping_cart')
+                  'image', 'image_variants', 'image_status', 'cooking_time',
+                  'is_favorited', 'is_in_shopping_cart')
 
     def get_is_favorited(self, obj):
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         request = self.context.get('request')
         if request and request.user.is_authenticated:
             return obj.favorited_by.filter(user=request.user).exists()
         return False
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         request = self.context.get('request')
         if request and request.user.is_authenticated:
             return obj.in_cart.filter(user=request.user).exists()
         return False
 
 
-class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
-    tags = serializers.PrimaryKeyRelatedField(
-        many=True, queryset=Tag.objects.all())
+class RecipeListCreateSerializer(serializers.ListSerializer):
+    """Creates a batch of recipes with a few bulk statements.
+
+    Tag and ingredient ids of all items are looked up once.
+    """
+
+    def to_internal_value(self, data):
+        if isinstance(data, list):
+            self.child.known_ids = self.child.get_known_ids(data)
+        return super().to_internal_value(data)
+
+    def create(self, validated_data):
+        return self.child.create_many(validated_data)
+
+    def save_each(self, **kwargs):
+        """Validates and saves every item in its own transaction.
+
+        Returns a (recipe, errors) pair per item.
+        """
+        known_ids = self.child.get_known_ids(self.initial_data)
+        results = []
+        for item in self.initial_data:
+            serializer = type(self.child)(data=item, context=self.context)
+            serializer.known_ids = known_ids
+            if not serializer.is_valid():
+                results.append((None, serializer.errors))
+                continue
+            try:
+                results.append((serializer.save(**kwargs), None))
+            except DatabaseError:
+                logger.exception('Saving a recipe of a bulk request failed')
+                results.append((None, {
+                    api_settings.NON_FIELD_ERRORS_KEY: [
+                        'The recipe could not be saved.']}))
+        return results
+
+
+class RecipeCreateUpdateSerializer(StagedImageMixin, ImageVariantsMixin,
+                                   serializers.ModelSerializer):
+    tags = serializers.ListField(child=serializers.IntegerField())
     ingredients = RecipeIngredientWriteSerializer(many=True)
     image = Base64ImageField(max_length=None, use_url=True)
+    image_variants = serializers.SerializerMethodField()
+
+    # {model: set of ids} loaded up front when validating many recipes.
+    known_ids = None
 
     class Meta:
         model = Recipe
         fields = ('id', 'name', 'text', 'ingredients', 'tags', 'image',
-                  'cooking_time')
+                  'image_variants', 'image_status', 'cooking_time')
+        read_only_fields = ('image_status',)
+        list_serializer_class = RecipeListCreateSerializer
+
+    @staticmethod
+    def get_known_ids(items):
+        """Loads the existing tag and ingredient ids referenced by items."""
+        tag_ids, ingredient_ids = set(), set()
+        for item in items:
+            if not isinstance(item, dict):
+                continue
+            tags = item.get('tags')
+            if isinstance(tags, list):
+                tag_ids.update(tags)
+            ingredients = item.get('ingredients')
+            if isinstance(ingredients, list):
+                ingredient_ids.update(
+                    ingredient.get('id') for ingredient in ingredients
+                    if isinstance(ingredient, dict))
+        known_ids = {}
+        for model, ids in ((Tag, tag_ids), (Ingredient, ingredient_ids)):
+            ids = RecipeCreateUpdateSerializer._to_ids(ids)
+            known_ids[model] = set(model.objects.filter(
+                pk__in=ids).values_list('pk', flat=True)) if ids else set()
+        return known_ids
+
+    @staticmethod
+    def _to_ids(values):
+        """Coerces ids like IntegerField does and drops invalid ones."""
+        field = serializers.IntegerField()
+        ids = set()
+        for value in values:
+            try:
+                ids.add(field.to_internal_value(value))
+            except serializers.ValidationError:
+                pass
+        return list(ids)
+
+    def validate_tags(self, value):
+        self._check_existing(Tag, value)
+        return value
+
+    def validate_ingredients(self, value):
+        self._check_existing(
+            Ingredient,
+            [ingredient['ingredient']['id'] for ingredient in value])
+        return value
+
+    def _check_existing(self, model, ids):
+        """Checks all submitted ids with a single query."""
+        if self.known_ids is not None:
+            existing = self.known_ids[model]
+        else:
+            existing = set(model.objects.filter(pk__in=ids).values_list(
+                'pk', flat=True))
+        missing = [pk for pk in ids if pk not in existing]
+        if missing:
+            raise serializers.ValidationError(
+                [f'Invalid pk "{pk}" - object does not exist.'
+                 for pk in missing])
 
     def validate(self, data):
-        if len(data['tags']) != len(set(tag.id for tag in data['tags'])):
+        if 'tags' in data and len(data['tags']) != len(set(data['tags'])):
             raise serializers.ValidationError(
                 {"tags": ["All tags must be unique."]})
 
-        if len(data['ingredients']) != len(
+        if 'ingredients' in data and len(data['ingredients']) != len(
             set(ingredient['ingredient']['id']
                 for ingredient in data['ingredients'])
         ):
             raise serializers.ValidationError(
                 {"ingredients": ["All ingredients must be unique."]})
 
-        for ingredient in data['ingredients']:
+        for ingredient in data.get('ingredients', []):
             if ingredient['amount'] <= 0:
                 raise serializers.ValidationError(
                     {"ingredients": ["Amount of each ingredient"
                                      "must be more than zero."]})
 
-        if len(data['tags']) == 0:
+        if 'tags' in data and len(data['tags']) == 0:
             raise serializers.ValidationError(
                 {"tags": ["This field is required."]})
-        if len(data['ingredients']) == 0:
+        if 'ingredients' in data and len(data['ingredients']) == 0:
             raise serializers.ValidationError(
                 {"ingredients": ["This field is required."]})
         return data
 
     def to_representation(self, instance):
-        self.fields['tags'] = TagSerializer(many=True)
-        self.fields['ingredients'] = IngredientSerializer(many=True)
+        prefetch_related_objects(
+            [instance], *Recipe.objects.related_lookups())
+        self.fields['tags'] = RecipeTagSerializer(
+            source='recipetag_set', many=True)
+        self.fields['ingredients'] = RecipeIngredientSerializer(
+            source='recipeingredient_set', many=True)
         self.fields['author'] = UserSerializer()
         representation = super().to_representation(instance)
         request = self.context.get('request')
@@ -123,40 +270,141 @@ class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
         return representation
 
     def create(self, validated_data):
-        tags_data = validated_data.pop('tags')
-        ingredient_data = validated_data.pop('ingredients')
-        recipe = Recipe.objects.create(**validated_data)
-        self._create_recipe_tags(recipe, tags_data)
-        self._create_recipe_ingredients(recipe, ingredient_data)
-        return recipe
-
+        return self.create_many([validated_data])[0]
+
+    @transaction.atomic
+    def create_many(self, items):
+        recipes, tag_rows, ingredient_rows = [], [], []
+        for validated_data in items:
+            tag_ids = validated_data.pop('tags')
+            amounts = self._get_amounts(validated_data.pop('ingredients'))
+            self._stage_image(validated_data)
+            recipe = Recipe(**validated_data)
+            recipes.append(recipe)
+            tag_rows.extend(RecipeTag(recipe=recipe, tag_id=tag_id)
+                            for tag_id in tag_ids)
+            ingredient_rows.extend(
+                RecipeIngredient(recipe=recipe, ingredient_id=ingredient_id,
+                                 amount=amount)
+                for ingredient_id, amount in amounts.items())
+        Recipe.objects.bulk_create(recipes)
+        RecipeTag.objects.bulk_create(tag_rows)
+        RecipeIngredient.objects.bulk_create(ingredient_rows)
+        for recipe, validated_data in zip(recipes, items):
+            self._enqueue_image(recipe, validated_data)
+        return recipes
+
+    @transaction.atomic
     def update(self, instance, validated_data):
-        tags_data = validated_data.pop('tags', [])
-        ingredients_data = validated_data.pop('ingredients', [])
+        tag_ids = validated_data.pop('tags', None)
+        ingredients_data = validated_data.pop('ingredients', None)
+        self._stage_image(validated_data)
         instance = super().update(instance, validated_data)
-        self._create_recipe_tags(instance, tags_data)
-        self._create_recipe_ingredients(instance, ingredients_data)
+        self._enqueue_image(instance, validated_data)
+        if tag_ids is not None:
+            self._update_recipe_tags(instance, tag_ids)
+        if ingredients_data is not None:
+            self._update_recipe_ingredients(
+                instance, self._get_amounts(ingredients_data))
         return instance
 
-    def _create_recipe_tags(self, instance, tags_data):
-        instance.recipetag_set.all().delete()
-        if tags_data:
+    @staticmethod
+    def _get_amounts(ingredients_data):
+        return {ingredient['ingredient']['id']: ingredient['amount']
+                for ingredient in ingredients_data}
+
+    def _update_recipe_tags(self, instance, tag_ids):
+        current = dict(RecipeTag.objects.filter(
+            recipe=instance).values_list('tag_id', 'pk'))
+        wanted = set(tag_ids)
+        removed = [pk for tag_id, pk in current.items()
+                   if tag_id not in wanted]
+        if removed:
+            RecipeTag.objects.filter(pk__in=removed).delete()
+        added = [tag_id for tag_id in tag_ids if tag_id not in current]
+        if added:
             RecipeTag.objects.bulk_create(
-                [RecipeTag(recipe=instance, tag=tag) for tag in tags_data])
+                RecipeTag(recipe=instance, tag_id=tag_id)
+                for tag_id in added)
+
+    def _update_recipe_ingredients(self, instance, amounts):
+        """Applies only the changed rows and updates the shopping lists."""
+        ShoppingCartService.lock_recipes([instance.pk])
+        current = {
+            recipe_ingredient.ingredient_id: recipe_ingredient
+            for recipe_ingredient in RecipeIngredient.objects.filter(
+                recipe=instance).only('pk', 'ingredient_id', 'amount')
+        }
+        old_amounts = {ingredient_id: recipe_ingredient.amount
+                       for ingredient_id, recipe_ingredient
+                       in current.items()}
+        removed = [recipe_ingredient.pk
+                   for ingredient_id, recipe_ingredient in current.items()
+                   if ingredient_id not in amounts]
+        if removed:
+            RecipeIngredient.objects.filter(pk__in=removed).delete()
+        added, changed = [], []
+        for ingredient_id, amount in amounts.items():
+            recipe_ingredient = current.get(ingredient_id)
+            if recipe_ingredient is None:
+                added.append(RecipeIngredient(
+                    recipe=instance, ingredient_id=ingredient_id,
+                    amount=amount))
+            elif recipe_ingredient.amount != amount:
+                recipe_ingredient.amount = amount
+                changed.append(recipe_ingredient)
+        if added:
+            RecipeIngredient.objects.bulk_create(added)
+        if changed:
+            RecipeIngredient.objects.bulk_update(changed, ['amount'])
+        ShoppingCartService.change_recipe_ingredients(
+            instance, old_amounts, amounts)
+
+
+class ShortRecipeSerializer(ImageVariantsMixin, serializers.ModelSerializer):
+    image = PlaceholderImageField(read_only=True)
+    image_variants = serializers.SerializerMethodField()
 
-    def _create_recipe_ingredients(self, instance, ingredients_data):
-        instance.recipeingredient_set.all().delete()
-        if ingredients_data:
-            RecipeIngredient.objects.bulk_create(
-                [RecipeIngredient(
-                    recipe=instance,
-                    ingredient_id=ingredient['ingredient']['id'],
-                    amount=ingredient['amount']
-                ) for ingredient in ingredients_data]
-            )
+    class Meta:
+        model = Recipe
+        fields = ('id', 'name', 'image', 'image_variants', 'cooking_time')
+
+
+class RecipeIdsSerializer(serializers.Serializer):
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), allow_empty=False,
+        max_length=BULK_RECIPES_LIMIT)
 
+    def validate_recipes(self, value):
+        return list(dict.fromkeys(value))
+
+
+class RecipeRemovalSerializer(RecipeIdsSerializer):
+    """Takes a list of recipes or an explicit {"all": true}."""
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), allow_empty=False,
+        max_length=BULK_RECIPES_LIMIT, required=False)
+    all = serializers.BooleanField(default=False)
+
+    def validate(self, attrs):
+        if attrs['all'] == ('recipes' in attrs):
+            raise serializers.ValidationError(
+                'Send either a list of recipes or "all": true.')
+        return attrs
+
+
+class RecipeImageSerializer(StagedImageMixin, ImageVariantsMixin,
+                            serializers.ModelSerializer):
+    image = Base64ImageField(max_length=None, use_url=True)
+    image_variants = serializers.SerializerMethodField()
 
-class ShortRecipeSerializer(serializers.ModelSerializer):
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'image', 'image_variants', 'image_status')
+        read_only_fields = ('image_status',)
+
+    def update(self, instance, validated_data):
+        self._stage_image(validated_data)
+        instance = super().update(instance, validated_data)
+        self._enqueue_image(instance, validated_data)
+        return instance
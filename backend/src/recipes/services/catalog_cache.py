@@ -0,0 +1,102 @@
+import hashlib
+import threading
+import time
+from collections import namedtuple
+
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from recipes.models import Ingredient, Tag
+from recipes.serializers import IngredientSerializer, TagSerializer
+
+CatalogEntry = namedtuple('CatalogEntry', 'version data content etag')
+
+
+class PrerenderedResponse(Response):
+    def __init__(self, data, content, **kwargs):
+        super().__init__(data, **kwargs)
+        self.prerendered_content = content
+
+    @property
+    def rendered_content(self):
+        renderer = getattr(self, 'accepted_renderer', None)
+        if isinstance(renderer, JSONRenderer):
+            self['Content-Type'] = self.content_type or renderer.media_type
+            return self.prerendered_content
+        return super().rendered_content
+
+
+class CatalogCache:
+    def __init__(self, name, build):
+        self.name = name
+        self._build = build
+        self._lock = threading.Lock()
+        self._entry = None
+
+    @property
+    def version_key(self):
+        return f'catalog:{self.name}:version'
+
+    def get_version(self):
+        version = cache.get(self.version_key)
+        if version is None:
+            cache.add(self.version_key, self._initial_version(), None)
+            version = cache.get(self.version_key)
+        return version
+
+    def invalidate(self):
+        try:
+            return cache.incr(self.version_key)
+        except ValueError:
+            cache.set(self.version_key, self._initial_version(), None)
+            return None
+
+    def get(self):
+        version = self.get_version()
+        entry = self._entry
+        if entry is not None and entry.version == version:
+            return entry
+        with self._lock:
+            entry = self._entry
+            if entry is None or entry.version != version:
+                data = list(self._build())
+                content = JSONRenderer().render(data)
+                etag = quote_etag(hashlib.sha1(content).hexdigest())
+                entry = CatalogEntry(version, data, content, etag)
+                self._entry = entry
+        return entry
+
+    def response(self, request):
+        entry = self.get()
+        not_modified = get_conditional_response(request, etag=entry.etag)
+        if not_modified is not None:
+            not_modified['ETag'] = entry.etag
+            return not_modified
+        return PrerenderedResponse(
+            entry.data, entry.content, headers={'ETag': entry.etag})
+
+    @staticmethod
+    def _initial_version():
+        return time.time_ns() // 1000
+
+
+def build_tags():
+    return TagSerializer(Tag.objects.all(), many=True).data
+
+
+def build_ingredients():
+    return IngredientSerializer(Ingredient.objects.all(), many=True).data
+
+
+tag_catalog = CatalogCache('tags', build_tags)
+ingredient_catalog = CatalogCache('ingredients', build_ingredients)
+
+
+def get_tag_ids(slugs):
+    """Resolves tag slugs to ids with the cached tag catalog."""
+    slugs = set(slugs)
+    return [tag['id'] for tag in tag_catalog.get().data
+            if tag['slug'] in slugs]
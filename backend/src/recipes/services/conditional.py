@@ -0,0 +1,77 @@
+import hashlib
+
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+from django.db.models import Count, Max, OuterRef, Subquery
+from django.utils.http import quote_etag
+
+from recipes.models import Favorite, Recipe, ShoppingCart
+from users.models import Subscription
+from .catalog_cache import ingredient_catalog, tag_catalog
+
+User = get_user_model()
+
+USER_STATE_MODELS = (Favorite, ShoppingCart, Subscription)
+
+
+def make_etag(*parts):
+    return quote_etag(
+        hashlib.sha1(repr(parts).encode('utf-8')).hexdigest())
+
+
+def _user_relation_stamp(model, aggregate):
+    return Subquery(
+        model.objects
+        .filter(user=OuterRef('pk'))
+        .order_by()
+        .values('user')
+        .annotate(value=aggregate)
+        .values('value')
+    )
+
+
+def get_user_state(request):
+    if not request.user.is_authenticated:
+        return None
+    if not hasattr(request, '_recipe_user_state'):
+        stamps = {}
+        for model in USER_STATE_MODELS:
+            name = model._meta.model_name
+            stamps[f'{name}_count'] = _user_relation_stamp(
+                model, Count('id'))
+            stamps[f'{name}_last'] = _user_relation_stamp(model, Max('id'))
+        state = User.objects.filter(pk=request.user.pk).values(**stamps)
+        request._recipe_user_state = tuple(sorted(state[0].items()))
+    return request._recipe_user_state
+
+
+def get_catalog_versions():
+    return tag_catalog.get_version(), ingredient_catalog.get_version()
+
+
+def recipe_list_etag(request, queryset):
+    stats = queryset.order_by().aggregate(
+        count=Count('id'), last_modified=Max('updated_at'))
+    return make_etag(
+        request.get_full_path(), stats['count'], stats['last_modified'],
+        get_user_state(request), get_catalog_versions())
+
+
+def recipe_validators(request, pk):
+    try:
+        pk = Recipe._meta.pk.to_python(pk)
+    except ValidationError:
+        return None, None
+    updated_at = (
+        Recipe.objects
+        .filter(pk=pk)
+        .values_list('updated_at', flat=True)
+        .first()
+    )
+    if updated_at is None:
+        return None, None
+    etag = make_etag(
+        pk, updated_at, get_user_state(request), get_catalog_versions())
+    if request.user.is_authenticated:
+        return etag, None
+    return etag, updated_at
@@ -0,0 +1,122 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, connection, transaction
+from django.utils import timezone
+
+from recipes.models import Recipe
+from . import images
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.IMAGE_PROCESSING['WORKERS'],
+                thread_name_prefix='recipe-images')
+    return _executor
+
+
+def stage_image(image_file):
+    """Returns the recipe fields that queue an upload.
+
+    The upload is written once the save commits, so a rolled back save
+    leaves no file behind.
+    """
+    upload_name = images.get_upload_name(image_file.image.format)
+    transaction.on_commit(
+        lambda: images.save_upload(image_file, upload_name))
+    return {
+        'image_upload': upload_name,
+        'image_status': Recipe.ImageStatus.PENDING,
+        'image_attempts': 0,
+        'image_error': '',
+    }
+
+
+def enqueue(recipe):
+    """Processes the staged image of the recipe once the save commits."""
+    recipe_id, upload_name = recipe.pk, recipe.image_upload
+    transaction.on_commit(lambda: schedule(recipe_id, upload_name))
+
+
+def schedule(recipe_id, upload_name, delay=0):
+    if not settings.IMAGE_PROCESSING['ASYNC']:
+        process_image(recipe_id, upload_name)
+    elif delay:
+        timer = threading.Timer(
+            delay, schedule, (recipe_id, upload_name))
+        timer.daemon = True
+        timer.start()
+    else:
+        get_executor().submit(run_task, recipe_id, upload_name)
+
+
+def run_task(recipe_id, upload_name):
+    close_old_connections()
+    try:
+        process_image(recipe_id, upload_name)
+    except Exception:
+        logger.exception('Processing image of recipe %s failed', recipe_id)
+    finally:
+        connection.close()
+
+
+def remove_upload(upload_name):
+    try:
+        default_storage.delete(upload_name)
+    except OSError:
+        logger.warning('Could not remove %s', upload_name)
+
+
+def process_image(recipe_id, upload_name, retry=True):
+    """Turns a staged upload into the recipe image.
+
+    Broken images fail at once; other errors are retried with an
+    exponential backoff up to MAX_ATTEMPTS. A recipe that got a newer
+    upload in the meantime is left alone. Uploads that kept failing are
+    kept for process_recipe_images --pending. Returns the new status.
+    """
+    options = settings.IMAGE_PROCESSING
+    pending = Recipe.objects.filter(pk=recipe_id, image_upload=upload_name)
+    attempts = pending.values_list('image_attempts', flat=True).first()
+    if attempts is None:
+        remove_upload(upload_name)
+        return None
+    attempts += 1
+    try:
+        with default_storage.open(upload_name) as image_file:
+            image_name = images.store_image(image_file)
+    except images.InvalidImage as error:
+        pending.update(image_upload='', image_status=Recipe.ImageStatus.FAILED,
+                       image_attempts=attempts, image_error=str(error))
+        remove_upload(upload_name)
+        return Recipe.ImageStatus.FAILED
+    except Exception as error:
+        logger.warning('Attempt %s to process image of recipe %s failed: %s',
+                       attempts, recipe_id, error)
+        if retry and attempts < options['MAX_ATTEMPTS']:
+            pending.update(image_attempts=attempts,
+                           image_error=str(error)[:255])
+            schedule(recipe_id, upload_name,
+                     options['RETRY_DELAY'] * 2 ** (attempts - 1))
+            return Recipe.ImageStatus.PENDING
+        pending.update(image_status=Recipe.ImageStatus.FAILED,
+                       image_attempts=attempts,
+                       image_error=str(error)[:255])
+        return Recipe.ImageStatus.FAILED
+    pending.update(image=image_name, image_upload='',
+                   image_status=Recipe.ImageStatus.READY,
+                   image_attempts=attempts, image_error='',
+                   updated_at=timezone.now())
+    remove_upload(upload_name)
+    return Recipe.ImageStatus.READY
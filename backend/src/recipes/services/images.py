@@ -0,0 +1,195 @@
+import hashlib
+import io
+import re
+import uuid
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+UPLOAD_DIR = 'recipes'
+RAW_UPLOAD_DIR = f'{UPLOAD_DIR}/uploads'
+MAX_PIXELS = 40_000_000
+CHUNK_SIZE = 64 * 1024
+
+# Longest side of each variant; images are never upscaled.
+VARIANTS = {
+    'card': 480,
+    'detail': 960,
+    'retina': 1920,
+}
+VARIANT_FORMATS = {
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+    'jpeg': {'format': 'JPEG', 'quality': 82, 'optimize': True,
+             'progressive': True},
+}
+ORIGINAL_FORMATS = {
+    'JPEG': ('jpg', {'format': 'JPEG', 'quality': 92, 'optimize': True}),
+    'PNG': ('png', {'format': 'PNG', 'optimize': True}),
+    'BMP': ('png', {'format': 'PNG', 'optimize': True}),
+    'WEBP': ('webp', {'format': 'WEBP', 'quality': 90}),
+}
+HASHED_NAME_RE = re.compile(
+    rf'^{UPLOAD_DIR}/[0-9a-f]{{2}}/(?P<digest>[0-9a-f]{{64}})')
+
+
+class InvalidImage(ValueError):
+    pass
+
+
+def get_digest(image_file):
+    digest = hashlib.sha256()
+    image_file.seek(0)
+    for chunk in image_file.chunks(CHUNK_SIZE):
+        digest.update(chunk)
+    image_file.seek(0)
+    return digest.hexdigest()
+
+
+def check_image(image):
+    if image.format not in ORIGINAL_FORMATS:
+        raise InvalidImage('Invalid image type.')
+    if image.width * image.height > MAX_PIXELS:
+        raise InvalidImage('Image is too large.')
+    return image
+
+
+def inspect_image(image_file):
+    """Checks the image header only; pixel data is not decoded."""
+    try:
+        image_file.seek(0)
+        image = Image.open(image_file)
+    except (UnidentifiedImageError, OSError,
+            Image.DecompressionBombError) as error:
+        raise InvalidImage('Upload a valid image.') from error
+    finally:
+        image_file.seek(0)
+    return check_image(image)
+
+
+def open_image(image_file):
+    """Opens, validates and decodes an uploaded image with Pillow."""
+    try:
+        image_file.seek(0)
+        image = Image.open(image_file)
+        image.verify()
+        image_file.seek(0)
+        image = Image.open(image_file)
+        image.load()
+    except (UnidentifiedImageError, OSError, SyntaxError,
+            Image.DecompressionBombError) as error:
+        raise InvalidImage('Upload a valid image.') from error
+    return check_image(image)
+
+
+def get_original_name(digest, image_format):
+    extension = ORIGINAL_FORMATS[image_format][0]
+    return f'{UPLOAD_DIR}/{digest[:2]}/{digest}.{extension}'
+
+
+def get_variant_names(image_name):
+    """Returns {variant: {format: name}} for a content-hashed image."""
+    match = HASHED_NAME_RE.match(image_name or '')
+    if match is None:
+        return None
+    digest = match.group('digest')
+    return {
+        variant: {
+            image_format: (f'{UPLOAD_DIR}/{digest[:2]}/{digest}/'
+                           f'{variant}.{image_format}')
+            for image_format in VARIANT_FORMATS
+        }
+        for variant in VARIANTS
+    }
+
+
+def get_variant_urls(image_name, request=None):
+    variant_names = get_variant_names(image_name)
+    if variant_names is None:
+        return None
+    urls = {}
+    for variant, names in variant_names.items():
+        urls[variant] = {}
+        for image_format, name in names.items():
+            url = default_storage.url(name)
+            if request is not None:
+                url = request.build_absolute_uri(url)
+            urls[variant][image_format] = url
+    return urls
+
+
+def normalize(image):
+    """Applies EXIF orientation and drops metadata and odd modes."""
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ('RGB', 'RGBA', 'L'):
+        has_alpha = 'A' in image.getbands() or 'transparency' in image.info
+        image = image.convert('RGBA' if has_alpha else 'RGB')
+    clean = Image.new(image.mode, image.size)
+    clean.paste(image)
+    return clean
+
+
+def flatten(image):
+    if image.mode == 'RGB':
+        return image
+    background = Image.new('RGB', image.size, (255, 255, 255))
+    if image.mode == 'RGBA':
+        background.paste(image, mask=image.getchannel('A'))
+    else:
+        background.paste(image.convert('RGB'))
+    return background
+
+
+def encode(image, options):
+    if options['format'] == 'JPEG':
+        image = flatten(image)
+    buffer = io.BytesIO()
+    image.save(buffer, **options)
+    return buffer.getvalue()
+
+
+def save_file(name, content):
+    if not default_storage.exists(name):
+        default_storage.save(name, ContentFile(content))
+
+
+def generate_variants(image, image_name):
+    for variant, names in get_variant_names(image_name).items():
+        size = VARIANTS[variant]
+        resized = image.copy()
+        resized.thumbnail((size, size), Image.LANCZOS)
+        for image_format, name in names.items():
+            save_file(name, encode(resized, VARIANT_FORMATS[image_format]))
+
+
+def get_upload_name(image_format):
+    """Returns a new storage name for an upload; the client's is ignored."""
+    return f'{RAW_UPLOAD_DIR}/{uuid.uuid4().hex}.{image_format.lower()}'
+
+
+def save_upload(image_file, name):
+    """Saves the uploaded bytes as they are for background processing.
+
+    The file is copied in chunks.
+    """
+    image_file.seek(0)
+    return default_storage.save(name, image_file)
+
+
+def store_image(image_file):
+    """Stores an upload under its content hash and returns the name.
+
+    The original is re-encoded without metadata and resized variants are
+    generated next to it. Identical uploads map to the same files, so
+    they are only processed once.
+    """
+    digest = get_digest(image_file)
+    image = open_image(image_file)
+    name = get_original_name(digest, image.format)
+    if default_storage.exists(name):
+        return name
+    image_format = image.format
+    image = normalize(image)
+    generate_variants(image, name)
+    save_file(name, encode(image, ORIGINAL_FORMATS[image_format][1]))
+    return name
@@ -0,0 +1,146 @@
+import bisect
+import threading
+
+from recipes.models import Ingredient
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+NGRAM_SIZE = 3
+
+
+def normalize(value):
+    return value.casefold().replace('ё', 'е')
+
+
+def ngrams(value):
+    return {value[i:i + NGRAM_SIZE]
+            for i in range(len(value) - NGRAM_SIZE + 1)}
+
+
+class IngredientIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._version = None
+        self._entries = None
+        self._keys = []
+        self._ngrams = {}
+
+    def search(self, query, limit=DEFAULT_LIMIT, version=None):
+        query = normalize(query)
+        with self._lock:
+            if version != self._version:
+                self._reset()
+                self._version = version
+            self._ensure_built()
+            prefix_ids = self._prefix_ids(query, limit)
+            results = [self._entries[pk][1] for pk in prefix_ids]
+            if len(results) < limit:
+                matches = []
+                for pk in self._candidate_ids(query):
+                    key = self._entries[pk][0]
+                    if query in key and not key.startswith(query):
+                        matches.append((key, pk))
+                matches.sort()
+                results.extend(self._entries[pk][1]
+                               for _, pk in matches[:limit - len(results)])
+        return results
+
+    def update(self, ingredient, version=None):
+        with self._lock:
+            if self._follows(version):
+                self._remove(ingredient.pk)
+                self._add(ingredient)
+
+    def remove(self, pk, version=None):
+        with self._lock:
+            if self._follows(version):
+                self._remove(pk)
+
+    def invalidate(self):
+        with self._lock:
+            self._reset()
+
+    def _follows(self, version):
+        if self._entries is None:
+            return False
+        if version is not None and self._version is not None:
+            if version == self._version + 1:
+                self._version = version
+                return True
+        elif version is None and self._version is None:
+            return True
+        self._reset()
+        return False
+
+    def _reset(self):
+        self._entries = None
+        self._keys = []
+        self._ngrams = {}
+
+    def _ensure_built(self):
+        if self._entries is not None:
+            return
+        self._entries = {}
+        for ingredient in Ingredient.objects.only(
+                'id', 'name', 'measurement_unit').iterator():
+            key = normalize(ingredient.name)
+            self._entries[ingredient.pk] = (key, self._as_data(ingredient))
+            self._keys.append((key, ingredient.pk))
+            for ngram in ngrams(key):
+                self._ngrams.setdefault(ngram, set()).add(ingredient.pk)
+        self._keys.sort()
+
+    def _prefix_ids(self, query, limit):
+        ids = []
+        index = bisect.bisect_left(self._keys, (query,))
+        while index < len(self._keys) and len(ids) < limit:
+            key, pk = self._keys[index]
+            if not key.startswith(query):
+                break
+            ids.append(pk)
+            index += 1
+        return ids
+
+    def _candidate_ids(self, query):
+        if len(query) < NGRAM_SIZE:
+            return self._entries.keys()
+        candidates = None
+        for ngram in ngrams(query):
+            ids = self._ngrams.get(ngram)
+            if not ids:
+                return set()
+            candidates = set(ids) if candidates is None else candidates & ids
+        return candidates
+
+    def _add(self, ingredient):
+        key = normalize(ingredient.name)
+        self._entries[ingredient.pk] = (key, self._as_data(ingredient))
+        bisect.insort(self._keys, (key, ingredient.pk))
+        for ngram in ngrams(key):
+            self._ngrams.setdefault(ngram, set()).add(ingredient.pk)
+
+    def _remove(self, pk):
+        entry = self._entries.pop(pk, None)
+        if entry is None:
+            return
+        key = entry[0]
+        index = bisect.bisect_left(self._keys, (key, pk))
+        if index < len(self._keys) and self._keys[index] == (key, pk):
+            del self._keys[index]
+        for ngram in ngrams(key):
+            ids = self._ngrams.get(ngram)
+            if ids is not None:
+                ids.discard(pk)
+                if not ids:
+                    del self._ngrams[ngram]
+
+    @staticmethod
+    def _as_data(ingredient):
+        return {
+            'id': ingredient.pk,
+            'name': ingredient.name,
+            'measurement_unit': ingredient.measurement_unit,
+        }
+
+
+ingredient_index = IngredientIndex()
@@ -0,0 +1,190 @@
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.db.models.constants import OnConflict
+
+
+class Relation:
+    """A unique (user, target) link such as a favorite or a subscription.
+
+    add() and remove() check that the target exists and write the link in
+    a single statement on PostgreSQL. Other backends need a second query
+    for the target when nothing was written or its fields are needed.
+    Duplicates are handled by the unique constraint, so concurrent
+    requests from the same user cannot create two links.
+    """
+
+    def __init__(self, model, target_field, target_fields=()):
+        self.model = model
+        self.user_field = model._meta.get_field('user')
+        self.target_field = model._meta.get_field(target_field)
+        self.target_model = self.target_field.related_model
+        pk = self.target_model._meta.pk
+        self.target_fields = [pk] + [
+            self.target_model._meta.get_field(name)
+            for name in target_fields if name != pk.name]
+
+    def add(self, user, target_id):
+        """Links the target to the user.
+
+        Returns (target, created); target is None when it does not exist
+        and otherwise an unsaved instance with target_fields loaded.
+        """
+        target_id = self._to_python(target_id)
+        if target_id is None:
+            return None, False
+        if connection.vendor == 'postgresql':
+            return self._add_returning(user, target_id)
+        with connection.cursor() as cursor:
+            cursor.execute(self._format(
+                '{insert} {table} ({user_column}, {target_column}) '
+                'SELECT %s, {target_pk} FROM {target_table} '
+                'WHERE {target_pk} = %s {on_conflict}'),
+                [user.pk, target_id])
+            created = cursor.rowcount == 1
+        if created and len(self.target_fields) == 1:
+            return self.target_model(pk=target_id), True
+        return self._get_target(target_id), created
+
+    def remove(self, user, target_id):
+        """Unlinks the target from the user.
+
+        Returns (exists, deleted) where exists tells whether the target
+        itself exists.
+        """
+        target_id = self._to_python(target_id)
+        if target_id is None:
+            return False, False
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute(self._format(
+                    'WITH target AS ('
+                    'SELECT {target_pk} FROM {target_table} '
+                    'WHERE {target_pk} = %s'
+                    '), deleted AS ('
+                    'DELETE FROM {table} WHERE {user_column} = %s '
+                    'AND {target_column} IN (SELECT {target_pk} FROM target) '
+                    'RETURNING 1'
+                    ') SELECT EXISTS (SELECT 1 FROM deleted) FROM target'),
+                    [target_id, user.pk])
+                row = cursor.fetchone()
+            return row is not None, bool(row and row[0])
+        deleted, _ = self.model.objects.filter(**{
+            self.user_field.name: user,
+            self.target_field.attname: target_id,
+        }).delete()
+        if deleted:
+            return True, True
+        return self.target_model.objects.filter(pk=target_id).exists(), False
+
+    def add_many(self, user, target_ids):
+        """Links all existing targets from target_ids to the user.
+
+        Returns the ids of the targets that were linked by this call.
+        """
+        if not target_ids:
+            return []
+        if self._can_return():
+            with connection.cursor() as cursor:
+                cursor.execute(self._format(
+                    '{insert} {table} ({user_column}, {target_column}) '
+                    'SELECT %s, {target_pk} FROM {target_table} '
+                    'WHERE {target_pk} IN ({placeholders}) {on_conflict} '
+                    'RETURNING {target_column}', len(target_ids)),
+                    [user.pk, *target_ids])
+                return [row[0] for row in cursor.fetchall()]
+        found = set(self.target_model.objects.filter(
+            pk__in=target_ids).values_list('pk', flat=True))
+        found -= set(self._links(user, target_ids).values_list(
+            self.target_field.attname, flat=True))
+        self.model.objects.bulk_create(
+            [self.model(**{self.user_field.name: user,
+                           self.target_field.attname: target_id})
+             for target_id in found],
+            ignore_conflicts=True)
+        return list(found)
+
+    def remove_many(self, user, target_ids=None):
+        """Unlinks the targets from the user, or all of them when None.
+
+        Returns the ids of the targets that were unlinked by this call.
+        """
+        if target_ids is not None and not target_ids:
+            return []
+        if self._can_return():
+            sql = 'DELETE FROM {table} WHERE {user_column} = %s'
+            if target_ids is not None:
+                sql += ' AND {target_column} IN ({placeholders})'
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    self._format(sql + ' RETURNING {target_column}',
+                                 len(target_ids or ())),
+                    [user.pk, *(target_ids or ())])
+                return [row[0] for row in cursor.fetchall()]
+        links = self._links(user, target_ids)
+        removed = list(links.values_list(
+            self.target_field.attname, flat=True))
+        links.delete()
+        return removed
+
+    def _links(self, user, target_ids=None):
+        links = self.model.objects.filter(**{self.user_field.name: user})
+        if target_ids is not None:
+            links = links.filter(**{
+                f'{self.target_field.attname}__in': target_ids})
+        return links
+
+    @staticmethod
+    def _can_return():
+        return (connection.vendor in ('postgresql', 'sqlite')
+                and connection.features.can_return_columns_from_insert)
+
+    def _add_returning(self, user, target_id):
+        with connection.cursor() as cursor:
+            cursor.execute(self._format(
+                'WITH target AS ('
+                'SELECT {target_columns} FROM {target_table} '
+                'WHERE {target_pk} = %s'
+                '), inserted AS ('
+                'INSERT INTO {table} ({user_column}, {target_column}) '
+                'SELECT %s, {target_pk} FROM target '
+                'ON CONFLICT DO NOTHING RETURNING 1'
+                ') SELECT {target_columns}, '
+                'EXISTS (SELECT 1 FROM inserted) FROM target'),
+                [target_id, user.pk])
+            row = cursor.fetchone()
+        if row is None:
+            return None, False
+        return self._build_target(row[:-1]), row[-1]
+
+    def _get_target(self, target_id):
+        row = self.target_model.objects.filter(pk=target_id).values_list(
+            *(field.attname for field in self.target_fields)).first()
+        return self._build_target(row) if row is not None else None
+
+    def _build_target(self, row):
+        return self.target_model(**{
+            field.attname: value
+            for field, value in zip(self.target_fields, row)})
+
+    def _to_python(self, target_id):
+        try:
+            return self.target_model._meta.pk.to_python(target_id)
+        except ValidationError:
+            return None
+
+    def _format(self, sql, params_count=0):
+        quote = connection.ops.quote_name
+        return sql.format(
+            insert=connection.ops.insert_statement(
+                on_conflict=OnConflict.IGNORE),
+            on_conflict=connection.ops.on_conflict_suffix_sql(
+                [], OnConflict.IGNORE, [], []) or '',
+            table=quote(self.model._meta.db_table),
+            user_column=quote(self.user_field.column),
+            target_column=quote(self.target_field.column),
+            target_table=quote(self.target_model._meta.db_table),
+            target_pk=quote(self.target_model._meta.pk.column),
+            target_columns=', '.join(
+                quote(field.column) for field in self.target_fields),
+            placeholders=', '.join(['%s'] * params_count),
+        )
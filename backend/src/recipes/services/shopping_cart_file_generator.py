@@ -1,38 +1,94 @@
 import csv
-import io
+import json
+
+
+class Echo:
+    def write(self, value):
+        return value
 
 
 class FileGenerator:
-    def generate(self, content):
+    extension = None
+    content_type = None
+    filename = 'shopping_cart'
+
+    def generate(self, ingredients):
+        return (self.stream(ingredients),
+                f'{self.filename}.{self.extension}',
+                self.content_type)
+
+    def stream(self, ingredients):
+        for chunk in self.iter_chunks(ingredients):
+            yield chunk.encode('utf-8')
+
+    def iter_chunks(self, ingredients):
         raise NotImplementedError()
 
 
 class TextFileGenerator(FileGenerator):
-    def generate(self, ingredients):
-        content = 'Список покупок:\n\n'
-        for name, data in ingredients.items():
-            content += (f'{name} - {data["amount"]} '
-                        f'{data["measurement_unit"]}\n')
-        return (content.encode("utf-8"),
-                'shopping_cart.txt',
-                'text/plain; charset=utf-8')
+    extension = 'txt'
+    content_type = 'text/plain; charset=utf-8'
+
+    def iter_chunks(self, ingredients):
+        yield 'Список покупок:\n\n'
+        for ingredient in ingredients:
+            yield (f'{ingredient["name"]} - {ingredient["amount"]} '
+                   f'{ingredient["measurement_unit"]}\n')
 
 
 class CsvFileGenerator(FileGenerator):
-    def generate(self, ingredients):
-        output = io.StringIO()
-        writer = csv.writer(output)
-        writer.writerow(['Ингредиент', 'Количество', 'Единица измерения'])
-        for name, data in ingredients.items():
-            writer.writerow([name, data["amount"], data["measurement_unit"]])
-        return (output.getvalue().encode('utf-8'),
-                'shopping_cart.csv',
-                'text/csv, charset=utf-8')
+    extension = 'csv'
+    content_type = 'text/csv; charset=utf-8'
+
+    def iter_chunks(self, ingredients):
+        writer = csv.writer(Echo())
+        yield writer.writerow(
+            ['Ингредиент', 'Количество', 'Единица измерения'])
+        for ingredient in ingredients:
+            yield writer.writerow([ingredient['name'],
+                                   ingredient['amount'],
+                                   ingredient['measurement_unit']])
+
+
+class JsonFileGenerator(FileGenerator):
+    extension = 'json'
+    content_type = 'application/json'
+
+    def iter_chunks(self, ingredients):
+        separator = '['
+        for ingredient in ingredients:
+            yield separator + json.dumps(
+                {'name': ingredient['name'],
+                 'amount': ingredient['amount'],
+                 'measurement_unit': ingredient['measurement_unit']},
+                ensure_ascii=False)
+            separator = ','
+        yield ']' if separator == ',' else '[]'
+
+
+class MarkdownFileGenerator(FileGenerator):
+    extension = 'md'
+    content_type = 'text/markdown; charset=utf-8'
+
+    def iter_chunks(self, ingredients):
+        yield '# Список покупок\n\n'
+        for ingredient in ingredients:
+            yield (f'- [ ] {self.escape(ingredient["name"])} — '
+                   f'{ingredient["amount"]} '
+                   f'{self.escape(ingredient["measurement_unit"])}\n')
+
+    @staticmethod
+    def escape(value):
+        for char in '\\`*_[]<>#':
+            value = value.replace(char, f'\\{char}')
+        return value
 
 
 GENERATORS = {
     'txt': TextFileGenerator(),
     'csv': CsvFileGenerator(),
+    'json': JsonFileGenerator(),
+    'md': MarkdownFileGenerator(),
 }
 
 
@@ -43,3 +99,7 @@ class FileGeneratorFactory:
         if generator is None:
             raise ValueError(f'Unknown format: {format}')
         return generator
+
+    @staticmethod
+    def get_formats():
+        return list(GENERATORS)
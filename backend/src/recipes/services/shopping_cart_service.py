@@ -1,23 +1,195 @@
+from collections import Counter
+from contextlib import contextmanager
+
+from django.db import IntegrityError, transaction
 from django.db.models import Sum
 
-from recipes.models import RecipeIngredient
+from recipes.models import (Recipe, RecipeIngredient, ShoppingCart,
+                            ShoppingListItem)
 
 
 class ShoppingCartService:
     @staticmethod
-    def get_ingredients(shopping_cart):
+    def iter_ingredients(user, chunk_size=2000):
+        items = (
+            ShoppingListItem.objects
+            .filter(user=user)
+            .values('ingredient__name', 'ingredient__measurement_unit',
+                    'amount')
+            .order_by('ingredient__name', 'ingredient__measurement_unit')
+        )
+
+        for item in items.iterator(chunk_size=chunk_size):
+            yield {
+                'name': item['ingredient__name'],
+                'amount': item['amount'],
+                'measurement_unit': item['ingredient__measurement_unit']
+            }
+
+    @staticmethod
+    def get_ingredients(user):
         ingredients = {}
-        recipe_ids = shopping_cart.values_list('recipe_id', flat=True)
-        recipe_ingredients = (
+        for ingredient in ShoppingCartService.iter_ingredients(user):
+            ingredients[ingredient['name']] = {
+                'amount': ingredient['amount'],
+                'measurement_unit': ingredient['measurement_unit']
+            }
+        return ingredients
+
+    @staticmethod
+    def add_recipes(user, recipe_ids):
+        ShoppingCartService._apply_recipes(user, recipe_ids, 1)
+
+    @staticmethod
+    def remove_recipes(user, recipe_ids):
+        ShoppingCartService._apply_recipes(user, recipe_ids, -1)
+
+    @staticmethod
+    def clear(user):
+        ShoppingListItem.objects.filter(user=user).delete()
+
+    @staticmethod
+    def lock_recipes(recipe_ids):
+        """Serializes cart changes with edits of the recipes' ingredients.
+
+        Must be called before the ingredients are read.
+        """
+        list(Recipe.objects.select_for_update().filter(
+            pk__in=recipe_ids).order_by('pk').values_list('pk', flat=True))
+
+    @staticmethod
+    @contextmanager
+    def tracking_recipe_ingredients(recipe_ids):
+        """Applies any ingredient changes made inside the block to carts."""
+        recipe_ids = sorted(set(recipe_ids))
+        with transaction.atomic():
+            ShoppingCartService.lock_recipes(recipe_ids)
+            old_amounts = {
+                recipe_id: ShoppingCartService.get_recipe_amounts(recipe_id)
+                for recipe_id in recipe_ids
+            }
+            yield
+            for recipe_id in recipe_ids:
+                ShoppingCartService.change_recipe_ingredients(
+                    recipe_id, old_amounts[recipe_id],
+                    ShoppingCartService.get_recipe_amounts(recipe_id))
+
+    @staticmethod
+    def change_recipe_ingredients(recipe, old_amounts, new_amounts):
+        changes = Counter(new_amounts)
+        changes.subtract(old_amounts)
+        changes = {pk: delta for pk, delta in changes.items() if delta}
+        if not changes:
+            return
+        user_ids = ShoppingCart.objects.filter(
+            recipe=recipe).values_list('user_id', flat=True)
+        ShoppingCartService._apply_deltas({
+            (user_id, ingredient_id): delta
+            for user_id in user_ids
+            for ingredient_id, delta in changes.items()
+        })
+
+    @staticmethod
+    def remove_recipe_from_carts(recipe):
+        ShoppingCartService.lock_recipes([recipe.pk])
+        amounts = ShoppingCartService.get_recipe_amounts(recipe)
+        ShoppingCartService.change_recipe_ingredients(recipe, amounts, {})
+
+    @staticmethod
+    def get_recipe_amounts(recipe):
+        return dict(
             RecipeIngredient.objects
-            .filter(recipe_id__in=recipe_ids)
-            .values('ingredient__name', 'ingredient__measurement_unit')
+            .filter(recipe=recipe)
+            .values_list('ingredient_id', 'amount')
+        )
+
+    @staticmethod
+    def get_expected_totals(user_ids=None):
+        if user_ids is None:
+            lookup = {'recipe__in_cart__isnull': False}
+        else:
+            lookup = {'recipe__in_cart__user_id__in': user_ids}
+        totals = (
+            RecipeIngredient.objects
+            .filter(**lookup)
+            .values_list('recipe__in_cart__user_id', 'ingredient_id')
             .annotate(total_amount=Sum('amount'))
+            .order_by()
         )
+        return {(user_id, ingredient_id): amount
+                for user_id, ingredient_id, amount in totals}
 
-        for ingredient in recipe_ingredients:
-            ingredients[ingredient['ingredient__name']] = {
-                'amount': ingredient['total_amount'],
-                'measurement_unit': ingredient['ingredient__measurement_unit']
-            }
-        return ingredients
+    @staticmethod
+    def get_stored_totals(user_ids=None):
+        items = ShoppingListItem.objects.all()
+        if user_ids is not None:
+            items = items.filter(user_id__in=user_ids)
+        return {(user_id, ingredient_id): amount
+                for user_id, ingredient_id, amount
+                in items.values_list('user_id', 'ingredient_id', 'amount')}
+
+    @staticmethod
+    @transaction.atomic
+    def rebuild(user_ids):
+        expected = ShoppingCartService.get_expected_totals(user_ids)
+        ShoppingListItem.objects.filter(user_id__in=user_ids).delete()
+        ShoppingListItem.objects.bulk_create(
+            ShoppingListItem(user_id=user_id, ingredient_id=ingredient_id,
+                             amount=amount)
+            for (user_id, ingredient_id), amount in expected.items()
+        )
+        return len(expected)
+
+    @staticmethod
+    @transaction.atomic(savepoint=False)
+    def _apply_recipes(user, recipe_ids, sign):
+        ShoppingCartService.lock_recipes(recipe_ids)
+        amounts = Counter()
+        recipe_ingredients = RecipeIngredient.objects.filter(
+            recipe_id__in=recipe_ids).values_list('ingredient_id', 'amount')
+        for ingredient_id, amount in recipe_ingredients:
+            amounts[(user.pk, ingredient_id)] += sign * amount
+        ShoppingCartService._apply_deltas(amounts)
+
+    @staticmethod
+    def _apply_deltas(deltas, retries=1):
+        deltas = {key: delta for key, delta in deltas.items() if delta}
+        if not deltas:
+            return
+        try:
+            with transaction.atomic():
+                ShoppingCartService._write_deltas(deltas)
+        except IntegrityError:
+            if not retries:
+                raise
+            ShoppingCartService._apply_deltas(deltas, retries - 1)
+
+    @staticmethod
+    def _write_deltas(deltas):
+        user_ids = {user_id for user_id, _ in deltas}
+        ingredient_ids = {ingredient_id for _, ingredient_id in deltas}
+        items = {
+            (item.user_id, item.ingredient_id): item
+            for item in ShoppingListItem.objects.select_for_update().filter(
+                user_id__in=user_ids, ingredient_id__in=ingredient_ids)
+        }
+        to_create, to_update, to_delete = [], [], []
+        for (user_id, ingredient_id), delta in deltas.items():
+            item = items.get((user_id, ingredient_id))
+            if item is None:
+                if delta > 0:
+                    to_create.append(ShoppingListItem(
+                        user_id=user_id, ingredient_id=ingredient_id,
+                        amount=delta))
+                continue
+            item.amount += delta
+            if item.amount > 0:
+                to_update.append(item)
+            else:
+                to_delete.append(item.pk)
+        if to_create:
+            ShoppingListItem.objects.bulk_create(to_create)
+        if to_update:
+            ShoppingListItem.objects.bulk_update(to_update, ['amount'])
+        if to_delete:
+            ShoppingListItem.objects.filter(pk__in=to_delete).delete()
@@ -0,0 +1,59 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Ingredient, Recipe, Tag
+from .services.catalog_cache import ingredient_catalog, tag_catalog
+from .services.ingredient_search import ingredient_index
+from .services.shopping_cart_service import ShoppingCartService
+
+# User fields embedded into recipes as the author.
+AUTHOR_FIELDS = frozenset(('email', 'username', 'first_name', 'last_name'))
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def invalidate_tag_catalog(sender, **kwargs):
+    transaction.on_commit(tag_catalog.invalidate)
+
+
+@receiver(post_save, sender=Ingredient)
+def update_ingredient_catalog(sender, instance, **kwargs):
+    def update():
+        version = ingredient_catalog.invalidate()
+        ingredient_index.update(instance, version)
+
+    transaction.on_commit(update)
+
+
+@receiver(post_delete, sender=Ingredient)
+def remove_from_ingredient_catalog(sender, instance, **kwargs):
+    pk = instance.pk
+
+    def remove():
+        version = ingredient_catalog.invalidate()
+        ingredient_index.remove(pk, version)
+
+    transaction.on_commit(remove)
+
+
+@receiver(pre_delete, sender=Recipe)
+def remove_recipe_from_shopping_lists(sender, instance, **kwargs):
+    """Subtracts the recipe from the lists of users who have it in cart.
+
+    Runs for every delete path, including the admin and cascades from a
+    deleted author, while the cart rows still exist.
+    """
+    ShoppingCartService.remove_recipe_from_carts(instance)
+
+
+@receiver(post_save, sender=get_user_model())
+def touch_author_recipes(sender, instance, created, update_fields=None,
+                         **kwargs):
+    """Changes the validators of recipes that embed the saved author."""
+    if created or (update_fields is not None
+                   and AUTHOR_FIELDS.isdisjoint(update_fields)):
+        return
+    Recipe.objects.filter(author=instance).update(updated_at=timezone.now())
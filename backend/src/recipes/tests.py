@@ -1,10 +1,21 @@
+import base64
+import io
+import json
 import os
 import shutil
 import tempfile
+from unittest import mock
 from urllib.parse import urlencode, urlparse
 
 from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, connection
 from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from PIL import Image
 from rest_framework.authtoken.models import Token
@@ -12,9 +23,11 @@ from rest_framework.test import APIClient, APIRequestFactory, APITestCase
 from rest_framework.views import status
 
 from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
-                            ShoppingCart, Tag)
-from recipes.serializers import (IngredientSerializer, RecipeRetriveSerializer,
-                                 TagSerializer)
+                            ShoppingCart, ShoppingListItem, Tag)
+from recipes.serializers import (IngredientSerializer,
+                                 RecipeCreateUpdateSerializer,
+                                 RecipeRetriveSerializer, TagSerializer)
+from recipes.services.shopping_cart_service import ShoppingCartService
 from users.models import User
 
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
@@ -37,6 +50,7 @@ class TagTest(APITestCase):
     def setUp(self):
         self.tag1 = self.create_tag("tag1", "#123456", "tag1")
         self.tag2 = self.create_tag("tag2", "#654321", "tag2")
+        cache.clear()
 
     def test_get_all_tags(self):
         response = self.client.get(
@@ -47,6 +61,28 @@ class TagTest(APITestCase):
         self.assertEqual(response.data, serialized.data)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
+    def test_get_all_tags_not_modified(self):
+        response = self.client.get(reverse("recipes:tag-list"))
+        etag = response['ETag']
+
+        response = self.client.get(
+            reverse("recipes:tag-list"), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_get_all_tags_invalidated_on_save(self):
+        response = self.client.get(reverse("recipes:tag-list"))
+        etag = response['ETag']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_tag("tag3", "#000000", "tag3")
+        response = self.client.get(
+            reverse("recipes:tag-list"), HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(len(response.json()), 3)
+
     def test_get_single_tag(self):
         response = self.client.get(
             reverse("recipes:tag-detail",
@@ -72,6 +108,7 @@ class IngredientTest(APITestCase):
     def setUp(self):
         self.ingredient1 = self.create_ingredient("ingredient1", "kg")
         self.ingredient2 = self.create_ingredient("ingredient2", "g")
+        cache.clear()
 
     def test_get_all_ingredients(self):
         response = self.client.get(
@@ -106,6 +143,51 @@ class IngredientTest(APITestCase):
         self.assertEqual(response.data, serialized.data)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
+    def test_search_ingredients_ranks_prefix_matches_first(self):
+        self.create_ingredient("сыр моцарелла", "г")
+        self.create_ingredient("плавленый сыр", "г")
+        self.create_ingredient("сырники", "шт.")
+        cache.clear()
+
+        response = self.client.get(
+            reverse("recipes:ingredient-list"), {'name': 'Сыр'})
+
+        self.assertEqual(
+            [item['name'] for item in response.data],
+            ["сыр моцарелла", "сырники", "плавленый сыр"])
+
+    def test_search_ingredients_with_limit(self):
+        response = self.client.get(
+            reverse("recipes:ingredient-list"),
+            {'name': 'ingredient', 'limit': 1})
+        self.assertEqual(len(response.data), 1)
+
+    def test_search_ingredients_normalizes_yo(self):
+        ingredient = self.create_ingredient("Ёрш", "шт.")
+        cache.clear()
+
+        response = self.client.get(
+            reverse("recipes:ingredient-list"), {'name': 'ерш'})
+
+        self.assertEqual([item['id'] for item in response.data],
+                         [ingredient.id])
+
+    def test_search_index_is_updated_on_save_and_delete(self):
+        self.client.get(reverse("recipes:ingredient-list"), {'name': 'x'})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ingredient = self.create_ingredient("новый ингредиент", "г")
+        response = self.client.get(
+            reverse("recipes:ingredient-list"), {'name': 'новый'})
+        self.assertEqual([item['id'] for item in response.data],
+                         [ingredient.id])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ingredient.delete()
+        response = self.client.get(
+            reverse("recipes:ingredient-list"), {'name': 'новый'})
+        self.assertEqual(response.data, [])
+
 
 @override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
 class RecipeListViewTests(APITestCase):
@@ -171,6 +253,7 @@ class RecipeListViewTests(APITestCase):
     def setUp(self):
         self.authorized_client = self._create_authorized_client()
         self.unauthorized_client = APIClient()
+        cache.clear()
 
     def _test_get_recipes_list(self, params=None, recipes_slice=slice(None)):
         self._create_test_recipes()
@@ -191,6 +274,38 @@ class RecipeListViewTests(APITestCase):
     def test_get_recipes_list_with_pagination(self):
         self._test_get_recipes_list({"limit": 5, "page": 2}, slice(5, 10))
 
+    def _collect_cursor_pages(self, params):
+        ids = []
+        url = reverse('recipes:recipe-list')
+        params = {'cursor': '', **params}
+        while url:
+            with CaptureQueriesContext(connection) as context:
+                response = self.unauthorized_client.get(url, params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn('count', response.data)
+            for query in context.captured_queries:
+                self.assertNotIn('COUNT(', query['sql'].upper())
+            ids.extend(item['id'] for item in response.data['results'])
+            url, params = response.data['next'], None
+        return ids
+
+    def test_get_recipes_list_with_cursor_pagination(self):
+        self._create_test_recipes(10)
+        ids = self._collect_cursor_pages({'limit': 4})
+        expected = list(Recipe.objects.order_by(
+            '-created_at', '-id').values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+
+    def test_get_recipes_list_with_cursor_pagination_and_tag_filter(self):
+        self._create_test_recipes(5)
+        other_tag = Tag.objects.create(
+            name="lunch", color="#E16B8C", slug="lunch")
+        tagged = Recipe.objects.order_by('-created_at', '-id')[:3]
+        for recipe in tagged:
+            recipe.tags.add(other_tag)
+        ids = self._collect_cursor_pages({'limit': 2, 'tags': 'lunch'})
+        self.assertEqual(ids, [recipe.id for recipe in tagged])
+
     def assert_response_matches_serializer(
             self, response_item, serializer_item):
         for key in response_item.keys():
@@ -245,6 +360,33 @@ class RecipeListViewTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assert_list_response_matches_serializer(response, serializer)
 
+    def test_get_recipes_list_user_flags(self):
+        self._create_test_recipes(2)
+        Favorite.objects.create(user=self.test_user, recipe=self.recipe)
+        ShoppingCart.objects.create(user=self.test_user, recipe=self.recipe)
+
+        response = self.authorized_client.get(
+            reverse('recipes:recipe-list'), {"limit": 10})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        for item in response.data['results']:
+            expected = item['id'] == self.recipe.id
+            self.assertEqual(item['is_favorited'], expected)
+            self.assertEqual(item['is_in_shopping_cart'], expected)
+
+    def _count_list_queries(self, client, limit):
+        with CaptureQueriesContext(connection) as context:
+            response = client.get(
+                reverse('recipes:recipe-list'), {"limit": limit})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(context.captured_queries)
+
+    def test_get_recipes_list_query_count_does_not_depend_on_limit(self):
+        self._create_test_recipes(10)
+        self.assertEqual(
+            self._count_list_queries(self.unauthorized_client, 2),
+            self._count_list_queries(self.unauthorized_client, 10))
+
     def test_get_recipes_list_with_multiple_tags_filter(self):
         tag1 = Tag.objects.create(name="lunch", color="#E16B8C", slug="lunch")
         tag2 = Tag.objects.create(
@@ -262,6 +404,30 @@ class RecipeListViewTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assert_list_response_matches_serializer(response, serializer)
 
+    def test_tag_filter_uses_semi_join_on_tag_ids(self):
+        other = self._create_test_recipe('other')
+        other.tags.add(Tag.objects.create(
+            name="lunch", color="#E16B8C", slug="lunch"))
+        url = reverse('recipes:recipe-list')
+        self.unauthorized_client.get(url, {'tags': 'breakfast'})
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.unauthorized_client.get(
+                f'{url}?tags=breakfast&tags=lunch')
+        self.assertEqual(
+            {recipe['id'] for recipe in response.data['results']},
+            {self.recipe.id, other.id})
+        self.assertEqual(response.data['count'], 2)
+        recipe_queries = [query['sql'] for query in context.captured_queries
+                          if 'FROM "recipes_recipe"' in query['sql']]
+        self.assertTrue(recipe_queries)
+        for sql in recipe_queries:
+            self.assertNotIn('DISTINCT', sql)
+            self.assertNotIn('JOIN "recipes_tag"', sql)
+
+        response = self.unauthorized_client.get(url, {'tags': 'missing'})
+        self.assertEqual(response.data['results'], [])
+
     def test_get_recipe_by_id(self):
         response = self.unauthorized_client.get(
             reverse('recipes:recipe-detail',
@@ -271,6 +437,65 @@ class RecipeListViewTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assert_response_matches_serializer(response.data, serializer.data)
 
+    def test_get_recipes_list_not_modified(self):
+        url = reverse('recipes:recipe-list')
+        etag = self.authorized_client.get(url)['ETag']
+
+        response = self.authorized_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+        self.assertIn('Authorization', response['Vary'])
+
+        Favorite.objects.create(user=self.test_user, recipe=self.recipe)
+        response = self.authorized_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_get_recipes_list_etag_depends_on_filters(self):
+        url = reverse('recipes:recipe-list')
+        etag = self.unauthorized_client.get(url)['ETag']
+        response = self.unauthorized_client.get(
+            url, {'author': self.test_user.id}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_get_recipe_by_id_not_modified(self):
+        url = reverse('recipes:recipe-detail', kwargs={'pk': self.recipe.id})
+        response = self.unauthorized_client.get(url)
+
+        not_modified = self.unauthorized_client.get(
+            url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(not_modified.status_code,
+                         status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(not_modified['ETag'], response['ETag'])
+        self.assertEqual(not_modified['Last-Modified'],
+                         response['Last-Modified'])
+
+        self.recipe.save()
+        modified = self.unauthorized_client.get(
+            url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(modified.status_code, status.HTTP_200_OK)
+
+    def test_get_recipe_by_non_numeric_id(self):
+        response = self.unauthorized_client.get(
+            reverse('recipes:recipe-detail', kwargs={'pk': 'abc'}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_etags_change_with_author_profile(self):
+        urls = (
+            reverse('recipes:recipe-list'),
+            reverse('recipes:recipe-detail', kwargs={'pk': self.recipe.id}))
+        etags = [self.authorized_client.get(url)['ETag'] for url in urls]
+
+        self.authorized_client.patch(
+            reverse('users:user-detail', kwargs={'pk': self.test_user.id}),
+            {'first_name': 'Renamed'}, format='json')
+
+        for url, etag in zip(urls, etags):
+            response = self.authorized_client.get(
+                url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['author']['first_name'], 'Renamed')
+
     def test_create_recipe(self):
         recipe_data = {
             'name': 'Recipe1',
@@ -305,6 +530,299 @@ class RecipeListViewTests(APITestCase):
 
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_create_recipe_returns_ingredient_amounts(self):
+        recipe_data = {
+            'name': 'Recipe1',
+            'text': 'Some text',
+            'cooking_time': 10,
+            'tags': [self.tag.id],
+            'ingredients': [{'id': self.ingredient.id, 'amount': 2}],
+            'image': f'data:image/png;base64, {TEST_BASE64_IMAGE}'
+        }
+
+        response = self.authorized_client.post(
+            reverse('recipes:recipe-list'),
+            data=recipe_data,
+            format='json'
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['tags'][0]['slug'], self.tag.slug)
+        self.assertEqual(response.data['ingredients'][0]['amount'], 2)
+
+    def _create_recipe_with_image(self, image_data):
+        recipe_data = {
+            'name': 'Recipe1',
+            'text': 'Some text',
+            'cooking_time': 10,
+            'tags': [self.tag.id],
+            'ingredients': [{'id': self.ingredient.id, 'amount': 2}],
+            'image': image_data
+        }
+        return self.authorized_client.post(
+            reverse('recipes:recipe-list'), data=recipe_data, format='json')
+
+    @staticmethod
+    def _create_jpeg_data_uri(size=(1200, 900)):
+        exif = Image.Exif()
+        exif[0x010e] = 'camera description'
+        buffer = io.BytesIO()
+        Image.new('RGB', size, (200, 100, 50)).save(
+            buffer, format='JPEG', exif=exif)
+        encoded = base64.b64encode(buffer.getvalue()).decode()
+        return f'data:image/jpeg;base64,{encoded}'
+
+    def _process_images(self, callbacks):
+        with override_settings(IMAGE_PROCESSING=dict(
+                settings.IMAGE_PROCESSING, ASYNC=False)):
+            for callback in callbacks:
+                callback()
+
+    def test_create_recipe_stores_image_variants(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self._create_recipe_with_image(
+                self._create_jpeg_data_uri())
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['image_status'], 'pending')
+        self.assertTrue(response.data['image'].endswith(
+            settings.IMAGE_PROCESSING['PLACEHOLDER']))
+        self.assertIsNone(response.data['image_variants'])
+        upload_name = Recipe.objects.get(pk=response.data['id']).image_upload
+        self.assertFalse(default_storage.exists(upload_name))
+
+        self._process_images(callbacks)
+
+        recipe = Recipe.objects.get(pk=response.data['id'])
+        self.assertEqual(recipe.image_status, Recipe.ImageStatus.READY)
+        self.assertFalse(default_storage.exists(upload_name))
+        with default_storage.open(recipe.image.name) as image_file:
+            self.assertEqual(dict(Image.open(image_file).getexif()), {})
+        response = self.client.get(
+            reverse('recipes:recipe-detail', args=[recipe.id]))
+        variants = response.data['image_variants']
+        self.assertEqual(set(variants), {'card', 'detail', 'retina'})
+        card_path = urlparse(variants['card']['webp']).path
+        with default_storage.open(
+                card_path[len(settings.MEDIA_URL):]) as card_file:
+            card = Image.open(card_file)
+            self.assertEqual((card.format, card.size), ('WEBP', (480, 360)))
+
+    def test_identical_image_uploads_are_deduplicated(self):
+        image_data = self._create_jpeg_data_uri()
+        with self.captureOnCommitCallbacks() as callbacks:
+            first = self._create_recipe_with_image(image_data)
+            second = self._create_recipe_with_image(image_data)
+        self._process_images(callbacks)
+
+        first, second = Recipe.objects.filter(
+            pk__in=[first.data['id'], second.data['id']])
+        self.assertEqual(first.image.name, second.image.name)
+
+    def test_update_keeps_image_until_processed(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self._create_recipe_with_image(
+                self._create_jpeg_data_uri())
+        self._process_images(callbacks)
+        url = reverse('recipes:recipe-detail', args=[response.data['id']])
+        old_image = self.client.get(url).data['image']
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.authorized_client.patch(url, data={
+                'tags': [self.tag.id],
+                'ingredients': [{'id': self.ingredient.id, 'amount': 2}],
+                'image': self._create_jpeg_data_uri((600, 600)),
+            }, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['image_status'], 'pending')
+        self.assertEqual(response.data['image'], old_image)
+        self._process_images(callbacks)
+        response = self.client.get(url)
+        self.assertEqual(response.data['image_status'], 'ready')
+        self.assertNotEqual(response.data['image'], old_image)
+
+    def test_image_processing_retries_and_recovers(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self._create_recipe_with_image(
+                self._create_jpeg_data_uri())
+        recipe = Recipe.objects.get(pk=response.data['id'])
+        save_upload, *process = callbacks
+        save_upload()
+        with default_storage.open(recipe.image_upload) as upload_file:
+            upload = upload_file.read()
+        default_storage.delete(recipe.image_upload)
+
+        with self.assertLogs('recipes.services.image_processing', 'WARNING'):
+            self._process_images(process)
+
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.image_status, Recipe.ImageStatus.FAILED)
+        self.assertEqual(recipe.image_attempts,
+                         settings.IMAGE_PROCESSING['MAX_ATTEMPTS'])
+        default_storage.save(recipe.image_upload, ContentFile(upload))
+        call_command('process_recipe_images', '--pending',
+                     stdout=io.StringIO())
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.image_status, Recipe.ImageStatus.READY)
+        self.assertEqual(recipe.image_upload, '')
+
+    def test_broken_image_fails_processing(self):
+        encoded = self._create_jpeg_data_uri().split(',')[1]
+        content = base64.b64decode(encoded)
+        truncated = base64.b64encode(content[:len(content) // 2]).decode()
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self._create_recipe_with_image(
+                f'data:image/jpeg;base64,{truncated}')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        self._process_images(callbacks)
+
+        recipe = Recipe.objects.get(pk=response.data['id'])
+        self.assertEqual(recipe.image_status, Recipe.ImageStatus.FAILED)
+        self.assertEqual(recipe.image_upload, '')
+
+    def test_create_recipe_with_multipart_image(self):
+        encoded = self._create_jpeg_data_uri().split(',')[1]
+        image = SimpleUploadedFile(
+            'photo.php', base64.b64decode(encoded), 'image/jpeg')
+        with self.captureOnCommitCallbacks():
+            response = self.authorized_client.post(
+                reverse('recipes:recipe-list'), data={
+                    'name': 'Recipe1',
+                    'text': 'Some text',
+                    'cooking_time': 10,
+                    'tags': [self.tag.id],
+                    'ingredients[0]id': self.ingredient.id,
+                    'ingredients[0]amount': 2,
+                    'image': image,
+                }, format='multipart')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['ingredients'][0]['amount'], 2)
+        recipe = Recipe.objects.get(pk=response.data['id'])
+        self.assertEqual(recipe.image_status, Recipe.ImageStatus.PENDING)
+        self.assertTrue(recipe.image_upload.endswith('.jpeg'))
+
+    def test_replace_image_with_raw_body(self):
+        recipe = Recipe.objects.get(pk=self._create_recipe_with_image(
+            self._create_jpeg_data_uri()).data['id'])
+        url = reverse('recipes:recipe-image', args=[recipe.id])
+        encoded = self._create_jpeg_data_uri((800, 600)).split(',')[1]
+        content = base64.b64decode(encoded)
+
+        response = self.client.post(
+            url, data=content, content_type='image/jpeg')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.authorized_client.post(
+                url, data=content, content_type='image/jpeg')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['image_status'], 'pending')
+        self._process_images(callbacks)
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.image_status, Recipe.ImageStatus.READY)
+        with default_storage.open(recipe.image.name) as image_file:
+            self.assertEqual(Image.open(image_file).size, (800, 600))
+
+        response = self.authorized_client.post(
+            url, data=b'not an image', content_type='image/jpeg')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_create_recipe_with_invalid_image(self):
+        encoded = base64.b64encode(b'not an image').decode()
+        response = self._create_recipe_with_image(
+            f'data:image/png;base64,{encoded}')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('image', response.data)
+
+    def _bulk_create(self, items, commit=None):
+        url = reverse('recipes:recipe-bulk-create')
+        if commit:
+            url = f'{url}?{urlencode({"commit": commit})}'
+        return self.authorized_client.post(url, data=items, format='json')
+
+    def _get_bulk_items(self):
+        return [{
+            'name': f'Bulk recipe {i}',
+            'text': 'Some text',
+            'cooking_time': 10,
+            'tags': [self.tag.id],
+            'ingredients': [{'id': self.ingredient.id, 'amount': i + 1}],
+            'image': f'data:image/png;base64,{TEST_BASE64_IMAGE}'
+        } for i in range(3)]
+
+    def test_bulk_create_recipes(self):
+        response = self._bulk_create(self._get_bulk_items())
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        recipes = Recipe.objects.filter(
+            pk__in=[item['id'] for item in response.data])
+        self.assertEqual(
+            sorted(recipes.values_list('name', 'recipeingredient__amount')),
+            [('Bulk recipe 0', 1), ('Bulk recipe 1', 2),
+             ('Bulk recipe 2', 3)])
+        self.assertTrue(all(recipe.author == self.test_user
+                            for recipe in recipes))
+
+    def test_bulk_create_batch_is_all_or_nothing(self):
+        items = self._get_bulk_items()
+        items[1]['tags'] = [999]
+        recipe_count = Recipe.objects.count()
+
+        response = self._bulk_create(items)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data[0], {'errors': {}})
+        self.assertIn('tags', response.data[1]['errors'])
+        self.assertEqual(Recipe.objects.count(), recipe_count)
+
+    def test_bulk_create_per_item_commits_valid_items(self):
+        items = self._get_bulk_items()
+        items[1]['ingredients'] = [{'id': 999, 'amount': 1}]
+
+        response = self._bulk_create(items, commit='item')
+
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertIn('ingredients', response.data[1]['errors'])
+        self.assertEqual(
+            list(Recipe.objects.filter(
+                pk__in=[response.data[0]['id'], response.data[2]['id']])
+                .order_by('name').values_list('name', flat=True)),
+            ['Bulk recipe 0', 'Bulk recipe 2'])
+
+    def test_bulk_create_accepts_string_ids(self):
+        items = self._get_bulk_items()
+        for item in items:
+            item['tags'] = [str(self.tag.id)]
+            item['ingredients'][0]['id'] = str(self.ingredient.id)
+
+        for commit in ('batch', 'item'):
+            response = self._bulk_create(items, commit=commit)
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_bulk_create_hides_database_errors(self):
+        error = DatabaseError('UNIQUE constraint failed: recipes_recipe.name')
+        with mock.patch.object(RecipeCreateUpdateSerializer, 'create_many',
+                               side_effect=error), \
+                self.assertLogs('recipes.serializers', 'ERROR'):
+            response = self._bulk_create(
+                self._get_bulk_items()[:1], commit='item')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data[0]['errors'], {
+            'non_field_errors': ['The recipe could not be saved.']})
+
+    def test_bulk_create_rejects_invalid_requests(self):
+        self.assertEqual(
+            self._bulk_create({'name': 'not a list'}).status_code,
+            status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            self._bulk_create(self._get_bulk_items(), commit='all')
+            .status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_update_recipe(self):
         upd_tag = Tag.objects.create(name='UpdTag')
         upd_ingredient = Ingredient.objects.create(name='UpdIngredient')
@@ -327,6 +845,63 @@ class RecipeListViewTests(APITestCase):
 
         self.assertEqual(response.status_code, 200)
 
+    def test_partial_update_keeps_tags_and_ingredients(self):
+        tag_rows = list(self.recipe.recipetag_set.values_list('pk', 'tag_id'))
+        ingredient_rows = list(self.recipe.recipeingredient_set.values_list(
+            'pk', 'ingredient_id', 'amount'))
+
+        response = self.authorized_client.patch(
+            reverse('recipes:recipe-detail', kwargs={'pk': self.recipe.id}),
+            data={'name': 'Upd Name'}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['name'], 'Upd Name')
+        self.assertEqual(
+            list(self.recipe.recipetag_set.values_list('pk', 'tag_id')),
+            tag_rows)
+        self.assertEqual(
+            list(self.recipe.recipeingredient_set.values_list(
+                'pk', 'ingredient_id', 'amount')),
+            ingredient_rows)
+
+    def test_update_changes_only_modified_rows(self):
+        upd_tag = Tag.objects.create(
+            name='UpdTag', color='#000001', slug='upd')
+        upd_ingredient = Ingredient.objects.create(
+            name='UpdIngredient', measurement_unit='g')
+        kept_tag_row = self.recipe.recipetag_set.get().pk
+        kept_ingredient_row = self.recipe.recipeingredient_set.get().pk
+
+        response = self.authorized_client.patch(
+            reverse('recipes:recipe-detail', kwargs={'pk': self.recipe.id}),
+            data={
+                'tags': [self.tag.id, upd_tag.id],
+                'ingredients': [{'id': self.ingredient.id, 'amount': 5},
+                                {'id': upd_ingredient.id, 'amount': 2}],
+            }, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.recipe.recipetag_set.get(tag=self.tag).pk,
+                         kept_tag_row)
+        kept = self.recipe.recipeingredient_set.get(
+            ingredient=self.ingredient)
+        self.assertEqual((kept.pk, kept.amount), (kept_ingredient_row, 5))
+        self.assertEqual(
+            [(item['id'], item['amount'])
+             for item in response.data['ingredients']],
+            [(self.ingredient.id, 5), (upd_ingredient.id, 2)])
+
+    def test_update_with_unknown_ids(self):
+        url = reverse('recipes:recipe-detail', kwargs={'pk': self.recipe.id})
+        response = self.authorized_client.patch(url, data={
+            'tags': [self.tag.id, 999],
+            'ingredients': [{'id': 998, 'amount': 1}],
+        }, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(set(response.data), {'tags', 'ingredients'})
+        self.assertEqual(self.recipe.recipeingredient_set.count(), 1)
+
     def test_delete_recipe(self):
         id_to_delete = self.recipe.id
         response = self.authorized_client.delete(
@@ -345,6 +920,29 @@ class RecipeListViewTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         self.assertTrue(Favorite.objects.filter(user=self.test_user,
                                                 recipe=self.recipe).exists())
+        self.assertEqual(
+            (response.data['id'], response.data['name'],
+             response.data['cooking_time']),
+            (self.recipe.id, self.recipe.name, self.recipe.cooking_time))
+        self.assertTrue(response.data['image'].endswith(
+            self.recipe.image.url))
+
+    def test_favorite_missing_recipe(self):
+        url = reverse('recipes:recipe-favorite', kwargs={'pk': 999})
+        self.assertEqual(self.authorized_client.post(url).status_code,
+                         status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.authorized_client.delete(url).status_code,
+                         status.HTTP_404_NOT_FOUND)
+        self.assertEqual(
+            self.authorized_client.post(reverse(
+                'recipes:recipe-favorite', kwargs={'pk': 'abc'})).status_code,
+            status.HTTP_404_NOT_FOUND)
+
+    def test_add_to_favorites_unauthenticated(self):
+        response = self.client.post(
+            reverse('recipes:recipe-favorite',
+                    kwargs={'pk': self.recipe.id}))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
 
     def test_remove_from_favorites(self):
         Favorite.objects.create(user=self.test_user, recipe=self.recipe)
@@ -421,11 +1019,287 @@ class RecipeListViewTests(APITestCase):
         )
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_bulk_add_and_remove_shopping_cart(self):
+        other = self._create_test_recipe('other')
+        third = self._create_test_recipe('third')
+        self.authorized_client.post(
+            reverse('recipes:recipe-shopping-cart',
+                    kwargs={'pk': self.recipe.id}))
+        url = reverse('recipes:recipe-shopping-cart-bulk')
+
+        response = self.authorized_client.post(
+            url, {'recipes': [self.recipe.id, other.id, third.id, other.id]},
+            format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual({recipe['id'] for recipe in response.data},
+                         {self.recipe.id, other.id, third.id})
+        self.assertEqual(self._get_shopping_list(), {self.ingredient.id: 3})
+
+        response = self.authorized_client.delete(
+            url, {'recipes': [self.recipe.id, other.id]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([recipe['id'] for recipe in response.data],
+                         [third.id])
+        self.assertEqual(self._get_shopping_list(), {self.ingredient.id: 1})
+
+    def test_bulk_add_to_shopping_cart_with_missing_recipe(self):
+        response = self.authorized_client.post(
+            reverse('recipes:recipe-shopping-cart-bulk'),
+            {'recipes': [self.recipe.id, 999]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['recipes'],
+                         ['Invalid pk "999" - object does not exist.'])
+        self.assertFalse(
+            ShoppingCart.objects.filter(user=self.test_user).exists())
+        self.assertEqual(self._get_shopping_list(), {})
+
+    def test_clear_shopping_cart(self):
+        other = self._create_test_recipe('other')
+        url = reverse('recipes:recipe-shopping-cart-bulk')
+        self.authorized_client.post(
+            url, {'recipes': [self.recipe.id, other.id]}, format='json')
+
+        for data in (None, {}, {'all': False}, {'recipes': 'all'}):
+            response = self.authorized_client.delete(
+                url, data, format='json')
+            self.assertEqual(response.status_code,
+                             status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            ShoppingCart.objects.filter(user=self.test_user).count(), 2)
+        self.assertEqual(self._get_shopping_list(), {self.ingredient.id: 2})
+
+        response = self.authorized_client.delete(
+            url, {'all': True}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, [])
+        self.assertFalse(
+            ShoppingCart.objects.filter(user=self.test_user).exists())
+        self.assertEqual(self._get_shopping_list(), {})
+
+    def test_bulk_favorites(self):
+        other = self._create_test_recipe('other')
+        url = reverse('recipes:recipe-favorite-bulk')
+        self.assertEqual(
+            self.unauthorized_client.post(
+                url, {'recipes': [self.recipe.id]}, format='json'
+            ).status_code,
+            status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(
+            self.authorized_client.post(
+                url, {'recipes': []}, format='json').status_code,
+            status.HTTP_400_BAD_REQUEST)
+
+        response = self.authorized_client.post(
+            url, {'recipes': [self.recipe.id, other.id]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            Favorite.objects.filter(user=self.test_user).count(), 2)
+
+        response = self.authorized_client.delete(
+            url, {'recipes': [other.id]}, format='json')
+        self.assertEqual([recipe['id'] for recipe in response.data],
+                         [self.recipe.id])
+
+        response = self.authorized_client.delete(
+            url, {'all': True}, format='json')
+        self.assertEqual(response.data, [])
+        self.assertFalse(
+            Favorite.objects.filter(user=self.test_user).exists())
+
     def test_download_shopping_cart(self):
         ShoppingCart.objects.create(user=self.test_user, recipe=self.recipe)
         response = self.authorized_client.get(
             reverse('recipes:recipe-download-shopping-cart')
         )
+        content = b''.join(response.streaming_content)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIsNotNone(content)
+        self.assertTrue(len(content) > 0)
+
+    def _download_shopping_cart(self, format):
+        self.authorized_client.post(
+            reverse('recipes:recipe-shopping-cart',
+                    kwargs={'pk': self.recipe.id}))
+        response = self.authorized_client.get(
+            reverse('recipes:recipe-download-shopping-cart'),
+            {'format': format}
+        )
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertIsNotNone(response.content)
-        self.assertTrue(len(response.content) > 0)
+        self.assertIn(f'shopping_cart.{format}',
+                      response['Content-Disposition'])
+        return b''.join(response.streaming_content).decode('utf-8')
+
+    def test_download_shopping_cart_txt(self):
+        content = self._download_shopping_cart('txt')
+        self.assertIn('potato - 1 g', content)
+
+    def test_download_shopping_cart_csv(self):
+        content = self._download_shopping_cart('csv')
+        self.assertIn('potato,1,g', content)
+
+    def test_download_shopping_cart_json(self):
+        content = self._download_shopping_cart('json')
+        self.assertEqual(
+            json.loads(content),
+            [{'name': 'potato', 'amount': 1, 'measurement_unit': 'g'}])
+
+    def test_download_shopping_cart_markdown(self):
+        content = self._download_shopping_cart('md')
+        self.assertIn('- [ ] potato — 1 g', content)
+
+    def test_download_empty_shopping_cart_json(self):
+        response = self.authorized_client.get(
+            reverse('recipes:recipe-download-shopping-cart'),
+            {'format': 'json'}
+        )
+        content = b''.join(response.streaming_content)
+        self.assertEqual(json.loads(content), [])
+
+    def _get_shopping_list(self):
+        return dict(ShoppingListItem.objects.filter(
+            user=self.test_user).values_list('ingredient_id', 'amount'))
+
+    def test_shopping_list_totals_follow_cart_changes(self):
+        other = self._create_test_recipe('other')
+        url = 'recipes:recipe-shopping-cart'
+        self.authorized_client.post(
+            reverse(url, kwargs={'pk': self.recipe.id}))
+        self.authorized_client.post(reverse(url, kwargs={'pk': other.id}))
+        self.assertEqual(self._get_shopping_list(), {self.ingredient.id: 2})
+
+        self.authorized_client.delete(
+            reverse(url, kwargs={'pk': self.recipe.id}))
+        self.assertEqual(self._get_shopping_list(), {self.ingredient.id: 1})
+
+        self.authorized_client.delete(
+            reverse('recipes:recipe-detail', kwargs={'pk': other.id}))
+        self.assertEqual(self._get_shopping_list(), {})
+
+    def test_shopping_list_totals_follow_model_deletes(self):
+        author, _ = self._create_test_user('author@user.co', 'author')
+        recipe = self._create_test_recipe('other')
+        Recipe.objects.filter(pk=recipe.pk).update(author=author)
+        url = 'recipes:recipe-shopping-cart'
+        self.authorized_client.post(
+            reverse(url, kwargs={'pk': self.recipe.id}))
+        self.authorized_client.post(reverse(url, kwargs={'pk': recipe.id}))
+
+        self.recipe.delete()
+        self.assertEqual(self._get_shopping_list(), {self.ingredient.id: 1})
+
+        author.delete()
+        self.assertFalse(
+            ShoppingCart.objects.filter(user=self.test_user).exists())
+        self.assertEqual(self._get_shopping_list(), {})
+
+    def test_shopping_list_totals_follow_recipe_update(self):
+        self.authorized_client.post(
+            reverse('recipes:recipe-shopping-cart',
+                    kwargs={'pk': self.recipe.id}))
+        new_ingredient = Ingredient.objects.create(
+            name='onion', measurement_unit='g')
+
+        self.authorized_client.patch(
+            reverse('recipes:recipe-detail', kwargs={'pk': self.recipe.id}),
+            data={
+                'name': 'Upd Name',
+                'text': 'Upd text',
+                'cooking_time': 100,
+                'tags': [self.tag.id],
+                'ingredients': [{'id': new_ingredient.id, 'amount': 5}],
+                'image': f'data:image/png;base64, {TEST_BASE64_IMAGE}'
+            },
+            format='json'
+        )
+
+        self.assertEqual(self._get_shopping_list(), {new_ingredient.id: 5})
+
+    def _create_admin_client(self):
+        admin = User.objects.create_superuser(
+            email='admin@user.co', username='admin', password='1qa!QA1qa')
+        self.client.force_login(admin)
+        return self.client
+
+    def test_shopping_list_totals_follow_admin_inline(self):
+        self.authorized_client.post(
+            reverse('recipes:recipe-shopping-cart',
+                    kwargs={'pk': self.recipe.id}))
+        onion = Ingredient.objects.create(name='onion', measurement_unit='g')
+        recipe_ingredient = RecipeIngredient.objects.get(recipe=self.recipe)
+        prefix = 'recipeingredient_set'
+
+        response = self._create_admin_client().post(
+            reverse('admin:recipes_recipe_change', args=(self.recipe.id,)),
+            data={
+                'author': self.test_user.id,
+                'name': self.recipe.name,
+                'text': self.recipe.text,
+                'cooking_time': self.recipe.cooking_time,
+                'image_status': self.recipe.image_status,
+                'image_attempts': 0,
+                f'{prefix}-TOTAL_FORMS': 2,
+                f'{prefix}-INITIAL_FORMS': 1,
+                f'{prefix}-0-id': recipe_ingredient.id,
+                f'{prefix}-0-recipe': self.recipe.id,
+                f'{prefix}-0-ingredient': self.ingredient.id,
+                f'{prefix}-0-amount': 4,
+                f'{prefix}-1-recipe': self.recipe.id,
+                f'{prefix}-1-ingredient': onion.id,
+                f'{prefix}-1-amount': 2,
+            })
+
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+        self.assertEqual(self._get_shopping_list(),
+                         {self.ingredient.id: 4, onion.id: 2})
+
+    def test_shopping_list_totals_follow_admin_recipe_ingredients(self):
+        other = self._create_test_recipe('other')
+        self.authorized_client.post(
+            reverse('recipes:recipe-shopping-cart',
+                    kwargs={'pk': self.recipe.id}))
+        admin_client = self._create_admin_client()
+        recipe_ingredient = RecipeIngredient.objects.get(recipe=self.recipe)
+        url = reverse('admin:recipes_recipeingredient_change',
+                      args=(recipe_ingredient.id,))
+
+        admin_client.post(url, data={
+            'recipe': self.recipe.id,
+            'ingredient': self.ingredient.id,
+            'amount': 3,
+        })
+        self.assertEqual(self._get_shopping_list(), {self.ingredient.id: 3})
+
+        RecipeIngredient.objects.filter(recipe=other).delete()
+        admin_client.post(url, data={
+            'recipe': other.id,
+            'ingredient': self.ingredient.id,
+            'amount': 3,
+        })
+        self.assertEqual(self._get_shopping_list(), {})
+
+        ShoppingCart.objects.create(user=self.test_user, recipe=other)
+        ShoppingCartService.add_recipes(self.test_user, [other.id])
+        admin_client.post(
+            reverse('admin:recipes_recipeingredient_delete',
+                    args=(recipe_ingredient.id,)),
+            data={'post': 'yes'})
+        self.assertFalse(RecipeIngredient.objects.filter(
+            pk=recipe_ingredient.id).exists())
+        self.assertEqual(self._get_shopping_list(), {})
+
+    def test_rebuild_shopping_lists_command(self):
+        self.authorized_client.post(
+            reverse('recipes:recipe-shopping-cart',
+                    kwargs={'pk': self.recipe.id}))
+        ShoppingListItem.objects.filter(user=self.test_user).update(amount=7)
+        out = io.StringIO()
+
+        with self.assertRaisesMessage(CommandError, '1 of 1 users'):
+            call_command('rebuild_shopping_lists', '--verify',
+                         '--user', str(self.test_user.id), stdout=out)
+        self.assertIn(f'User {self.test_user.id} has stale', out.getvalue())
+
+        call_command('rebuild_shopping_lists', stdout=out)
+        self.assertEqual(self._get_shopping_list(), {self.ingredient.id: 1})
+        call_command('rebuild_shopping_lists', '--verify', stdout=out)
+        self.assertIn('are consistent', out.getvalue())
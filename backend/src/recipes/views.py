@@ -1,35 +1,65 @@
-from django.http import HttpResponse
+from django.db import transaction
+from django.http import StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import filters, permissions, status, viewsets
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.parsers import MultiPartParser
 from rest_framework.response import Response
 
 from .filters import RecipeFilter
 from .models import Favorite, Ingredient, Recipe, ShoppingCart, Tag
-from .paginators import RecipePaginator
+from .negotiation import FileFormatContentNegotiation
+from .paginators import RecipeCursorPaginator, RecipePaginator
+from .parsers import RawImageParser
 from .permissions import IsOwner
-from .serializers import (IngredientSerializer, RecipeCreateUpdateSerializer,
+from .serializers import (BULK_RECIPES_LIMIT, IngredientSerializer,
+                          RecipeCreateUpdateSerializer, RecipeIdsSerializer,
+                          RecipeImageSerializer, RecipeRemovalSerializer,
                           RecipeRetriveSerializer, ShortRecipeSerializer,
                           TagSerializer)
+from .services import ingredient_search
+from .services.catalog_cache import ingredient_catalog, tag_catalog
+from .services.conditional import recipe_list_etag, recipe_validators
+from .services.relations import Relation
 from .services.shopping_cart_file_generator import FileGeneratorFactory
 from .services.shopping_cart_service import ShoppingCartService
 
+RECIPE_CARD_FIELDS = ('id', 'name', 'image', 'cooking_time')
+
+favorite_relation = Relation(Favorite, 'recipe', RECIPE_CARD_FIELDS)
+cart_relation = Relation(ShoppingCart, 'recipe', RECIPE_CARD_FIELDS)
+
 
 class TagViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
 
+    def list(self, request, *args, **kwargs):
+        return tag_catalog.response(request)
+
 
 class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     serializer_class = IngredientSerializer
 
-    def get_queryset(self):
-        queryset = Ingredient.objects.all()
-        name = self.request.query_params.get('name', None)
+    queryset = Ingredient.objects.all()
+
+    def list(self, request, *args, **kwargs):
+        name = request.query_params.get('name', None)
         if name is not None:
-            return queryset.filter(name__istartswith=name) | queryset.filter(
-                name__icontains=name).exclude(name__istartswith=name)
-        return queryset
+            return Response(ingredient_search.ingredient_index.search(
+                name, self._get_limit(request),
+                ingredient_catalog.get_version()))
+        return ingredient_catalog.response(request)
+
+    def _get_limit(self, request):
+        try:
+            limit = int(request.query_params.get('limit'))
+        except (TypeError, ValueError):
+            return ingredient_search.DEFAULT_LIMIT
+        return min(max(limit, 1), ingredient_search.MAX_LIMIT)
 
 
 class RecipeViewSet(viewsets.ModelViewSet):
@@ -40,52 +70,188 @@ class RecipeViewSet(viewsets.ModelViewSet):
     filterset_class = RecipeFilter
     filterset_fields = ['author', 'tags', 'is_favorited']
 
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            if RecipeCursorPaginator.is_requested(self.request):
+                self._paginator = RecipeCursorPaginator()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action in ['list', 'retrieve']:
+            return queryset.with_related().with_user_flags(self.request.user)
+        if self.action in ['update', 'partial_update', 'image']:
+            return queryset.select_related('author')
+        return queryset
+
+    def list(self, request, *args, **kwargs):
+        etag = None
+        if not RecipeCursorPaginator.is_requested(request):
+            etag = recipe_list_etag(
+                request, self.filter_queryset(Recipe.objects.all()))
+        return self._conditional_response(
+            request, etag, None, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        etag, last_modified = recipe_validators(request, kwargs['pk'])
+        return self._conditional_response(
+            request, etag, last_modified, super().retrieve, *args, **kwargs)
+
+    def _conditional_response(self, request, etag, last_modified,
+                              handler, *args, **kwargs):
+        timestamp = int(last_modified.timestamp()) if last_modified else None
+        response = None
+        if etag is not None:
+            response = get_conditional_response(
+                request, etag=etag, last_modified=timestamp)
+        if response is None:
+            response = handler(request, *args, **kwargs)
+        # A 304 repeats the validators, so caches can refresh their copy.
+        if etag is not None and response.status_code in (
+                status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED):
+            response['ETag'] = etag
+            if timestamp is not None:
+                response['Last-Modified'] = http_date(timestamp)
+        patch_vary_headers(response, ['Authorization'])
+        return response
+
     def get_permissions(self):
-        if self.action in ['create', 'shopping_cart']:
+        if self.action in ['create', 'bulk_create', 'favorite',
+                           'shopping_cart', 'bulk_favorite',
+                           'bulk_shopping_cart']:
             return [permissions.IsAuthenticated()]
-        if self.action in ['update', 'partial_update', 'destroy']:
+        if self.action in ['update', 'partial_update', 'destroy', 'image']:
             return [permissions.IsAuthenticated(), IsOwner()]
         return [permissions.AllowAny()]
 
     def get_serializer_class(self):
         if self.action in ['list', 'retrieve']:
             return RecipeRetriveSerializer
-        if self.action in ['create', 'update', 'partial_update']:
+        if self.action in ['create', 'bulk_create', 'update',
+                           'partial_update']:
             return RecipeCreateUpdateSerializer
+        if self.action == 'image':
+            return RecipeImageSerializer
         raise ValueError("Invalid action specified.")
 
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
+    @action(detail=False,
+            methods=['post'],
+            url_path='bulk')
+    def bulk_create(self, request):
+        """Creates a list of recipes.
+
+        With ?commit=batch (the default) all recipes are saved in one
+        transaction, or none when any item is invalid. With ?commit=item
+        every valid recipe is saved on its own.
+        """
+        commit = request.query_params.get('commit', 'batch')
+        if commit not in ('batch', 'item'):
+            return Response({"detail": "commit must be 'batch' or 'item'."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if not isinstance(request.data, list) or not request.data:
+            return Response({"detail": "Expected a list of recipes."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if len(request.data) > BULK_RECIPES_LIMIT:
+            return Response(
+                {"detail": f"At most {BULK_RECIPES_LIMIT} recipes "
+                           "can be created at once."},
+                status=status.HTTP_400_BAD_REQUEST)
+
+        serializer = self.get_serializer(data=request.data, many=True)
+        if commit == 'item':
+            results = serializer.save_each(author=request.user)
+        elif serializer.is_valid():
+            results = [(recipe, None)
+                       for recipe in serializer.save(author=request.user)]
+        else:
+            results = [(None, errors) for errors in serializer.errors]
+
+        created = sum(recipe is not None for recipe, _ in results)
+        if created == len(results):
+            status_code = status.HTTP_201_CREATED
+        elif created:
+            status_code = status.HTTP_207_MULTI_STATUS
+        else:
+            status_code = status.HTTP_400_BAD_REQUEST
+        return Response(
+            [{'id': recipe.pk} if recipe is not None else {'errors': errors}
+             for recipe, errors in results],
+            status=status_code)
+
+    @action(detail=True,
+            methods=['post'],
+            parser_classes=[RawImageParser, MultiPartParser],
+            url_path='image')
+    def image(self, request, pk=None):
+        """Replaces the image with a raw image body or a multipart file."""
+        recipe = self.get_object()
+        serializer = self.get_serializer(recipe, data={
+            'image': request.data.get('file') or request.data.get('image')})
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return Response(serializer.data)
+
     @action(detail=True,
             methods=['post', 'delete'],
             permission_classes=[permissions.IsAuthenticated],
             url_path='favorite')
     def favorite(self, request, pk=None):
-        recipe = self.get_object()
         if request.method == 'POST':
-            return self._add_to_favorites(request, recipe)
-        return self._remove_from_favorites(request, recipe)
+            return self._add_to_favorites(request, pk)
+        return self._remove_from_favorites(request, pk)
 
     @action(detail=True,
             methods=['post', 'delete'],
             permission_classes=[permissions.IsAuthenticated],
             url_path='shopping_cart')
     def shopping_cart(self, request, pk=None):
-        recipe = self.get_object()
         if request.method == 'POST':
-            return self._add_to_shopping_cart(request, recipe)
-        return self._remove_from_shopping_cart(request, recipe)
+            return self._add_to_shopping_cart(request, pk)
+        return self._remove_from_shopping_cart(request, pk)
+
+    @action(detail=False,
+            methods=['post', 'delete'],
+            permission_classes=[permissions.IsAuthenticated],
+            url_path='favorite',
+            url_name='favorite-bulk')
+    def bulk_favorite(self, request):
+        """Adds or removes a list of recipes, or all of them.
+
+        Responds with the recipes that are in favorites afterwards.
+        """
+        if request.method == 'POST':
+            return self._add_many_to_favorites(request)
+        return self._remove_many_from_favorites(request)
+
+    @action(detail=False,
+            methods=['post', 'delete'],
+            permission_classes=[permissions.IsAuthenticated],
+            url_path='shopping_cart',
+            url_name='shopping-cart-bulk')
+    def bulk_shopping_cart(self, request):
+        """Adds or removes a list of recipes, or clears the cart.
+
+        Responds with the recipes that are in the cart afterwards.
+        """
+        if request.method == 'POST':
+            return self._add_many_to_shopping_cart(request)
+        return self._remove_many_from_shopping_cart(request)
 
     @action(detail=False,
             methods=['get'],
             permission_classes=[permissions.IsAuthenticated],
+            content_negotiation_class=FileFormatContentNegotiation,
             url_path='download_shopping_cart')
     def download_shopping_cart(self, request):
         format = self._get_format(request)
 
-        shopping_cart = ShoppingCart.objects.filter(user=request.user)
-        ingredients = ShoppingCartService.get_ingredients(shopping_cart)
+        ingredients = ShoppingCartService.iter_ingredients(request.user)
 
         try:
             content, filename, content_type = (
@@ -97,47 +263,112 @@ class RecipeViewSet(viewsets.ModelViewSet):
             return Response(
                 {"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-        response = HttpResponse(content, content_type=content_type)
+        response = StreamingHttpResponse(content, content_type=content_type)
         response['Content-Disposition'] = f'attachment; filename="{filename}"'
 
         return response
 
     def _get_format(self, request):
         format = request.query_params.get('format')
-        if format and format.lower() in ['txt', 'csv']:
-            return format
+        if format and format.lower() in FileGeneratorFactory.get_formats():
+            return format.lower()
         return 'txt'
 
-    def _add_to_shopping_cart(self, request, recipe):
-        _, created = ShoppingCart.objects.get_or_create(
-            user=request.user, recipe=recipe)
+    @transaction.atomic
+    def _add_to_shopping_cart(self, request, pk):
+        recipe, created = cart_relation.add(request.user, pk)
+        if recipe is None:
+            raise NotFound()
         if created:
+            ShoppingCartService.add_recipes(request.user, [recipe.pk])
             serializer = ShortRecipeSerializer(recipe)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response({"detail": "Recipe is already in shopping cart."},
                         status=status.HTTP_400_BAD_REQUEST)
 
-    def _remove_from_shopping_cart(self, request, recipe):
-        deleted_count, _ = ShoppingCart.objects.filter(
-            user=request.user, recipe=recipe).delete()
-        if deleted_count > 0:
+    @transaction.atomic
+    def _remove_from_shopping_cart(self, request, pk):
+        exists, deleted = cart_relation.remove(request.user, pk)
+        if not exists:
+            raise NotFound()
+        if deleted:
+            ShoppingCartService.remove_recipes(request.user, [pk])
             return Response(status=status.HTTP_204_NO_CONTENT)
         return Response({"detail": "Recipe is not in shopping cart."},
                         status=status.HTTP_400_BAD_REQUEST)
 
-    def _add_to_favorites(self, request, recipe):
-        _, created = Favorite.objects.get_or_create(
-            user=request.user, recipe=recipe)
+    @transaction.atomic
+    def _add_many_to_shopping_cart(self, request):
+        recipe_ids = self._get_recipe_ids(request)
+        added = cart_relation.add_many(request.user, recipe_ids)
+        response = self._get_recipe_cards(
+            Recipe.objects.filter(in_cart__user=request.user), recipe_ids)
+        ShoppingCartService.add_recipes(request.user, added)
+        return response
+
+    @transaction.atomic
+    def _remove_many_from_shopping_cart(self, request):
+        recipe_ids = self._get_recipe_ids(request, RecipeRemovalSerializer)
+        removed = cart_relation.remove_many(request.user, recipe_ids)
+        if recipe_ids is None:
+            ShoppingCartService.clear(request.user)
+            return Response([])
+        ShoppingCartService.remove_recipes(request.user, removed)
+        return self._get_recipe_cards(
+            Recipe.objects.filter(in_cart__user=request.user))
+
+    @transaction.atomic
+    def _add_many_to_favorites(self, request):
+        recipe_ids = self._get_recipe_ids(request)
+        favorite_relation.add_many(request.user, recipe_ids)
+        return self._get_recipe_cards(
+            Recipe.objects.filter(favorited_by__user=request.user),
+            recipe_ids)
+
+    def _remove_many_from_favorites(self, request):
+        recipe_ids = self._get_recipe_ids(request, RecipeRemovalSerializer)
+        favorite_relation.remove_many(request.user, recipe_ids)
+        if recipe_ids is None:
+            return Response([])
+        return self._get_recipe_cards(
+            Recipe.objects.filter(favorited_by__user=request.user))
+
+    def _get_recipe_ids(self, request,
+                        serializer_class=RecipeIdsSerializer):
+        """Returns the validated ids, or None when "all" was requested."""
+        serializer = serializer_class(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data.get('recipes')
+
+    def _get_recipe_cards(self, queryset, recipe_ids=()):
+        """Serializes the queryset, which must contain all recipe_ids.
+
+        Raising here rolls back the changes made by the caller.
+        """
+        recipes = list(queryset.only(*RECIPE_CARD_FIELDS))
+        missing = set(recipe_ids) - {recipe.pk for recipe in recipes}
+        if missing:
+            raise ValidationError({'recipes': [
+                f'Invalid pk "{pk}" - object does not exist.'
+                for pk in sorted(missing)]})
+        serializer = ShortRecipeSerializer(recipes, many=True)
+        return Response(serializer.data)
+
+    def _add_to_favorites(self, request, pk):
+        recipe, created = favorite_relation.add(request.user, pk)
+        if recipe is None:
+            raise NotFound()
         if created:
             serializer = ShortRecipeSerializer(recipe)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response({"detail": "Recipe is already in favorites."},
                         status=status.HTTP_400_BAD_REQUEST)
 
-    def _remove_from_favorites(self, request, recipe):
-        deleted_count, _ = Favorite.objects.filter(
-            user=request.user, recipe=recipe).delete()
-        if deleted_count > 0:
+    def _remove_from_favorites(self, request, pk):
+        exists, deleted = favorite_relation.remove(request.user, pk)
+        if not exists:
+            raise NotFound()
+        if deleted:
             return Response(status=status.HTTP_204_NO_CONTENT)
         return Response({"detail": "Recipe is not in favorites."},
                         status=status.HTTP_400_BAD_REQUEST)
@@ -1,13 +1,30 @@
 from django.contrib.auth import get_user_model
 from rest_framework import serializers
 
-from recipes.models import Recipe
 from .models import Subscription
 
 User = get_user_model()
 
 
-class UserSerializer(serializers.ModelSerializer):
+def get_subscribed_author_ids(request):
+    if not hasattr(request, '_subscribed_author_ids'):
+        request._subscribed_author_ids = frozenset(
+            Subscription.objects
+            .filter(user=request.user)
+            .values_list('author_id', flat=True)
+        )
+    return request._subscribed_author_ids
+
+
+class SubscriptionStatusMixin:
+    def get_is_subscribed(self, obj):
+        request = self.context.get('request', None)
+        if request and request.user.is_authenticated:
+            return obj.id in get_subscribed_author_ids(request)
+        return False
+
+
+class UserSerializer(SubscriptionStatusMixin, serializers.ModelSerializer):
     is_subscribed = serializers.SerializerMethodField()
 
     class Meta:
@@ -16,13 +33,6 @@ class UserSerializer(serializers.ModelSerializer):
                   'is_subscribed', 'password')
         extra_kwargs = {'password': {'write_only': True}}
 
-    def get_is_subscribed(self, obj):
-        request = self.context.get('request', None)
-        if request and request.user.is_authenticated:
-            return Subscription.objects.filter(
-                user=request.user, author=obj).exists()
-        return False
-
 
 class UserRegisterSerializer(serializers.ModelSerializer):
     class Meta:
@@ -45,7 +55,8 @@ class SetPasswordSerializer(serializers.Serializer):
     current_password = serializers.CharField(required=True)
 
 
-class UserSubscriptionSerializer(serializers.ModelSerializer):
+class UserSubscriptionSerializer(SubscriptionStatusMixin,
+                                 serializers.ModelSerializer):
     is_subscribed = serializers.SerializerMethodField()
     recipes = serializers.SerializerMethodField()
     recipes_count = serializers.SerializerMethodField()
@@ -58,23 +69,7 @@ class UserSubscriptionSerializer(serializers.ModelSerializer):
     def get_recipes(self, obj):
         from recipes.serializers import ShortRecipeSerializer
 
-        default_recipes_limit = 10
-        recipes_limit = self.context['request'].query_params.get(
-            'recipes_limit', default_recipes_limit)
-        try:
-            recipes_limit = int(recipes_limit)
-        except ValueError:
-            recipes_limit = default_recipes_limit
-
-        recipes = Recipe.objects.filter(author=obj)[:recipes_limit]
-        return ShortRecipeSerializer(recipes, many=True).data
-
-    def get_is_subscribed(self, obj):
-        request = self.context.get('request', None)
-        if request and request.user.is_authenticated:
-            return Subscription.objects.filter(
-                user=request.user, author=obj).exists()
-        return False
+        return ShortRecipeSerializer(obj.recipes_preview, many=True).data
 
     def get_recipes_count(self, obj):
-        return Recipe.objects.filter(author=obj).count()
+        return obj.recipes_count
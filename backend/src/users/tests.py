@@ -1,9 +1,13 @@
 from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.authtoken.models import Token
 from rest_framework.test import APIClient, APITestCase
 
+from recipes.models import Recipe
+
 User = get_user_model()
 
 
@@ -37,6 +41,25 @@ class UserViewTests(APITestCase):
             reverse('users:user-list'))
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
+    def test_user_list_is_subscribed(self):
+        response = self.authorized_client.get(
+            reverse('users:user-list'))
+        subscribed = {user['id']: user['is_subscribed']
+                      for user in response.data}
+        self.assertEqual(subscribed, {self.test_user1.id: False,
+                                      self.test_user2.id: True})
+
+    def test_user_list_query_count_does_not_depend_on_size(self):
+        with CaptureQueriesContext(connection) as small:
+            self.authorized_client.get(reverse('users:user-list'))
+        for i in range(10):
+            User.objects.create_user(
+                email=f'extra{i}@user.co', username=f'extra{i}')
+        with CaptureQueriesContext(connection) as large:
+            self.authorized_client.get(reverse('users:user-list'))
+        self.assertEqual(len(small.captured_queries),
+                         len(large.captured_queries))
+
     def test_user_list_unauthorized_user(self):
         response = self.unauthorized_client.get(
             reverse('users:user-list'))
@@ -100,6 +123,37 @@ class UserViewTests(APITestCase):
         self.assertEqual(len(response.data), 1)
         self.assertEqual(response.data[0]['email'], self.test_user2.email)
 
+    def _create_recipes(self, author, count):
+        for i in range(count):
+            Recipe.objects.create(author=author, name=f'recipe{i}',
+                                  text='text', cooking_time=1,
+                                  image='recipes/test.jpg')
+
+    def test_get_subscriptions_with_recipes_limit(self):
+        self._create_recipes(self.test_user2, 3)
+        response = self.authorized_client.get(
+            reverse('users:user-subscriptions'), {'recipes_limit': 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data[0]['recipes']), 2)
+        self.assertEqual(response.data[0]['recipes_count'], 3)
+        self.assertTrue(response.data[0]['is_subscribed'])
+
+    def test_get_subscriptions_query_count_does_not_depend_on_size(self):
+        self._create_recipes(self.test_user2, 2)
+        with CaptureQueriesContext(connection) as small:
+            self.authorized_client.get(reverse('users:user-subscriptions'))
+        for i in range(5):
+            author = User.objects.create_user(
+                email=f'author{i}@user.co', username=f'author{i}')
+            self._create_recipes(author, 3)
+            self.test_user1.follower.create(author=author)
+        with CaptureQueriesContext(connection) as large:
+            response = self.authorized_client.get(
+                reverse('users:user-subscriptions'))
+        self.assertEqual(len(response.data), 6)
+        self.assertEqual(len(small.captured_queries),
+                         len(large.captured_queries))
+
     def test_create_subscription(self):
         new_user = User.objects.create_user(
             email="user3@test.com", username='user3', password="password")
@@ -109,6 +163,23 @@ class UserViewTests(APITestCase):
         self.assertTrue(
             self.test_user1.follower.filter(author=new_user).exists())
 
+    def test_subscribe_twice_and_to_missing_user(self):
+        new_user = User.objects.create_user(
+            email="user3@test.com", username='user3', password="password")
+        url = reverse('users:user-subscribe', kwargs={'pk': new_user.id})
+        self.assertEqual(self.authorized_client.post(url).status_code,
+                         status.HTTP_201_CREATED)
+        self.assertEqual(self.authorized_client.post(url).status_code,
+                         status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            self.test_user1.follower.filter(author=new_user).count(), 1)
+
+        url = reverse('users:user-subscribe', kwargs={'pk': 999})
+        self.assertEqual(self.authorized_client.post(url).status_code,
+                         status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.authorized_client.delete(url).status_code,
+                         status.HTTP_404_NOT_FOUND)
+
     def test_user_unsubscribe(self):
         new_user = User.objects.create_user(
             email="user3@test.com", username='user3', password="password")
@@ -1,12 +1,16 @@
 from django.contrib.auth import authenticate, get_user_model
 from django.contrib.auth.hashers import check_password
+from django.db.models import Count, Prefetch
 from rest_framework import status, viewsets
 from rest_framework.authtoken.models import Token
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from recipes.models import Recipe
+from recipes.services.relations import Relation
 from users.serializers import UserSubscriptionSerializer
 from .models import Subscription
 from .paginators import UsersPaginator
@@ -15,6 +19,10 @@ from .serializers import (SetPasswordSerializer, UserLoginSerializer,
 
 User = get_user_model()
 
+DEFAULT_RECIPES_LIMIT = 10
+
+subscription_relation = Relation(Subscription, 'author')
+
 
 class UserViewSet(viewsets.ModelViewSet):
     queryset = User.objects.all()
@@ -54,15 +62,24 @@ class UserViewSet(viewsets.ModelViewSet):
                             status=status.HTTP_400_BAD_REQUEST)
         request.user.set_password(
             serializer.validated_data.get('new_password'))
-        request.user.save()
+        request.user.save(update_fields=['password'])
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(detail=False,
             methods=['get'],
             permission_classes=[IsAuthenticated])
     def subscriptions(self, request):
-        subscriptions = User.objects.filter(
-            following__user=request.user).order_by('username')
+        recipes_limit = self._get_recipes_limit(request)
+        subscriptions = (
+            User.objects
+            .filter(following__user=request.user)
+            .annotate(recipes_count=Count('recipes'))
+            .prefetch_related(Prefetch(
+                'recipes',
+                queryset=Recipe.objects.all()[:recipes_limit],
+                to_attr='recipes_preview'))
+            .order_by('username')
+        )
         page = self.paginate_queryset(subscriptions)
         if page is not None:
             serializer = UserSubscriptionSerializer(
@@ -73,6 +90,16 @@ class UserViewSet(viewsets.ModelViewSet):
             subscriptions, many=True, context={'request': request})
         return Response(serializer.data)
 
+    def _get_recipes_limit(self, request):
+        recipes_limit = request.query_params.get('recipes_limit')
+        try:
+            recipes_limit = int(recipes_limit)
+        except (TypeError, ValueError):
+            return DEFAULT_RECIPES_LIMIT
+        if recipes_limit < 0:
+            return DEFAULT_RECIPES_LIMIT
+        return recipes_limit
+
     @action(detail=True,
             methods=['post', 'delete'],
             permission_classes=[IsAuthenticated],
@@ -83,10 +110,9 @@ class UserViewSet(viewsets.ModelViewSet):
         return self._remove_subscription(request, pk)
 
     def _add_subscription(self, request, pk=None):
-        user_to_subscribe = self.get_object()
-
-        _, created = Subscription.objects.get_or_create(
-            user=request.user, author=user_to_subscribe)
+        author, created = subscription_relation.add(request.user, pk)
+        if author is None:
+            raise NotFound()
 
         if created:
             return Response({"detail": "Successfully subscribed."},
@@ -96,12 +122,11 @@ class UserViewSet(viewsets.ModelViewSet):
                         status=status.HTTP_400_BAD_REQUEST)
 
     def _remove_subscription(self, request, pk=None):
-        user_to_unsubscribe = self.get_object()
-        subscription = Subscription.objects.filter(
-            user=request.user, author=user_to_unsubscribe).first()
+        exists, deleted = subscription_relation.remove(request.user, pk)
+        if not exists:
+            raise NotFound()
 
-        if subscription:
-            subscription.delete()
+        if deleted:
             return Response({"detail": "Successfully unsubscribed."},
                             status=status.HTTP_204_NO_CONTENT)
 
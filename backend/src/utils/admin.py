@@ -0,0 +1,62 @@
+import os
+
+from django.conf import settings
+from django.contrib import admin
+from django.http import FileResponse, Http404
+from django.urls import path, reverse
+from django.utils.html import format_html
+
+from .models import RequestProfile
+from .profiling import remove_profile_files
+
+
+class RequestProfileAdmin(admin.ModelAdmin):
+    list_display = ('created_at', 'method', 'path', 'view', 'action',
+                    'status_code', 'duration_ms', 'sampled', 'user')
+    list_filter = ('sampled', 'view', 'action')
+    search_fields = ('path',)
+    readonly_fields = ('download_link',) + tuple(
+        field.name for field in RequestProfile._meta.fields)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def delete_model(self, request, obj):
+        remove_profile_files(RequestProfile.objects.filter(pk=obj.pk))
+        super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        remove_profile_files(queryset)
+        super().delete_queryset(request, queryset)
+
+    def get_urls(self):
+        return [
+            path('<int:pk>/download/',
+                 self.admin_site.admin_view(self.download),
+                 name='utils_requestprofile_download'),
+        ] + super().get_urls()
+
+    def download(self, request, pk):
+        profile = self.get_object(request, pk)
+        if profile is None or not self.has_view_permission(request, profile):
+            raise Http404()
+        file_path = os.path.join(
+            settings.PROFILING['DIR'], profile.stats_file)
+        if not os.path.exists(file_path):
+            raise Http404()
+        return FileResponse(open(file_path, 'rb'), as_attachment=True,
+                            filename=profile.stats_file)
+
+    def download_link(self, obj):
+        return format_html(
+            '<a href="{}">{}</a>',
+            reverse('admin:utils_requestprofile_download', args=[obj.pk]),
+            obj.stats_file)
+
+    download_link.short_description = 'pstats file'
+
+
+admin.site.register(RequestProfile, RequestProfileAdmin)
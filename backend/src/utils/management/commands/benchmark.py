@@ -0,0 +1,230 @@
+import base64
+import io
+import json
+import platform
+import random
+import statistics
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from PIL import Image
+
+from recipes.fields import Base64ImageField
+from recipes.models import (Ingredient, Recipe, RecipeIngredient, RecipeTag,
+                            ShoppingListItem, Tag)
+from recipes.serializers import (RecipeCreateUpdateSerializer,
+                                 RecipeRetriveSerializer)
+from recipes.services.shopping_cart_file_generator import FileGeneratorFactory
+from recipes.services.shopping_cart_service import ShoppingCartService
+from users.models import User
+
+RECIPE_COUNTS = (6, 100)
+INGREDIENTS_PER_RECIPE = 10
+TAGS_PER_RECIPE = 3
+CART_SIZE = 200
+IMAGE_SIZES_MB = (1, 5)
+# Noise JPEGs at quality 85 take about 0.75 bytes per pixel.
+JPEG_BYTES_PER_PIXEL = 0.75
+
+
+class Command(BaseCommand):
+    help = ('Runs micro-benchmarks of serializers and services and '
+            'reports time and memory per call')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=20,
+                            help='Measured calls per case')
+        parser.add_argument('--warmup', type=int, default=2)
+        parser.add_argument('-k', dest='keyword',
+                            help='Only run cases containing this substring')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--save', help='Write the results to this file')
+        parser.add_argument('--compare',
+                            help='Baseline results to compare against')
+        parser.add_argument('--threshold', type=float, default=10.0,
+                            help='Slowdown in percent reported as regression')
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.rng = random.Random(options['seed'])
+        results = {}
+        # Fixtures that need the database are rolled back afterwards.
+        with transaction.atomic():
+            for name, func in self.get_cases():
+                if options['keyword'] and options['keyword'] not in name:
+                    continue
+                results[name] = self.measure(func)
+                self.stdout.write(self.format_result(name, results[name]))
+            transaction.set_rollback(True)
+        if not results:
+            raise CommandError('No benchmark cases matched')
+
+        report = {
+            'python': platform.python_version(),
+            'repeat': options['repeat'],
+            'cases': results,
+        }
+        if options['save']:
+            with open(options['save'], 'w') as report_file:
+                json.dump(report, report_file, indent=2)
+        if options['compare']:
+            with open(options['compare']) as baseline_file:
+                self.compare(json.load(baseline_file), report)
+
+    def get_cases(self):
+        tags = self.create_tags()
+        ingredients = self.create_ingredients()
+        # Reused when the database already has it, the fixtures are rolled
+        # back anyway.
+        author, _ = User.objects.get_or_create(
+            email='benchmark@example.com', defaults={'username': 'benchmark'})
+
+        for count in RECIPE_COUNTS:
+            recipes = self.build_recipes(count, author, tags, ingredients)
+            yield (f'recipe_retrieve_serializer[{count}]',
+                   lambda recipes=recipes: RecipeRetriveSerializer(
+                       recipes, many=True).data)
+
+        validated_data = self.build_validated_data(tags, ingredients)
+        serializer = RecipeCreateUpdateSerializer()
+        yield ('recipe_create_update_serializer.validate',
+               lambda: serializer.validate(validated_data))
+        # Without an upload, so the case measures no storage writes.
+        create_data = dict(validated_data, author=author)
+        del create_data['image']
+        yield ('recipe_create_update_serializer.create',
+               lambda: serializer.create(dict(create_data)))
+
+        for size in IMAGE_SIZES_MB:
+            data = self.build_base64_image(size * 1024 * 1024)
+            field = Base64ImageField()
+            yield (f'base64_image_field.to_internal_value[{size}mb]',
+                   lambda data=data, field=field:
+                   field.to_internal_value(data))
+
+        ShoppingListItem.objects.bulk_create(
+            ShoppingListItem(user=author, ingredient=ingredient,
+                             amount=self.rng.randint(1, 1000))
+            for ingredient in ingredients[:CART_SIZE])
+        yield (f'shopping_cart_service.get_ingredients[{CART_SIZE}]',
+               lambda: ShoppingCartService.get_ingredients(author))
+
+        cart = list(ShoppingCartService.iter_ingredients(author))
+        for file_format in FileGeneratorFactory.get_formats():
+            generator = FileGeneratorFactory.get_generator(file_format)
+            yield (f'file_generator.{file_format}[{CART_SIZE}]',
+                   lambda generator=generator: b''.join(
+                       generator.generate(cart)[0]))
+
+    def create_tags(self):
+        return [
+            Tag.objects.get_or_create(
+                slug=f'benchmark-tag-{i}',
+                defaults={'name': f'benchmark tag {i}',
+                          'color': f'#b{i:05x}'})[0]
+            for i in range(TAGS_PER_RECIPE * 3)]
+
+    def create_ingredients(self):
+        return Ingredient.objects.bulk_create(
+            Ingredient(name=f'Ингредиент для замера {i}',
+                       measurement_unit=self.rng.choice(['г', 'мл', 'шт.']))
+            for i in range(max(CART_SIZE, INGREDIENTS_PER_RECIPE * 2)))
+
+    def build_recipes(self, count, author, tags, ingredients):
+        """Builds unsaved recipes with their relations already prefetched."""
+        recipes = []
+        for pk in range(1, count + 1):
+            recipe = Recipe(pk=pk, author=author, name=f'Рецепт {pk}',
+                            text='Описание рецепта. ' * 20,
+                            image='recipes/benchmark.jpg',
+                            cooking_time=self.rng.randint(5, 120))
+            recipe.is_favorited = self.rng.random() < 0.3
+            recipe.is_in_shopping_cart = self.rng.random() < 0.1
+            recipe._prefetched_objects_cache = {
+                'recipetag_set': [
+                    RecipeTag(recipe=recipe, tag=tag)
+                    for tag in self.rng.sample(tags, TAGS_PER_RECIPE)],
+                'recipeingredient_set': [
+                    RecipeIngredient(recipe=recipe, ingredient=ingredient,
+                                     amount=self.rng.randint(1, 500))
+                    for ingredient in self.rng.sample(
+                        ingredients, INGREDIENTS_PER_RECIPE)],
+            }
+            recipes.append(recipe)
+        return recipes
+
+    def build_validated_data(self, tags, ingredients):
+        return {
+            'name': 'Рецепт для замера',
+            'text': 'Описание рецепта. ' * 20,
+            'cooking_time': 30,
+            'image': 'recipes/benchmark.jpg',
+            'tags': [tag.pk for tag in tags[:TAGS_PER_RECIPE]],
+            'ingredients': [
+                {'ingredient': {'id': ingredient.pk},
+                 'amount': self.rng.randint(1, 500)}
+                for ingredient in ingredients[:INGREDIENTS_PER_RECIPE]],
+        }
+
+    def build_base64_image(self, size):
+        pixels = size / JPEG_BYTES_PER_PIXEL
+        width = int((pixels * 4 / 3) ** 0.5)
+        height = int(width * 3 / 4)
+        image = Image.frombytes(
+            'RGB', (width, height), self.rng.randbytes(width * height * 3))
+        buffer = io.BytesIO()
+        image.save(buffer, format='JPEG', quality=85)
+        encoded = base64.b64encode(buffer.getvalue()).decode()
+        return f'data:image/jpeg;base64,{encoded}'
+
+    def measure(self, func):
+        for _ in range(self.options['warmup']):
+            func()
+        timings = []
+        for _ in range(self.options['repeat']):
+            started = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - started)
+
+        tracemalloc.start()
+        try:
+            tracemalloc.reset_peak()
+            before, _ = tracemalloc.get_traced_memory()
+            func()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        return {
+            'median_us': round(statistics.median(timings) * 1e6, 1),
+            'min_us': round(min(timings) * 1e6, 1),
+            'mean_us': round(statistics.mean(timings) * 1e6, 1),
+            'peak_kb': round((peak - before) / 1024, 1),
+        }
+
+    def format_result(self, name, result):
+        return (f'{name:<55} median {result["median_us"]:>12.1f} us  '
+                f'min {result["min_us"]:>12.1f} us  '
+                f'peak {result["peak_kb"]:>10.1f} KiB')
+
+    def compare(self, baseline, report):
+        self.stdout.write(self.style.NOTICE('Comparison with baseline:'))
+        regressions = 0
+        for name, result in report['cases'].items():
+            previous = baseline['cases'].get(name)
+            if previous is None:
+                continue
+            change = ((result['median_us'] - previous['median_us'])
+                      / previous['median_us'] * 100)
+            regressed = change > self.options['threshold']
+            regressions += regressed
+            style = self.style.ERROR if regressed else self.style.SUCCESS
+            self.stdout.write(style(
+                f'{name:<55} {previous["median_us"]:>12.1f} -> '
+                f'{result["median_us"]:>12.1f} us ({change:+.1f}%), '
+                f'peak {previous["peak_kb"]} -> {result["peak_kb"]} KiB'))
+        if regressions:
+            raise CommandError(
+                f'{regressions} cases are more than '
+                f'{self.options["threshold"]}% slower than the baseline')
@@ -0,0 +1,211 @@
+import io
+import itertools
+import random
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from PIL import Image
+
+from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                            RecipeTag, ShoppingCart, Tag)
+from recipes.services.catalog_cache import ingredient_catalog, tag_catalog
+from recipes.services.images import store_image
+from recipes.services.shopping_cart_service import ShoppingCartService
+from users.models import Subscription, User
+
+
+class ZipfSampler:
+    max_rounds = 20
+
+    def __init__(self, population, exponent, rng):
+        self.population = list(population)
+        self.rng = rng
+        weights = [1 / rank ** exponent
+                   for rank in range(1, len(self.population) + 1)]
+        self.cum_weights = list(itertools.accumulate(weights))
+
+    def sample(self, count):
+        count = min(count, len(self.population))
+        chosen = set()
+        for _ in range(self.max_rounds):
+            if len(chosen) >= count:
+                return chosen
+            chosen.update(self.rng.choices(
+                self.population, cum_weights=self.cum_weights,
+                k=count - len(chosen)))
+        remaining = [value for value in self.population
+                     if value not in chosen]
+        chosen.update(self.rng.sample(remaining, count - len(chosen)))
+        return chosen
+
+
+class Command(BaseCommand):
+    help = 'Generates a synthetic dataset with skewed popularity'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=10000)
+        parser.add_argument('--tags', type=int, default=10,
+                            help='Tags to create when the table is empty')
+        parser.add_argument('--ingredients', type=int, default=2000,
+                            help='Ingredients to create when the table '
+                                 'is empty')
+        parser.add_argument('--ingredients-per-recipe', type=int,
+                            nargs=2, default=(3, 15), metavar=('MIN', 'MAX'))
+        parser.add_argument('--tags-per-recipe', type=int,
+                            nargs=2, default=(1, 3), metavar=('MIN', 'MAX'))
+        parser.add_argument('--favorites-per-user', type=int, default=20)
+        parser.add_argument('--cart-per-user', type=int, default=5)
+        parser.add_argument('--subscriptions-per-user', type=int, default=10)
+        parser.add_argument('--zipf', type=float, default=1.1,
+                            help='Exponent of the popularity distribution')
+        parser.add_argument('--prefix', default='synthetic',
+                            help='Prefix for generated usernames and names')
+        parser.add_argument('--password', default='synthetic-password')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.rng = random.Random(options['seed'])
+        self.chunk_size = options['chunk_size']
+        self.prefix = options['prefix']
+        if User.objects.filter(
+                username__startswith=f'{self.prefix}_').exists():
+            raise CommandError(
+                f'Users with prefix "{self.prefix}" already exist, '
+                'choose another --prefix')
+
+        tag_ids = self.ensure_tags()
+        ingredient_ids = self.ensure_ingredients()
+        user_ids = self.create_users()
+        recipe_ids = self.create_recipes(user_ids, tag_ids, ingredient_ids)
+
+        popular_recipes = list(recipe_ids)
+        self.rng.shuffle(popular_recipes)
+        popular_authors = list(user_ids)
+        self.rng.shuffle(popular_authors)
+        self.create_relations(
+            Favorite, 'recipe_id', user_ids, popular_recipes,
+            options['favorites_per_user'])
+        self.create_relations(
+            ShoppingCart, 'recipe_id', user_ids, popular_recipes,
+            options['cart_per_user'])
+        self.create_relations(
+            Subscription, 'author_id', user_ids, popular_authors,
+            options['subscriptions_per_user'])
+        for chunk in self.chunks(user_ids):
+            ShoppingCartService.rebuild(chunk)
+        tag_catalog.invalidate()
+        ingredient_catalog.invalidate()
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated {len(user_ids)} users and {len(recipe_ids)} recipes'))
+
+    def ensure_tags(self):
+        tag_ids = list(Tag.objects.values_list('pk', flat=True))
+        if tag_ids:
+            return tag_ids
+        Tag.objects.bulk_create(
+            Tag(name=f'{self.prefix} tag {i}', color=f'#{i:06x}',
+                slug=f'{self.prefix}-tag-{i}')
+            for i in range(self.options['tags']))
+        return list(Tag.objects.values_list('pk', flat=True))
+
+    def ensure_ingredients(self):
+        ingredient_ids = list(Ingredient.objects.values_list('pk', flat=True))
+        if ingredient_ids:
+            return ingredient_ids
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'{self.prefix} ingredient {i}',
+                       measurement_unit=self.rng.choice(['г', 'мл', 'шт.']))
+            for i in range(self.options['ingredients']))
+        return list(Ingredient.objects.values_list('pk', flat=True))
+
+    def create_users(self):
+        password = make_password(self.options['password'])
+        for chunk in self.chunks(range(self.options['users'])):
+            User.objects.bulk_create(
+                User(email=f'{self.prefix}_{i}@example.com',
+                     username=f'{self.prefix}_{i}',
+                     first_name='Synthetic', last_name=str(i),
+                     password=password)
+                for i in chunk)
+        self.stdout.write(f'users: {self.options["users"]} created')
+        return list(User.objects.filter(
+            username__startswith=f'{self.prefix}_'
+        ).order_by('pk').values_list('pk', flat=True))
+
+    def create_recipes(self, user_ids, tag_ids, ingredient_ids):
+        image_name = self.ensure_image()
+        authors = ZipfSampler(user_ids, self.options['zipf'], self.rng)
+        ingredients = ZipfSampler(
+            ingredient_ids, self.options['zipf'], self.rng)
+        created = 0
+        for chunk in self.chunks(range(self.options['recipes'])):
+            with transaction.atomic():
+                recipes = Recipe.objects.bulk_create(
+                    Recipe(author_id=authors.sample(1).pop(),
+                           name=f'{self.prefix} recipe {i}',
+                           text=f'Synthetic recipe number {i}.',
+                           cooking_time=self.rng.randint(5, 180),
+                           image=image_name)
+                    for i in chunk)
+                recipe_tags = []
+                recipe_ingredients = []
+                for recipe in recipes:
+                    tag_count = self.rng.randint(
+                        *self.options['tags_per_recipe'])
+                    recipe_tags.extend(
+                        RecipeTag(recipe=recipe, tag_id=tag_id)
+                        for tag_id in self.rng.sample(
+                            tag_ids, min(tag_count, len(tag_ids))))
+                    ingredient_count = self.rng.randint(
+                        *self.options['ingredients_per_recipe'])
+                    recipe_ingredients.extend(
+                        RecipeIngredient(recipe=recipe,
+                                         ingredient_id=ingredient_id,
+                                         amount=self.rng.randint(1, 500))
+                        for ingredient_id in ingredients.sample(
+                            ingredient_count))
+                RecipeTag.objects.bulk_create(recipe_tags)
+                RecipeIngredient.objects.bulk_create(recipe_ingredients)
+            created += len(recipes)
+            self.stdout.write(f'recipes: {created} created')
+        return list(Recipe.objects.filter(
+            name__startswith=f'{self.prefix} recipe '
+        ).values_list('pk', flat=True))
+
+    def create_relations(self, model, target_field, user_ids, targets,
+                         per_user):
+        if not targets or not per_user:
+            return
+        sampler = ZipfSampler(targets, self.options['zipf'], self.rng)
+        created = 0
+        for chunk in self.chunks(user_ids):
+            rows = []
+            for user_id in chunk:
+                count = min(self.rng.randint(0, per_user * 2), len(targets))
+                rows.extend(
+                    model(user_id=user_id, **{target_field: target})
+                    for target in sampler.sample(count)
+                    if target != user_id or target_field != 'author_id')
+            model.objects.bulk_create(rows, ignore_conflicts=True)
+            created += len(rows)
+        self.stdout.write(f'{model._meta.verbose_name_plural}: '
+                          f'{created} created')
+
+    def ensure_image(self):
+        buffer = io.BytesIO()
+        Image.new('RGB', (480, 320), (230, 150, 80)).save(
+            buffer, format='JPEG')
+        return store_image(ContentFile(buffer.getvalue()))
+
+    def chunks(self, values):
+        values = iter(values)
+        while True:
+            chunk = list(itertools.islice(values, self.chunk_size))
+            if not chunk:
+                return
+            yield chunk
@@ -1,13 +1,26 @@
 import csv
+import io
+import itertools
 import json
+import os
+import time
 
-from django.core.exceptions import ObjectDoesNotExist
+from django.contrib.auth.hashers import PBKDF2PasswordHasher, make_password
+from django.core.files import File
 from django.core.management.base import BaseCommand
+from django.db import connection, transaction
 
 from recipes.models import Ingredient, Recipe, RecipeIngredient, RecipeTag, Tag
+from recipes.services.catalog_cache import ingredient_catalog, tag_catalog
+from recipes.services.images import store_image
 from users.models import User
 
 
+class SeedPasswordHasher(PBKDF2PasswordHasher):
+    """PBKDF2 with few iterations, upgraded by Django on the first login."""
+    iterations = 1000
+
+
 class Command(BaseCommand):
     help = 'Imports data from CSV files and generates recipes'
 
@@ -18,112 +31,260 @@ class Command(BaseCommand):
             default='../../data/',
             help='Path to data directory'
         )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=5000,
+            help='Number of rows written per transaction'
+        )
+        parser.add_argument(
+            '--resume',
+            action='store_true',
+            help='Skip rows committed by a previous interrupted run'
+        )
+        parser.add_argument(
+            '--state-file',
+            default='.import_basic_data.json',
+            help='File used to record committed rows for --resume'
+        )
+        parser.add_argument(
+            '--no-copy',
+            action='store_true',
+            help='Do not use COPY for ingredients on PostgreSQL'
+        )
+        parser.add_argument(
+            '--fast-passwords',
+            action='store_true',
+            help='Hash seed passwords with few PBKDF2 iterations'
+        )
 
     def handle(self, *args, **options):
         data_path = options['data_path']
+        self.chunk_size = options['chunk_size']
+        self.state_file = options['state_file']
+        self.use_copy = (connection.vendor == 'postgresql'
+                         and not options['no_copy'])
+        self.state = self.load_state() if options['resume'] else {}
+        self.password_hasher = (SeedPasswordHasher()
+                                if options['fast_passwords'] else 'default')
+
         self.import_users_from_csv(data_path + 'users.csv')
         self.stdout.write(self.style.SUCCESS('Imported users'))
         self.import_tags_from_csv(data_path + 'tags.csv')
+        tag_catalog.invalidate()
         self.stdout.write(self.style.SUCCESS('Imported tags'))
         self.import_ingredients_from_csv(data_path + 'ingredients.csv')
         self.stdout.write(self.style.SUCCESS('Imported ingredients'))
-        recipes_data = self.load_recipes_from_json(data_path + 'recipes.json')
-        self.generate_recipes_for_all_users(recipes_data, data_path)
+        self.generate_recipes_for_all_users(
+            self.find_recipes_source(data_path), data_path)
+        ingredient_catalog.invalidate()
         self.stdout.write(self.style.SUCCESS('Generated recipes'))
+        if os.path.exists(self.state_file):
+            os.remove(self.state_file)
 
     def import_users_from_csv(self, csv_path):
         self.stdout.write(self.style.NOTICE(
             f'Importing users from {csv_path}...'))
         with open(csv_path, newline='') as csvfile:
-            reader = csv.reader(csvfile)
-            for row in reader:
-                email, username, first_name, last_name, password = row
-                try:
-                    User.objects.get(username=username)
-                except ObjectDoesNotExist:
-                    user = User.objects.create_user(
-                        email=email,
-                        username=username,
-                        first_name=first_name,
-                        last_name=last_name,
-                        password=password
-                    )
-                    user.save()
+            self.process_chunks(
+                'users', csv.reader(csvfile), self.write_users)
 
     def import_tags_from_csv(self, csv_path):
         self.stdout.write(self.style.NOTICE(
             f'Importing tags from {csv_path}...'))
         with open(csv_path, newline='') as csvfile:
-            reader = csv.reader(csvfile)
-            for row in reader:
-                name, color, slug = row
-                try:
-                    Tag.objects.get(name=name)
-                except ObjectDoesNotExist:
-                    tag = Tag.objects.create(name=name, color=color, slug=slug)
-                    tag.save()
+            self.process_chunks('tags', csv.reader(csvfile), self.write_tags)
 
     def import_ingredients_from_csv(self, csv_path):
         self.stdout.write(self.style.NOTICE(
             f'Importing ingredients from {csv_path}...'))
         with open(csv_path, newline='') as csvfile:
-            reader = csv.reader(csvfile)
-            for row in reader:
-                name, measurement_unit = row
-                ingredient = Ingredient.objects.filter(name=name).first()
-                if ingredient is None:
-                    ingredient = Ingredient.objects.create(
-                        name=name, measurement_unit=measurement_unit)
-                    ingredient.save()
-
-    def load_recipes_from_json(self, json_path):
-        self.stdout.write(self.style.NOTICE(
-            f'Loading recipes from {json_path}...'))
-        with open(json_path, 'r') as jsonfile:
-            return json.load(jsonfile)
-
-    def generate_recipes_for_all_users(self, recipes_data, data_path):
-        users = User.objects.all()
-        user_count = users.count()
-        for i, recipe_data in enumerate(recipes_data['recipes']):
-            user = users[i % user_count]
-            self.generate_recipe_for_user(user, recipe_data, data_path)
-
-    def generate_recipe_for_user(self, user, recipe_data, data_path):
-        recipe_name = recipe_data['name']
-        if Recipe.objects.filter(name=recipe_name).exists():
-            return
-
-        for ingredient_data in recipe_data['ingredients']:
-            ingredient, created = Ingredient.objects.get_or_create(
-                name=ingredient_data['name'],
-                defaults={'measurement_unit': ingredient_data['unit']}
+            self.process_chunks(
+                'ingredients', csv.reader(csvfile), self.write_ingredients)
+
+    def find_recipes_source(self, data_path):
+        jsonl_path = data_path + 'recipes.jsonl'
+        if os.path.exists(jsonl_path):
+            return jsonl_path
+        return data_path + 'recipes.json'
+
+    def load_recipes(self, path):
+        self.stdout.write(self.style.NOTICE(f'Loading recipes from {path}...'))
+        with open(path, 'r') as jsonfile:
+            if path.endswith('.jsonl'):
+                for line in jsonfile:
+                    if line.strip():
+                        yield json.loads(line)
+            else:
+                yield from json.load(jsonfile)['recipes']
+
+    def generate_recipes_for_all_users(self, recipes_path, data_path):
+        user_ids = list(User.objects.values_list('pk', flat=True))
+        self.data_path = data_path
+        self.process_chunks(
+            'recipes',
+            zip(itertools.cycle(user_ids), self.load_recipes(recipes_path)),
+            self.write_recipes)
+
+    def process_chunks(self, source, rows, write):
+        done = self.state.get(source, 0)
+        rows = iter(rows)
+        if done:
+            self.stdout.write(self.style.NOTICE(
+                f'Skipping {done} {source} rows committed earlier'))
+            for _ in itertools.islice(rows, done):
+                pass
+        started = time.monotonic()
+        processed = 0
+        while True:
+            chunk = list(itertools.islice(rows, self.chunk_size))
+            if not chunk:
+                break
+            with transaction.atomic():
+                created = write(chunk)
+            processed += len(chunk)
+            self.state[source] = done + processed
+            self.save_state()
+            rate = processed / max(time.monotonic() - started, 1e-6)
+            self.stdout.write(
+                f'{source}: {done + processed} rows processed, '
+                f'{created} created ({rate:.0f} rows/s)')
+
+    def write_users(self, rows):
+        usernames = {row[1] for row in rows}
+        existing = set(User.objects.filter(
+            username__in=usernames).values_list('username', flat=True))
+        users = {}
+        for email, username, first_name, last_name, password in rows:
+            if username in existing or username in users:
+                continue
+            users[username] = User(
+                email=User.objects.normalize_email(email),
+                username=username,
+                first_name=first_name,
+                last_name=last_name,
+                password=self.hash_password(password)
             )
+        User.objects.bulk_create(users.values(), ignore_conflicts=True)
+        return User.objects.filter(username__in=users).count()
 
-        tags = [Tag.objects.get(name=tag) for tag in recipe_data['tags']]
+    def hash_password(self, password):
+        return make_password(password, hasher=self.password_hasher)
 
-        recipe = Recipe.objects.create(
-            author=user,
-            name=recipe_name,
-            text=recipe_data['text'],
-            cooking_time=recipe_data['cooking_time'],
-        )
+    def write_tags(self, rows):
+        names = {row[0] for row in rows}
+        existing = set(Tag.objects.filter(
+            name__in=names).values_list('name', flat=True))
+        tags = {name: Tag(name=name, color=color, slug=slug)
+                for name, color, slug in rows if name not in existing}
+        Tag.objects.bulk_create(tags.values(), ignore_conflicts=True)
+        return Tag.objects.filter(name__in=tags).count()
 
-        image_name = recipe_data['slug'] + '.jpeg'
-        image_path = f"{data_path}img/{image_name}"
-        self.stdout.write(self.style.NOTICE(
-            f'Importing image for {recipe.name} from {image_path}...'))
-        with open(image_path, 'rb') as f:
-            recipe.image.save(image_name, f)
-            recipe.save()
-
-        for tag in tags:
-            RecipeTag.objects.create(recipe=recipe, tag=tag)
-
-        for ingredient_data in recipe_data['ingredients']:
-            ingredient = Ingredient.objects.get(name=ingredient_data['name'])
-            RecipeIngredient.objects.create(
-                recipe=recipe,
-                ingredient=ingredient,
-                amount=ingredient_data['quantity']
+    def write_ingredients(self, rows):
+        if self.use_copy:
+            return self.copy_ingredients(rows)
+        return len(self.create_missing_ingredients(rows))
+
+    def create_missing_ingredients(self, rows):
+        names = {name for name, _ in rows}
+        existing = set(Ingredient.objects.filter(
+            name__in=names).values_list('name', flat=True))
+        ingredients = {}
+        for name, measurement_unit in rows:
+            if name not in existing and name not in ingredients:
+                ingredients[name] = Ingredient(
+                    name=name, measurement_unit=measurement_unit)
+        Ingredient.objects.bulk_create(ingredients.values())
+        return ingredients
+
+    def copy_ingredients(self, rows):
+        table = Ingredient._meta.db_table
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TEMPORARY TABLE import_ingredient '
+                '(name varchar(200), measurement_unit varchar(50)) '
+                'ON COMMIT DROP')
+            cursor.copy_expert(
+                'COPY import_ingredient (name, measurement_unit) '
+                'FROM STDIN WITH (FORMAT csv)', buffer)
+            cursor.execute(
+                f'INSERT INTO {table} (name, measurement_unit) '
+                'SELECT DISTINCT ON (src.name) src.name, '
+                'src.measurement_unit FROM import_ingredient src '
+                f'WHERE NOT EXISTS (SELECT 1 FROM {table} dst '
+                'WHERE dst.name = src.name)')
+            return cursor.rowcount
+
+    def write_recipes(self, rows):
+        names = {recipe_data['name'] for _, recipe_data in rows}
+        existing = set(Recipe.objects.filter(
+            name__in=names).values_list('name', flat=True))
+        rows = [(author_id, recipe_data) for author_id, recipe_data in rows
+                if recipe_data['name'] not in existing]
+        if not rows:
+            return 0
+
+        ingredient_ids = self.resolve_ingredients(rows)
+        tag_ids = dict(Tag.objects.values_list('name', 'pk'))
+
+        recipes = {}
+        for author_id, recipe_data in rows:
+            if recipe_data['name'] in recipes:
+                continue
+            recipe = Recipe(
+                author_id=author_id,
+                name=recipe_data['name'],
+                text=recipe_data['text'],
+                cooking_time=recipe_data['cooking_time'],
             )
+            self.attach_image(recipe, recipe_data)
+            recipes[recipe.name] = recipe
+        Recipe.objects.bulk_create(recipes.values())
+
+        recipe_tags = []
+        recipe_ingredients = []
+        for _, recipe_data in rows:
+            recipe = recipes[recipe_data['name']]
+            recipe_tags.extend(
+                RecipeTag(recipe=recipe, tag_id=tag_ids[tag])
+                for tag in recipe_data['tags'])
+            recipe_ingredients.extend(
+                RecipeIngredient(
+                    recipe=recipe,
+                    ingredient_id=ingredient_ids[ingredient_data['name']],
+                    amount=ingredient_data['quantity'])
+                for ingredient_data in recipe_data['ingredients'])
+        RecipeTag.objects.bulk_create(recipe_tags, ignore_conflicts=True)
+        RecipeIngredient.objects.bulk_create(
+            recipe_ingredients, ignore_conflicts=True)
+        return len(recipes)
+
+    def resolve_ingredients(self, rows):
+        self.create_missing_ingredients([
+            (ingredient_data['name'], ingredient_data['unit'])
+            for _, recipe_data in rows
+            for ingredient_data in recipe_data['ingredients']
+        ])
+        names = {ingredient_data['name']
+                 for _, recipe_data in rows
+                 for ingredient_data in recipe_data['ingredients']}
+        return dict(Ingredient.objects.filter(
+            name__in=names).values_list('name', 'pk'))
+
+    def attach_image(self, recipe, recipe_data):
+        image_path = f'{self.data_path}img/{recipe_data["slug"]}.jpeg'
+        with open(image_path, 'rb') as f:
+            recipe.image = store_image(File(f))
+
+    def load_state(self):
+        if not os.path.exists(self.state_file):
+            return {}
+        with open(self.state_file) as state_file:
+            return json.load(state_file)
+
+    def save_state(self):
+        with open(self.state_file, 'w') as state_file:
+            json.dump(self.state, state_file)
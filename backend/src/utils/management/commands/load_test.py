@@ -0,0 +1,178 @@
+import json
+import random
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client
+from rest_framework.authtoken.models import Token
+
+from recipes.models import Ingredient, Tag
+from users.models import User
+
+DEFAULT_MIX = 'recipes=50,subscriptions=20,ingredients=20,download=10'
+
+
+def percentile(values, percent):
+    if not values:
+        return None
+    values = sorted(values)
+    index = max(0, min(len(values) - 1,
+                       round(percent / 100 * len(values) + 0.5) - 1))
+    return values[index]
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = 'Replays a request mix in-process and reports latency stats'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=1000)
+        parser.add_argument('--concurrency', type=int, default=4)
+        parser.add_argument('--mix', default=DEFAULT_MIX,
+                            help='Comma separated scenario=weight pairs')
+        parser.add_argument('--users', type=int, default=50,
+                            help='Number of users to sample tokens from')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--output', help='Write the JSON report here')
+        parser.add_argument('--compare',
+                            help='Baseline JSON report to compare against')
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.rng_lock = threading.Lock()
+        scenarios = self.parse_mix(options['mix'])
+        self.tokens = self.get_tokens(options['users'])
+        self.tags = list(Tag.objects.values_list('slug', flat=True))
+        self.ingredient_prefixes = [
+            name[:self.rng.randint(1, 4)]
+            for name in Ingredient.objects.values_list(
+                'name', flat=True)[:500]
+        ] or ['а']
+        plan = self.rng.choices(
+            list(scenarios), weights=list(scenarios.values()),
+            k=options['requests'])
+
+        results = defaultdict(list)
+        started = time.perf_counter()
+        with ThreadPoolExecutor(options['concurrency']) as executor:
+            for scenario, result in executor.map(self.run_request, plan):
+                results[scenario].append(result)
+        elapsed = time.perf_counter() - started
+
+        report = self.build_report(results, elapsed)
+        output = json.dumps(report, indent=2, ensure_ascii=False)
+        if options['output']:
+            with open(options['output'], 'w') as report_file:
+                report_file.write(output)
+        self.stdout.write(output)
+        if options['compare']:
+            with open(options['compare']) as baseline_file:
+                self.print_comparison(json.load(baseline_file), report)
+
+    def parse_mix(self, mix):
+        scenarios = {}
+        for item in mix.split(','):
+            name, _, weight = item.partition('=')
+            if not hasattr(self, f'scenario_{name.strip()}'):
+                raise CommandError(f'Unknown scenario: {name}')
+            scenarios[name.strip()] = float(weight or 1)
+        return scenarios
+
+    def get_tokens(self, count):
+        users = User.objects.order_by('?')[:count]
+        tokens = [Token.objects.get_or_create(user=user)[0].key
+                  for user in users]
+        if not tokens:
+            raise CommandError('No users found, generate data first')
+        return tokens
+
+    def choice(self, values):
+        with self.rng_lock:
+            return self.rng.choice(values)
+
+    def run_request(self, scenario):
+        client = Client(
+            HTTP_AUTHORIZATION=f'Token {self.choice(self.tokens)}',
+            raise_request_exception=False)
+        counter = QueryCounter()
+        try:
+            with connection.execute_wrapper(counter):
+                started = time.perf_counter()
+                response = getattr(self, f'scenario_{scenario}')(client)
+                if response.streaming:
+                    for _ in response.streaming_content:
+                        pass
+                latency = time.perf_counter() - started
+        finally:
+            connections.close_all()
+        return scenario, {
+            'latency': latency,
+            'queries': counter.count,
+            'status': response.status_code,
+        }
+
+    def scenario_recipes(self, client):
+        params = {'page': self.choice([1, 1, 1, 2, 3]), 'limit': 6}
+        if self.tags and self.choice([True, False]):
+            params['tags'] = self.choice(self.tags)
+        return client.get('/api/recipes/', params)
+
+    def scenario_subscriptions(self, client):
+        return client.get('/api/users/subscriptions/',
+                          {'page': 1, 'limit': 6, 'recipes_limit': 3})
+
+    def scenario_ingredients(self, client):
+        return client.get('/api/ingredients/',
+                          {'name': self.choice(self.ingredient_prefixes)})
+
+    def scenario_download(self, client):
+        return client.get('/api/recipes/download_shopping_cart/')
+
+    def build_report(self, results, elapsed):
+        total = sum(len(items) for items in results.values())
+        report = {
+            'requests': total,
+            'elapsed_seconds': round(elapsed, 3),
+            'throughput_rps': round(total / elapsed, 2) if elapsed else None,
+            'scenarios': {},
+        }
+        for scenario, items in sorted(results.items()):
+            latencies = [item['latency'] * 1000 for item in items]
+            queries = [item['queries'] for item in items]
+            report['scenarios'][scenario] = {
+                'requests': len(items),
+                'errors': sum(item['status'] >= 400 for item in items),
+                'p50_ms': round(percentile(latencies, 50), 3),
+                'p95_ms': round(percentile(latencies, 95), 3),
+                'p99_ms': round(percentile(latencies, 99), 3),
+                'mean_queries': round(sum(queries) / len(queries), 2),
+                'max_queries': max(queries),
+            }
+        return report
+
+    def print_comparison(self, baseline, report):
+        self.stdout.write(self.style.NOTICE('Comparison with baseline:'))
+        for scenario, stats in report['scenarios'].items():
+            previous = baseline.get('scenarios', {}).get(scenario)
+            if previous is None:
+                continue
+            for metric in ('p50_ms', 'p95_ms', 'p99_ms', 'mean_queries'):
+                before, after = previous[metric], stats[metric]
+                change = (after - before) / before * 100 if before else 0
+                style = (self.style.ERROR if change > 10
+                         else self.style.SUCCESS)
+                self.stdout.write(style(
+                    f'{scenario} {metric}: {before} -> {after} '
+                    f'({change:+.1f}%)'))
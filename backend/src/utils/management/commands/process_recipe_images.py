@@ -0,0 +1,72 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from recipes.models import Recipe
+from recipes.services import image_processing, images
+
+
+class Command(BaseCommand):
+    help = ('Moves recipe images to content-hashed names and generates '
+            'their resized variants, or processes queued uploads')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=200,
+            help='Number of recipes updated per query'
+        )
+        parser.add_argument(
+            '--pending',
+            action='store_true',
+            help=('Process uploads left pending or failed, for example '
+                  'after a restart dropped the queued tasks')
+        )
+
+    def handle(self, *args, **options):
+        if options['pending']:
+            self.process_pending()
+            return
+        recipes = Recipe.objects.exclude(image='').only(
+            'pk', 'image', 'updated_at').order_by('pk')
+        processed = failed = 0
+        changed = []
+        for recipe in recipes.iterator(chunk_size=options['chunk_size']):
+            if images.get_variant_names(recipe.image.name) is not None:
+                continue
+            try:
+                with default_storage.open(recipe.image.name) as image_file:
+                    recipe.image = images.store_image(image_file)
+                recipe.updated_at = timezone.now()
+            except (OSError, images.InvalidImage) as error:
+                failed += 1
+                self.stdout.write(self.style.WARNING(
+                    f'Recipe {recipe.pk}: {error}'))
+                continue
+            changed.append(recipe)
+            if len(changed) == options['chunk_size']:
+                processed += self.save(changed)
+        processed += self.save(changed)
+        self.stdout.write(self.style.SUCCESS(
+            f'Processed {processed} images, {failed} failed'))
+
+    def process_pending(self):
+        pending = Recipe.objects.exclude(image_upload='').values_list(
+            'pk', 'image_upload')
+        processed = failed = 0
+        for recipe_id, upload_name in list(pending):
+            status = image_processing.process_image(
+                recipe_id, upload_name, retry=False)
+            if status == Recipe.ImageStatus.READY:
+                processed += 1
+            elif status == Recipe.ImageStatus.FAILED:
+                failed += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Processed {processed} uploads, {failed} failed'))
+
+    def save(self, recipes):
+        count = len(recipes)
+        Recipe.objects.bulk_update(recipes, ['image', 'updated_at'])
+        recipes.clear()
+        return count
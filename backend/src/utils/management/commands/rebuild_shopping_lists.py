@@ -0,0 +1,77 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.services.shopping_cart_service import ShoppingCartService
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds or verifies aggregated shopping list totals'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Only report users whose totals differ from their carts'
+        )
+        parser.add_argument(
+            '--user',
+            type=int,
+            action='append',
+            dest='user_ids',
+            help='Limit to the given user id (can be repeated)'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=500,
+            help='Number of users processed per transaction'
+        )
+
+    def handle(self, *args, **options):
+        user_ids = options['user_ids']
+        if user_ids is None:
+            user_ids = User.objects.order_by('pk').values_list(
+                'pk', flat=True).iterator()
+        chunk_size = options['chunk_size']
+        mismatched = processed = 0
+        for chunk in self.iter_chunks(user_ids, chunk_size):
+            processed += len(chunk)
+            if options['verify']:
+                mismatched += self.verify_chunk(chunk)
+            else:
+                rows = ShoppingCartService.rebuild(chunk)
+                self.stdout.write(self.style.NOTICE(
+                    f'Rebuilt {rows} rows for {processed} users...'))
+
+        if not options['verify']:
+            self.stdout.write(self.style.SUCCESS(
+                f'Rebuilt shopping lists for {processed} users'))
+        elif mismatched:
+            raise CommandError(
+                f'{mismatched} of {processed} users have stale totals')
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f'Shopping lists of {processed} users are consistent'))
+
+    def verify_chunk(self, user_ids):
+        expected = ShoppingCartService.get_expected_totals(user_ids)
+        stored = ShoppingCartService.get_stored_totals(user_ids)
+        stale_users = sorted({
+            key[0] for key in set(expected) | set(stored)
+            if expected.get(key) != stored.get(key)
+        })
+        for user_id in stale_users:
+            self.stdout.write(self.style.WARNING(
+                f'User {user_id} has stale shopping list totals'))
+        return len(stale_users)
+
+    @staticmethod
+    def iter_chunks(values, size):
+        chunk = []
+        for value in values:
+            chunk.append(value)
+            if len(chunk) == size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
@@ -0,0 +1,88 @@
+import os
+import time
+
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY,
+                               CollectorRegistry, Counter, Histogram,
+                               generate_latest, multiprocess)
+
+UNRESOLVED_VIEW = '<unresolved>'
+
+REQUEST_DURATION = Histogram(
+    'foodgram_request_duration_seconds',
+    'Time spent handling a request, including middleware',
+    ['view', 'action', 'method'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+REQUESTS = Counter(
+    'foodgram_requests',
+    'Handled requests by response status',
+    ['view', 'action', 'method', 'status'],
+)
+QUERIES_PER_REQUEST = Histogram(
+    'foodgram_db_queries_per_request',
+    'Number of SQL queries executed by a request',
+    ['view', 'action'],
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 250),
+)
+DB_QUERIES = Counter(
+    'foodgram_db_queries',
+    'SQL queries executed',
+    ['view', 'action'],
+)
+DB_DURATION = Counter(
+    'foodgram_db_duration_seconds',
+    'Time spent executing SQL queries',
+    ['view', 'action'],
+)
+
+
+class QueryRecorder:
+    """Execute wrapper that counts queries of a single request.
+
+    The recorder is owned by one request, so it needs no locking; the
+    shared metrics are only touched once the request is finished.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+
+
+def get_view_labels(view_func, method):
+    """Returns (view, action) labels for a resolved view function."""
+    view_class = getattr(view_func, 'cls', None)
+    if view_class is None:
+        return (f'{view_func.__module__}.{view_func.__name__}',
+                method.lower())
+    actions = getattr(view_func, 'actions', None) or {}
+    return view_class.__name__, actions.get(method.lower(), method.lower())
+
+
+def observe_request(view, action, method, status, duration, recorder):
+    REQUEST_DURATION.labels(view, action, method).observe(duration)
+    REQUESTS.labels(view, action, method, status).inc()
+    QUERIES_PER_REQUEST.labels(view, action).observe(recorder.count)
+    if recorder.count:
+        DB_QUERIES.labels(view, action).inc(recorder.count)
+        DB_DURATION.labels(view, action).inc(recorder.duration)
+
+
+def get_registry():
+    """Collects metrics of all gunicorn workers in multi-process mode."""
+    if 'PROMETHEUS_MULTIPROC_DIR' not in os.environ:
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def render_metrics():
+    return generate_latest(get_registry()), CONTENT_TYPE_LATEST
@@ -0,0 +1,117 @@
+import logging
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+
+from . import metrics, profiling
+from .slow_queries import SlowQueryRecorder
+
+logger = logging.getLogger(__name__)
+
+
+class ViewLabelsMixin:
+    """Stores the view and action labels of the resolved view."""
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._view_labels = metrics.get_view_labels(
+            view_func, request.method)
+
+
+class ExecuteWrapperMiddleware(ViewLabelsMixin):
+    """Runs each request under a connection execute wrapper.
+
+    Streaming responses keep the wrapper installed while their content is
+    consumed, and finish() is called once the response is complete.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        wrapper = self.get_wrapper(request)
+        with connection.execute_wrapper(wrapper):
+            response = self.get_response(request)
+        if response.streaming:
+            response.streaming_content = self.stream(
+                response.streaming_content, request, response, wrapper)
+        else:
+            self.finish(request, response, wrapper)
+        return response
+
+    def stream(self, content, request, response, wrapper):
+        try:
+            with connection.execute_wrapper(wrapper):
+                yield from content
+        finally:
+            self.finish(request, response, wrapper)
+
+    def get_wrapper(self, request):
+        raise NotImplementedError()
+
+    def finish(self, request, response, wrapper):
+        pass
+
+
+class MetricsMiddleware(ExecuteWrapperMiddleware):
+    """Records latency and SQL metrics per resolved view and action."""
+
+    def get_wrapper(self, request):
+        request._metrics_started = time.perf_counter()
+        return metrics.QueryRecorder()
+
+    def finish(self, request, response, recorder):
+        view, action = getattr(
+            request, '_view_labels', (metrics.UNRESOLVED_VIEW, ''))
+        metrics.observe_request(
+            view, action, request.method, response.status_code,
+            time.perf_counter() - request._metrics_started, recorder)
+
+
+class SlowQueryMiddleware(ExecuteWrapperMiddleware):
+    """Logs slow queries when SLOW_QUERY_LOG['FILE'] is configured."""
+
+    def __init__(self, get_response):
+        if not settings.SLOW_QUERY_LOG.get('FILE'):
+            raise MiddlewareNotUsed()
+        super().__init__(get_response)
+
+    def get_wrapper(self, request):
+        return SlowQueryRecorder(request, settings.SLOW_QUERY_LOG)
+
+
+class ProfilingMiddleware(ViewLabelsMixin):
+    """Profiles requests of admins who ask for it and a random sample."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        options = settings.PROFILING
+        user = None
+        if profiling.is_requested(request):
+            user = profiling.get_profiling_user(request)
+        sampled = user is None and profiling.is_sampled(options)
+        if user is None and not sampled:
+            return self.get_response(request)
+
+        profiler = profiling.RequestProfiler.start(
+            options, trace_memory=not sampled or options.get('TRACE_SAMPLED'))
+        if profiler is None:
+            return self.get_response(request)
+        try:
+            response = self.get_response(request)
+            if response.streaming:
+                # Profiled responses are buffered to include their content.
+                response.streaming_content = list(response.streaming_content)
+        finally:
+            profiler.stop()
+        try:
+            profile = profiler.save(request, response, user, sampled)
+        except Exception:
+            logger.exception('Saving the profile of %s failed', request.path)
+            return response
+        if user is not None:
+            response['X-Profile-Id'] = str(profile.pk)
+        return response
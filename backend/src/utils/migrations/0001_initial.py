@@ -0,0 +1,40 @@
+# Generated by Django 4.2 on 2026-10-18 05:10
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RequestProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('method', models.CharField(max_length=10, verbose_name='Метод')),
+                ('path', models.CharField(max_length=500, verbose_name='Путь')),
+                ('view', models.CharField(max_length=200, verbose_name='Представление')),
+                ('action', models.CharField(max_length=100, verbose_name='Действие')),
+                ('status_code', models.PositiveSmallIntegerField(verbose_name='Статус')),
+                ('duration_ms', models.FloatField(verbose_name='Длительность, мс')),
+                ('sampled', models.BooleanField(default=False, verbose_name='Случайная выборка')),
+                ('stats_file', models.CharField(max_length=255, verbose_name='Файл pstats')),
+                ('top_functions', models.TextField(verbose_name='Самые долгие функции')),
+                ('top_allocations', models.TextField(blank=True, verbose_name='Места выделения памяти')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='request_profiles', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Профиль запроса',
+                'verbose_name_plural': 'Профили запросов',
+                'ordering': ('-created_at',),
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+from django.contrib.auth import get_user_model
+from django.db import models
+
+User = get_user_model()
+
+
+class RequestProfile(models.Model):
+    created_at = models.DateTimeField(
+        auto_now_add=True, verbose_name='Дата создания')
+    method = models.CharField(max_length=10, verbose_name='Метод')
+    path = models.CharField(max_length=500, verbose_name='Путь')
+    view = models.CharField(max_length=200, verbose_name='Представление')
+    action = models.CharField(max_length=100, verbose_name='Действие')
+    status_code = models.PositiveSmallIntegerField(verbose_name='Статус')
+    duration_ms = models.FloatField(verbose_name='Длительность, мс')
+    user = models.ForeignKey(
+        User, null=True, blank=True, on_delete=models.SET_NULL,
+        related_name='request_profiles', verbose_name='Пользователь')
+    sampled = models.BooleanField(
+        default=False, verbose_name='Случайная выборка')
+    stats_file = models.CharField(
+        max_length=255, verbose_name='Файл pstats')
+    top_functions = models.TextField(verbose_name='Самые долгие функции')
+    top_allocations = models.TextField(
+        blank=True, verbose_name='Места выделения памяти')
+
+    class Meta:
+        ordering = ('-created_at',)
+        verbose_name = 'Профиль запроса'
+        verbose_name_plural = 'Профили запросов'
+
+    def __str__(self):
+        return f'{self.method} {self.path} ({self.created_at})'
@@ -0,0 +1,142 @@
+import cProfile
+import io
+import os
+import pstats
+import random
+import re
+import threading
+import time
+import tracemalloc
+import uuid
+
+from django.conf import settings
+from django.utils import timezone
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+
+from .metrics import UNRESOLVED_VIEW
+from .models import RequestProfile
+
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+PROFILE_QUERY_PARAM = '_profile'
+TRACEMALLOC_FRAMES = 10
+UNSAFE_FILENAME_CHARS = re.compile(r'[^\w.-]+')
+
+# cProfile and tracemalloc are process wide, so one request at a time.
+_profiling_lock = threading.Lock()
+
+
+def is_requested(request):
+    return (PROFILE_HEADER in request.META
+            or PROFILE_QUERY_PARAM in request.GET)
+
+
+def get_profiling_user(request):
+    """Returns the admin who asked for a profile, or None."""
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        try:
+            user_auth_tuple = TokenAuthentication().authenticate(request)
+        except AuthenticationFailed:
+            return None
+        user = user_auth_tuple[0] if user_auth_tuple else None
+    if user is not None and user.is_staff:
+        return user
+    return None
+
+
+def is_sampled(options):
+    sample_rate = options.get('SAMPLE_RATE', 0)
+    return sample_rate > 0 and random.randrange(sample_rate) == 0
+
+
+class RequestProfiler:
+    """Runs part of a request under cProfile and optionally tracemalloc."""
+
+    def __init__(self, options, trace_memory):
+        self.options = options
+        self.trace_memory = trace_memory and not tracemalloc.is_tracing()
+        self.profiler = cProfile.Profile()
+        self.snapshot = None
+        self.duration = 0.0
+
+    @classmethod
+    def start(cls, options, trace_memory):
+        if not _profiling_lock.acquire(blocking=False):
+            return None
+        profiler = cls(options, trace_memory)
+        if profiler.trace_memory:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        profiler.started = time.perf_counter()
+        profiler.profiler.enable()
+        return profiler
+
+    def stop(self):
+        self.profiler.disable()
+        self.duration = time.perf_counter() - self.started
+        try:
+            if self.trace_memory:
+                self.snapshot = tracemalloc.take_snapshot().filter_traces((
+                    tracemalloc.Filter(False, tracemalloc.__file__),
+                    tracemalloc.Filter(False, __file__),
+                ))
+                tracemalloc.stop()
+        finally:
+            _profiling_lock.release()
+
+    def get_top_functions(self):
+        stream = io.StringIO()
+        stats = pstats.Stats(self.profiler, stream=stream)
+        stats.sort_stats('cumulative').print_stats(
+            self.options.get('TOP_ENTRIES', 30))
+        return stream.getvalue()
+
+    def get_top_allocations(self):
+        if self.snapshot is None:
+            return ''
+        return '\n'.join(
+            str(statistic) for statistic in self.snapshot.statistics(
+                'lineno')[:self.options.get('TOP_ENTRIES', 30)])
+
+    def save(self, request, response, user, sampled):
+        profile_dir = self.options['DIR']
+        os.makedirs(profile_dir, exist_ok=True)
+        view, action = getattr(
+            request, '_view_labels', (UNRESOLVED_VIEW, ''))
+        label = UNSAFE_FILENAME_CHARS.sub('', f'{view}-{action}')[:100]
+        stats_file = (f'{timezone.now():%Y%m%d-%H%M%S}-{label}-'
+                      f'{uuid.uuid4().hex[:8]}.prof')
+        self.profiler.dump_stats(os.path.join(profile_dir, stats_file))
+        profile = RequestProfile.objects.create(
+            method=request.method,
+            path=request.path[:500],
+            view=view[:200],
+            action=action[:100],
+            status_code=response.status_code,
+            duration_ms=round(self.duration * 1000, 3),
+            user=user,
+            sampled=sampled,
+            stats_file=stats_file,
+            top_functions=self.get_top_functions(),
+            top_allocations=self.get_top_allocations(),
+        )
+        prune_profiles(self.options.get('MAX_PROFILES', 500))
+        return profile
+
+
+def remove_profile_files(profiles):
+    profile_dir = settings.PROFILING['DIR']
+    for stats_file in profiles.values_list('stats_file', flat=True):
+        try:
+            os.remove(os.path.join(profile_dir, stats_file))
+        except FileNotFoundError:
+            pass
+
+
+def prune_profiles(max_profiles):
+    stale_ids = list(RequestProfile.objects.values_list(
+        'pk', flat=True)[max_profiles:])
+    if stale_ids:
+        stale = RequestProfile.objects.filter(pk__in=stale_ids)
+        remove_profile_files(stale)
+        stale.delete()
@@ -0,0 +1,162 @@
+import json
+import logging
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from logging.handlers import RotatingFileHandler
+
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.db.models.sql.compiler import SQLCompiler
+
+from .metrics import UNRESOLVED_VIEW
+
+MAX_PARAMS_LENGTH = 1000
+INSTRUMENTATION_MODULES = frozenset(
+    ('utils.metrics', 'utils.middleware', 'utils.slow_queries'))
+
+_handlers = {}
+_handlers_lock = threading.Lock()
+
+
+def tag_origin(queryset, label):
+    """Remembers which code shaped a queryset.
+
+    The label is stored on the query, which survives cloning, so it is
+    still known when the queryset is evaluated somewhere else.
+    """
+    query = queryset.query
+    query.origins = getattr(query, 'origins', ()) + (label,)
+    return queryset
+
+
+class QueryOriginFilterSetMixin:
+    """Tags querysets with the filter methods that were applied."""
+
+    def filter_queryset(self, queryset):
+        for name, value in self.form.cleaned_data.items():
+            queryset_filter = self.filters[name]
+            filtered = queryset_filter.filter(queryset, value)
+            if filtered is not queryset:
+                method = queryset_filter.method
+                label = method if isinstance(method, str) else name
+                tag_origin(filtered, f'{type(self).__name__}.{label}')
+            queryset = filtered
+        return queryset
+
+
+def get_logger(path, max_bytes, backup_count):
+    logger = logging.getLogger(f'foodgram.slow_queries.{path}')
+    with _handlers_lock:
+        if path not in _handlers:
+            handler = RotatingFileHandler(
+                path, maxBytes=max_bytes, backupCount=backup_count,
+                encoding='utf-8')
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            logger.addHandler(handler)
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            _handlers[path] = handler
+    return logger
+
+
+def get_frame_name(frame):
+    code = frame.f_code
+    qualname = getattr(code, 'co_qualname', None)
+    if qualname:
+        return qualname
+    owner = frame.f_locals.get('self', frame.f_locals.get('cls'))
+    if owner is None:
+        return code.co_name
+    owner_class = owner if isinstance(owner, type) else type(owner)
+    return f'{owner_class.__name__}.{code.co_name}'
+
+
+def is_project_frame(frame, base_dir):
+    filename = frame.f_code.co_filename
+    return (filename.startswith(base_dir)
+            and 'site-packages' not in filename
+            and frame.f_globals.get('__name__') not in INSTRUMENTATION_MODULES)
+
+
+class SlowQueryRecorder:
+    """Execute wrapper that logs queries slower than a threshold."""
+
+    def __init__(self, request, options):
+        self.request = request
+        self.threshold = options['THRESHOLD_MS'] / 1000
+        self.explain = (options.get('EXPLAIN')
+                        and connection.vendor == 'postgresql')
+        self.stack_depth = options.get('STACK_DEPTH', 10)
+        self.base_dir = str(settings.BASE_DIR)
+        self.logger = get_logger(
+            options['FILE'], options.get('MAX_BYTES', 10 * 1024 * 1024),
+            options.get('BACKUP_COUNT', 5))
+        self.explaining = False
+
+    def __call__(self, execute, sql, params, many, context):
+        if self.explaining:
+            return execute(sql, params, many, context)
+        started = time.perf_counter()
+        # Failed queries are not recorded: EXPLAIN would run in an aborted
+        # transaction, and the caller should see the original error.
+        result = execute(sql, params, many, context)
+        duration = time.perf_counter() - started
+        if duration >= self.threshold:
+            self.record(sql, params, many, duration, context)
+        return result
+
+    def record(self, sql, params, many, duration, context):
+        view, action = getattr(
+            self.request, '_view_labels', (UNRESOLVED_VIEW, ''))
+        stack, origins = self.inspect_stack(sys._getframe(2))
+        record = {
+            'time': datetime.now(timezone.utc).isoformat(),
+            'duration_ms': round(duration * 1000, 3),
+            'view': view,
+            'action': action,
+            'method': self.request.method,
+            'path': self.request.path,
+            'call_site': stack[0]['function'] if stack else None,
+            'origins': origins,
+            'sql': sql,
+            'params': repr(params)[:MAX_PARAMS_LENGTH],
+            'stack': stack,
+        }
+        if self.explain and not many and sql.lstrip()[:6].upper() == 'SELECT':
+            record['explain'] = self.get_explain(
+                context['connection'], sql, params)
+        self.logger.info(json.dumps(record, ensure_ascii=False, default=str))
+
+    def inspect_stack(self, frame):
+        stack = []
+        origins = ()
+        while frame is not None:
+            owner = frame.f_locals.get('self')
+            if not origins and isinstance(owner, SQLCompiler):
+                query = owner.query
+                origins = getattr(query, 'origins', None) or getattr(
+                    getattr(query, 'inner_query', None), 'origins', ())
+            if (len(stack) < self.stack_depth
+                    and is_project_frame(frame, self.base_dir)):
+                stack.append({
+                    'function': get_frame_name(frame),
+                    'file': frame.f_code.co_filename[len(self.base_dir):]
+                    .lstrip('/'),
+                    'line': frame.f_lineno,
+                })
+            frame = frame.f_back
+        return stack, list(origins)
+
+    def get_explain(self, db_connection, sql, params):
+        self.explaining = True
+        try:
+            with transaction.atomic(using=db_connection.alias):
+                with db_connection.cursor() as cursor:
+                    cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+                    return cursor.fetchone()[0]
+        except DatabaseError as error:
+            return {'error': str(error)}
+        finally:
+            self.explaining = False
@@ -0,0 +1,695 @@
+import base64
+import io
+import json
+import os
+import shutil
+import tempfile
+from collections import namedtuple
+
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, connection, transaction
+from django.test import RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+from rest_framework.test import (APIClient, APITestCase,
+                                 APITransactionTestCase)
+
+from recipes import urls as recipes_urls
+from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                            RecipeTag, ShoppingCart, Tag)
+from recipes.services.shopping_cart_service import ShoppingCartService
+from users import urls as users_urls
+from users.models import Subscription, User
+from utils.metrics import UNRESOLVED_VIEW
+from utils.models import RequestProfile
+from utils.slow_queries import SlowQueryRecorder
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp()
+SMALL_SIZE = 10
+LARGE_SIZE = 200
+BULK_SIZE = 3
+PASSWORD = '1qa!QA1qa'
+BASE64_IMAGE = (
+    'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABAgMAAABieywaAAAA'
+    'CVBMVEUAAAD///9fX1/S0ecCAAAACXBIWXMAAA7EAAAOxAGVKw4bAAAACklEQVQImWNo'
+    'AAAAggCByxOyYQAAAABJRU5ErkJggg=='
+)
+
+# Maximum number of queries per request, measured after a warm-up request
+# for GET endpoints. Counts must also stay the same between SMALL_SIZE and
+# LARGE_SIZE related rows. Lower a budget when an endpoint gets cheaper.
+# The numbers were measured on SQLite 3.35+ (for RETURNING). On PostgreSQL
+# the relation service merges some statements with CTEs, so counts there can
+# only be lower; calibrate on SQLite so the budgets hold for both backends.
+QUERY_BUDGETS = {
+    'tag-list': 0,
+    'tag-detail': 1,
+    'ingredient-list': 0,
+    'ingredient-list?name': 0,
+    'ingredient-detail': 1,
+    'recipe-list': 5,
+    'recipe-list-authorized': 8,
+    'recipe-list?tags': 8,
+    'recipe-list?is_favorited': 8,
+    'recipe-list?is_in_shopping_cart': 8,
+    'recipe-list?author': 10,
+    'recipe-list?cursor': 5,
+    'recipe-create': 11,
+    'recipe-bulk-create': 8,
+    'recipe-bulk-create?commit=item': 18,
+    'recipe-detail': 7,
+    'recipe-update': 19,
+    'recipe-delete': 16,
+    'recipe-image': 3,
+    'recipe-favorite-add': 3,
+    'recipe-favorite-remove': 2,
+    'recipe-shopping-cart-add': 11,
+    'recipe-shopping-cart-remove': 10,
+    'recipe-shopping-cart-bulk-add': 11,
+    'recipe-shopping-cart-bulk-remove': 12,
+    'recipe-shopping-cart-clear': 5,
+    'recipe-favorite-bulk-add': 5,
+    'recipe-favorite-bulk-remove': 3,
+    'recipe-favorite-clear': 2,
+    'recipe-download-shopping-cart': 2,
+    'recipe-download-shopping-cart?format=json': 2,
+    'user-list': 3,
+    'user-create': 3,
+    'user-detail': 1,
+    'user-me': 2,
+    'user-set-password': 2,
+    'user-subscriptions': 4,
+    'user-subscribe': 2,
+    'user-unsubscribe': 2,
+    'user-login': 2,
+    'user-logout': 2,
+}
+
+Endpoint = namedtuple(
+    'Endpoint',
+    ('label', 'route', 'method', 'url', 'data', 'authorized', 'content_type'),
+    defaults=(None,))
+
+
+def get_route_names(urlconf):
+    names = {
+        pattern.name
+        for pattern in urlconf.router.urls + urlconf.urlpatterns
+        if getattr(pattern, 'name', None)
+    }
+    names.discard('api-root')
+    return names
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class QueryBudgetTests(APITestCase):
+    """Runs every API route at two data sizes and checks query counts."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='owner@user.co', username='owner', password=PASSWORD)
+        cls.token = Token.objects.create(user=cls.user)
+        cls.spare_author = User.objects.create_user(
+            email='spare@user.co', username='spare')
+        cls.big_recipe = cls._create_recipe(cls.user, 'big recipe')
+        cls.spare_recipe = cls._create_recipe(cls.spare_author, 'spare')
+        Favorite.objects.create(user=cls.user, recipe=cls.big_recipe)
+        ShoppingCart.objects.create(user=cls.user, recipe=cls.big_recipe)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    @staticmethod
+    def _create_recipe(author, name):
+        return Recipe.objects.create(author=author, name=name, text='text',
+                                     cooking_time=1, image='recipes/test.jpg')
+
+    def setUp(self):
+        self.authorized_client = APIClient()
+        self.authorized_client.credentials(
+            HTTP_AUTHORIZATION='Token ' + self.token.key)
+        self.unauthorized_client = APIClient()
+
+    def _populate(self, start, stop):
+        """Adds rows with indexes start..stop-1 to every relation."""
+        indexes = range(start, stop)
+        tags = Tag.objects.bulk_create(
+            Tag(name=f'tag{i}', color=f'#{i:06x}', slug=f'tag-{i}')
+            for i in indexes)
+        ingredients = Ingredient.objects.bulk_create(
+            Ingredient(name=f'ingredient{i}', measurement_unit='g')
+            for i in indexes)
+        authors = User.objects.bulk_create(
+            User(email=f'author{i}@user.co', username=f'author{i}')
+            for i in indexes)
+        recipes = Recipe.objects.bulk_create(
+            Recipe(author=author, name=f'recipe{i}', text='text',
+                   cooking_time=1, image='recipes/test.jpg')
+            for i, author in zip(indexes, authors))
+
+        RecipeTag.objects.bulk_create(
+            [RecipeTag(recipe=recipe, tag=tag)
+             for recipe, tag in zip(recipes, tags)]
+            + [RecipeTag(recipe=recipe, tag=tag)
+               for recipe in (self.big_recipe, self.spare_recipe)
+               for tag in tags])
+        RecipeIngredient.objects.bulk_create(
+            [RecipeIngredient(recipe=recipe, ingredient=ingredient, amount=1)
+             for recipe, ingredient in zip(recipes, ingredients)]
+            + [RecipeIngredient(recipe=recipe, ingredient=ingredient,
+                                amount=2)
+               for recipe in (self.big_recipe, self.spare_recipe)
+               for ingredient in ingredients])
+        Favorite.objects.bulk_create(
+            Favorite(user=self.user, recipe=recipe) for recipe in recipes)
+        ShoppingCart.objects.bulk_create(
+            ShoppingCart(user=self.user, recipe=recipe) for recipe in recipes)
+        Subscription.objects.bulk_create(
+            Subscription(user=self.user, author=author) for author in authors)
+        ShoppingCartService.rebuild(
+            list(User.objects.values_list('pk', flat=True)))
+
+    def _get_endpoints(self):
+        first_tag = Tag.objects.order_by('pk').first()
+        ingredients = Ingredient.objects.order_by('pk')
+        recipe_list = reverse('recipes:recipe-list')
+        big_recipe = reverse('recipes:recipe-detail',
+                             kwargs={'pk': self.big_recipe.pk})
+        download = reverse('recipes:recipe-download-shopping-cart')
+        bulk_create = reverse('recipes:recipe-bulk-create')
+        bulk_cart = reverse('recipes:recipe-shopping-cart-bulk')
+        bulk_favorite = reverse('recipes:recipe-favorite-bulk')
+        # Recipes in and out of the cart and favorites, a fixed number.
+        bulk_recipes = {'recipes': [
+            self.big_recipe.pk, self.spare_recipe.pk,
+            *Recipe.objects.exclude(
+                pk__in=[self.big_recipe.pk, self.spare_recipe.pk],
+            ).order_by('pk').values_list('pk', flat=True)[:BULK_SIZE]]}
+        recipe_data = {
+            'name': 'new recipe',
+            'text': 'text',
+            'cooking_time': 1,
+            'image': BASE64_IMAGE,
+            'tags': list(Tag.objects.values_list('pk', flat=True)),
+            'ingredients': [{'id': ingredient.pk, 'amount': 3}
+                            for ingredient in ingredients],
+        }
+        # A fixed payload, as SQLite splits larger bulk inserts.
+        bulk_data = [dict(recipe_data, name=f'bulk recipe {i}',
+                          tags=recipe_data['tags'][:3],
+                          ingredients=recipe_data['ingredients'][:3])
+                     for i in range(BULK_SIZE)]
+        return [
+            Endpoint('tag-list', 'recipes:tag-list', 'get',
+                     reverse('recipes:tag-list'), None, False),
+            Endpoint('tag-detail', 'recipes:tag-detail', 'get',
+                     reverse('recipes:tag-detail',
+                             kwargs={'pk': first_tag.pk}), None, False),
+            Endpoint('ingredient-list', 'recipes:ingredient-list', 'get',
+                     reverse('recipes:ingredient-list'), None, False),
+            Endpoint('ingredient-list?name', 'recipes:ingredient-list',
+                     'get', reverse('recipes:ingredient-list'),
+                     {'name': 'ingr'}, False),
+            Endpoint('ingredient-detail', 'recipes:ingredient-detail', 'get',
+                     reverse('recipes:ingredient-detail',
+                             kwargs={'pk': ingredients[0].pk}), None, False),
+            Endpoint('recipe-list', 'recipes:recipe-list', 'get',
+                     recipe_list, None, False),
+            Endpoint('recipe-list-authorized', 'recipes:recipe-list', 'get',
+                     recipe_list, None, True),
+            Endpoint('recipe-list?tags', 'recipes:recipe-list', 'get',
+                     recipe_list, {'tags': ['tag-0', 'tag-1']}, True),
+            Endpoint('recipe-list?is_favorited', 'recipes:recipe-list',
+                     'get', recipe_list, {'is_favorited': 1}, True),
+            Endpoint('recipe-list?is_in_shopping_cart', 'recipes:recipe-list',
+                     'get', recipe_list, {'is_in_shopping_cart': 1}, True),
+            Endpoint('recipe-list?author', 'recipes:recipe-list', 'get',
+                     recipe_list, {'author': self.user.pk}, True),
+            Endpoint('recipe-list?cursor', 'recipes:recipe-list', 'get',
+                     recipe_list, {'cursor': ''}, True),
+            Endpoint('recipe-create', 'recipes:recipe-list', 'post',
+                     recipe_list, recipe_data, True),
+            Endpoint('recipe-bulk-create', 'recipes:recipe-bulk-create',
+                     'post', bulk_create, bulk_data, True),
+            Endpoint('recipe-bulk-create?commit=item',
+                     'recipes:recipe-bulk-create', 'post',
+                     f'{bulk_create}?commit=item', bulk_data, True),
+            Endpoint('recipe-detail', 'recipes:recipe-detail', 'get',
+                     big_recipe, None, True),
+            Endpoint('recipe-update', 'recipes:recipe-detail', 'patch',
+                     big_recipe, recipe_data, True),
+            Endpoint('recipe-delete', 'recipes:recipe-detail', 'delete',
+                     big_recipe, None, True),
+            Endpoint('recipe-image', 'recipes:recipe-image', 'post',
+                     reverse('recipes:recipe-image',
+                             kwargs={'pk': self.big_recipe.pk}),
+                     base64.b64decode(BASE64_IMAGE.split(',')[1]), True,
+                     'image/png'),
+            Endpoint('recipe-favorite-add', 'recipes:recipe-favorite', 'post',
+                     reverse('recipes:recipe-favorite',
+                             kwargs={'pk': self.spare_recipe.pk}),
+                     None, True),
+            Endpoint('recipe-favorite-remove', 'recipes:recipe-favorite',
+                     'delete', reverse('recipes:recipe-favorite',
+                                       kwargs={'pk': self.big_recipe.pk}),
+                     None, True),
+            Endpoint('recipe-shopping-cart-add',
+                     'recipes:recipe-shopping-cart', 'post',
+                     reverse('recipes:recipe-shopping-cart',
+                             kwargs={'pk': self.spare_recipe.pk}),
+                     None, True),
+            Endpoint('recipe-shopping-cart-remove',
+                     'recipes:recipe-shopping-cart', 'delete',
+                     reverse('recipes:recipe-shopping-cart',
+                             kwargs={'pk': self.big_recipe.pk}),
+                     None, True),
+            Endpoint('recipe-shopping-cart-bulk-add',
+                     'recipes:recipe-shopping-cart-bulk', 'post', bulk_cart,
+                     bulk_recipes, True),
+            Endpoint('recipe-shopping-cart-bulk-remove',
+                     'recipes:recipe-shopping-cart-bulk', 'delete',
+                     bulk_cart, bulk_recipes, True),
+            Endpoint('recipe-shopping-cart-clear',
+                     'recipes:recipe-shopping-cart-bulk', 'delete',
+                     bulk_cart, {'all': True}, True),
+            Endpoint('recipe-favorite-bulk-add',
+                     'recipes:recipe-favorite-bulk', 'post', bulk_favorite,
+                     bulk_recipes, True),
+            Endpoint('recipe-favorite-bulk-remove',
+                     'recipes:recipe-favorite-bulk', 'delete', bulk_favorite,
+                     bulk_recipes, True),
+            Endpoint('recipe-favorite-clear', 'recipes:recipe-favorite-bulk',
+                     'delete', bulk_favorite, {'all': True}, True),
+            Endpoint('recipe-download-shopping-cart',
+                     'recipes:recipe-download-shopping-cart', 'get',
+                     download, None, True),
+            Endpoint('recipe-download-shopping-cart?format=json',
+                     'recipes:recipe-download-shopping-cart', 'get',
+                     download, {'format': 'json'}, True),
+            Endpoint('user-list', 'users:user-list', 'get',
+                     reverse('users:user-list'), None, True),
+            Endpoint('user-create', 'users:user-list', 'post',
+                     reverse('users:user-list'),
+                     {'email': 'new@user.co', 'username': 'new',
+                      'first_name': 'New', 'last_name': 'User',
+                      'password': PASSWORD}, False),
+            Endpoint('user-detail', 'users:user-detail', 'get',
+                     reverse('users:user-detail',
+                             kwargs={'pk': self.spare_author.pk}),
+                     None, False),
+            Endpoint('user-me', 'users:user-me', 'get',
+                     reverse('users:user-me'), None, True),
+            Endpoint('user-set-password', 'users:user-set-password', 'post',
+                     reverse('users:user-set-password'),
+                     {'current_password': PASSWORD,
+                      'new_password': 'new' + PASSWORD}, True),
+            Endpoint('user-subscriptions', 'users:user-subscriptions', 'get',
+                     reverse('users:user-subscriptions'),
+                     {'recipes_limit': 3}, True),
+            Endpoint('user-subscribe', 'users:user-subscribe', 'post',
+                     reverse('users:user-subscribe',
+                             kwargs={'pk': self.spare_author.pk}),
+                     None, True),
+            Endpoint('user-unsubscribe', 'users:user-subscribe', 'delete',
+                     reverse('users:user-subscribe', kwargs={
+                         'pk': self.user.follower.first().author_id}),
+                     None, True),
+            Endpoint('user-login', 'users:user-login', 'post',
+                     reverse('users:user-login'),
+                     {'email': self.user.email, 'password': PASSWORD}, False),
+            Endpoint('user-logout', 'users:user-logout', 'post',
+                     reverse('users:user-logout'), None, True),
+        ]
+
+    def _capture(self, endpoint):
+        """Runs a request in a rolled back transaction, returns its SQL."""
+        cache.clear()
+        client = (self.authorized_client if endpoint.authorized
+                  else self.unauthorized_client)
+        request = getattr(client, endpoint.method)
+        kwargs = {}
+        if endpoint.content_type:
+            kwargs['content_type'] = endpoint.content_type
+        elif endpoint.method != 'get':
+            kwargs['format'] = 'json'
+        with transaction.atomic():
+            if endpoint.method == 'get':
+                request(endpoint.url, endpoint.data)
+            with CaptureQueriesContext(connection) as context:
+                response = request(endpoint.url, endpoint.data, **kwargs)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+            transaction.set_rollback(True)
+        self.assertLess(
+            response.status_code, 400,
+            f'{endpoint.label} returned {response.status_code}')
+        return [query['sql'] for query in context.captured_queries]
+
+    def _format_queries(self, queries):
+        return '\n'.join(f'{number}. {sql}'
+                         for number, sql in enumerate(queries, start=1))
+
+    def test_every_route_has_a_budget(self):
+        self._populate(0, SMALL_SIZE)
+        covered = {endpoint.route.split(':')[1]
+                   for endpoint in self._get_endpoints()}
+        routes = get_route_names(recipes_urls) | get_route_names(users_urls)
+        self.assertEqual(routes - covered, set())
+        self.assertEqual(
+            {endpoint.label for endpoint in self._get_endpoints()},
+            set(QUERY_BUDGETS))
+
+    def test_query_count_does_not_grow_with_data_size(self):
+        self._populate(0, SMALL_SIZE)
+        small = {endpoint.label: self._capture(endpoint)
+                 for endpoint in self._get_endpoints()}
+        self._populate(SMALL_SIZE, LARGE_SIZE)
+        for endpoint in self._get_endpoints():
+            with self.subTest(endpoint=endpoint.label):
+                large = self._capture(endpoint)
+                self.assertEqual(
+                    len(small[endpoint.label]), len(large),
+                    f'\n{endpoint.label} ran {len(small[endpoint.label])} '
+                    f'queries with {SMALL_SIZE} rows and {len(large)} with '
+                    f'{LARGE_SIZE} rows:\n{self._format_queries(large)}')
+                self.assertLessEqual(
+                    len(large), QUERY_BUDGETS[endpoint.label],
+                    f'\n{endpoint.label} exceeded its budget of '
+                    f'{QUERY_BUDGETS[endpoint.label]} queries on '
+                    f'{connection.vendor}:\n'
+                    f'{self._format_queries(large)}')
+
+
+class MetricsTests(APITestCase):
+    def test_metrics_are_recorded_per_view_and_action(self):
+        self.client.get(reverse('recipes:recipe-list'))
+        response = self.client.get(reverse('metrics'))
+
+        self.assertEqual(response.status_code, 200)
+        content = response.content.decode()
+        self.assertIn(
+            'foodgram_request_duration_seconds_count{'
+            'action="list",method="GET",view="RecipeViewSet"}', content)
+        self.assertIn(
+            'foodgram_db_queries_total{'
+            'action="list",view="RecipeViewSet"}', content)
+
+    def test_metrics_record_unresolved_requests(self):
+        self.client.get('/missing/')
+        response = self.client.get(reverse('metrics'))
+
+        self.assertIn('status="404",view="<unresolved>"',
+                      response.content.decode())
+
+    @override_settings(METRICS={'ALLOWED_IPS': ['10.0.0.0/8'],
+                                'TOKEN': 'secret'})
+    def test_metrics_require_allowed_address_or_token(self):
+        url = reverse('metrics')
+        cases = (
+            ({}, 403),
+            ({'REMOTE_ADDR': '10.1.2.3'}, 200),
+            ({'HTTP_AUTHORIZATION': 'Bearer wrong'}, 403),
+            ({'HTTP_AUTHORIZATION': 'Bearer secret'}, 200),
+        )
+        for extra, status_code in cases:
+            with self.subTest(extra=extra):
+                response = self.client.get(url, **extra)
+                self.assertEqual(response.status_code, status_code)
+
+
+class SlowQueryLogTests(APITestCase):
+    def setUp(self):
+        self.log_dir = tempfile.mkdtemp()
+        self.log_file = os.path.join(self.log_dir, 'slow_queries.jsonl')
+        Tag.objects.create(name='tag', color='#000000', slug='tag')
+
+    def tearDown(self):
+        shutil.rmtree(self.log_dir, ignore_errors=True)
+
+    def _read_records(self):
+        with open(self.log_file, encoding='utf-8') as log_file:
+            return [json.loads(line) for line in log_file]
+
+    def test_slow_queries_are_logged_with_view_and_origin(self):
+        with self.settings(SLOW_QUERY_LOG={'FILE': self.log_file,
+                                           'THRESHOLD_MS': 0}):
+            self.client.get(reverse('recipes:recipe-list'), {'tags': 'tag'})
+
+        records = self._read_records()
+        self.assertTrue(records)
+        self.assertTrue(all(record['view'] == 'RecipeViewSet'
+                            and record['action'] == 'list'
+                            for record in records))
+        filtered = [record for record in records
+                    if 'RecipeFilter.filter_by_tags' in record['origins']]
+        self.assertTrue(filtered)
+        self.assertIn('recipes_recipetag', filtered[0]['sql'])
+        self.assertTrue(filtered[0]['call_site'])
+
+    def test_fast_queries_are_not_logged(self):
+        with self.settings(SLOW_QUERY_LOG={'FILE': self.log_file,
+                                           'THRESHOLD_MS': 10 ** 6}):
+            self.client.get(reverse('recipes:recipe-list'))
+
+        self.assertEqual(self._read_records(), [])
+
+    def test_failed_queries_are_not_logged(self):
+        request = RequestFactory().get('/')
+        recorder = SlowQueryRecorder(
+            request, {'FILE': self.log_file, 'THRESHOLD_MS': 0})
+
+        with connection.execute_wrapper(recorder), \
+                self.assertRaises(DatabaseError):
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT * FROM missing_table')
+
+        self.assertEqual(self._read_records(), [])
+
+    def test_slow_query_log_is_disabled_without_file(self):
+        with self.settings(SLOW_QUERY_LOG={'FILE': '', 'THRESHOLD_MS': 0}):
+            self.client.get(reverse('recipes:recipe-list'))
+
+        self.assertFalse(os.path.exists(self.log_file))
+
+
+class ProfilingTests(APITestCase):
+    def setUp(self):
+        self.profile_dir = tempfile.mkdtemp()
+        self.admin = User.objects.create_user(
+            email='admin@user.co', username='admin', is_staff=True)
+        self.user = User.objects.create_user(
+            email='user@user.co', username='user')
+
+    def tearDown(self):
+        shutil.rmtree(self.profile_dir, ignore_errors=True)
+
+    def _get_recipes(self, user, sample_rate=0, **extra):
+        token = Token.objects.create(user=user)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        with self.settings(PROFILING={'DIR': self.profile_dir,
+                                      'SAMPLE_RATE': sample_rate}):
+            return self.client.get(reverse('recipes:recipe-list'), **extra)
+
+    def test_admin_can_profile_request_with_header(self):
+        response = self._get_recipes(self.admin, HTTP_X_PROFILE='1')
+
+        profile = RequestProfile.objects.get()
+        self.assertEqual(response['X-Profile-Id'], str(profile.pk))
+        self.assertEqual((profile.view, profile.action),
+                         ('RecipeViewSet', 'list'))
+        self.assertEqual(profile.user, self.admin)
+        self.assertFalse(profile.sampled)
+        self.assertIn('function calls', profile.top_functions)
+        self.assertTrue(profile.top_allocations)
+        self.assertTrue(os.path.exists(
+            os.path.join(self.profile_dir, profile.stats_file)))
+
+    def test_regular_user_cannot_profile_request(self):
+        response = self._get_recipes(self.user, HTTP_X_PROFILE='1')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertFalse(RequestProfile.objects.exists())
+
+    def test_sampled_requests_are_profiled(self):
+        self._get_recipes(self.user, sample_rate=1)
+
+        profile = RequestProfile.objects.get()
+        self.assertTrue(profile.sampled)
+        self.assertIsNone(profile.user)
+        self.assertEqual(profile.top_allocations, '')
+
+    def test_unresolved_view_label_is_safe_in_file_name(self):
+        with self.settings(PROFILING={'DIR': self.profile_dir,
+                                      'SAMPLE_RATE': 1}):
+            self.client.get('/api/missing/')
+
+        profile = RequestProfile.objects.get()
+        self.assertEqual(profile.view, UNRESOLVED_VIEW)
+        self.assertRegex(profile.stats_file, r'^[\w.-]+$')
+        self.assertIn('-unresolved-', profile.stats_file)
+        self.assertTrue(os.path.exists(
+            os.path.join(self.profile_dir, profile.stats_file)))
+
+    def test_failed_profile_save_keeps_response(self):
+        self.profile_dir = os.path.join(self.profile_dir, 'file')
+        open(self.profile_dir, 'w').close()
+
+        with self.assertLogs('utils.middleware', 'ERROR'):
+            response = self._get_recipes(self.admin, HTTP_X_PROFILE='1')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertFalse(RequestProfile.objects.exists())
+
+
+class ImportBasicDataTests(APITestCase):
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        files = {
+            'users.csv': 'first@user.co,first,First,User,secret\n'
+                         'second@user.co,second,Second,User,secret\n'
+                         'first@user.co,copy,Copy,User,secret\n',
+            'tags.csv': 'breakfast,#E26C2D,breakfast\n',
+            'ingredients.csv': 'salt,g\n',
+            'recipes.json': '{"recipes": []}',
+        }
+        for name, content in files.items():
+            with open(os.path.join(self.data_dir, name), 'w') as data_file:
+                data_file.write(content)
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir, ignore_errors=True)
+
+    def _import(self, *args):
+        output = io.StringIO()
+        call_command('import_basic_data', self.data_dir + '/', *args,
+                     state_file=os.path.join(self.data_dir, 'state.json'),
+                     stdout=output)
+        return output.getvalue()
+
+    def test_users_get_own_salts_and_created_rows_are_counted(self):
+        output = self._import()
+
+        first, second = User.objects.order_by('username')
+        self.assertNotEqual(first.password, second.password)
+        self.assertTrue(first.check_password('secret'))
+        self.assertIn('users: 3 rows processed, 2 created', output)
+
+    def test_fast_passwords_are_upgraded_on_login(self):
+        self._import('--fast-passwords')
+
+        user = User.objects.get(username='first')
+        self.assertIn('$1000$', user.password)
+        self.assertTrue(user.check_password('secret'))
+        user.refresh_from_db()
+        self.assertNotIn('$1000$', user.password)
+
+
+class BenchmarkTests(APITestCase):
+    def test_benchmark_runs_with_existing_fixture_names(self):
+        User.objects.create_user(
+            email='benchmark@example.com', username='benchmark')
+        Tag.objects.create(
+            name='benchmark tag 0', color='#b00000', slug='benchmark-tag-0')
+        report_file = os.path.join(tempfile.mkdtemp(), 'report.json')
+        self.addCleanup(shutil.rmtree, os.path.dirname(report_file))
+        out = io.StringIO()
+
+        call_command('benchmark', '--repeat', '1', '--warmup', '0',
+                     '-k', 'serializer', '--save', report_file, stdout=out)
+
+        self.assertIn('recipe_retrieve_serializer[6]', out.getvalue())
+        with open(report_file) as report:
+            cases = json.load(report)['cases']
+        self.assertIn('recipe_create_update_serializer.create', cases)
+        self.assertNotIn('file_generator.csv[200]', cases)
+        self.assertEqual(User.objects.count(), 1)
+        self.assertEqual(Tag.objects.count(), 1)
+        self.assertFalse(Recipe.objects.exists())
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class GenerateSyntheticDataTests(APITestCase):
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def test_generates_requested_rows_and_shopping_lists(self):
+        call_command('generate_synthetic_data', '--users', '6',
+                     '--recipes', '15', '--tags', '3', '--ingredients', '20',
+                     '--cart-per-user', '3', '--chunk-size', '4',
+                     stdout=io.StringIO())
+
+        self.assertEqual(User.objects.count(), 6)
+        self.assertEqual(Recipe.objects.count(), 15)
+        self.assertEqual(Tag.objects.count(), 3)
+        self.assertEqual(Ingredient.objects.count(), 20)
+        self.assertTrue(ShoppingCart.objects.exists())
+        for user in User.objects.all():
+            expected = {}
+            for recipe_ingredient in RecipeIngredient.objects.filter(
+                    recipe__in_cart__user=user).select_related('ingredient'):
+                name = recipe_ingredient.ingredient.name
+                expected[name] = (expected.get(name, 0)
+                                  + recipe_ingredient.amount)
+            stored = {item['name']: item['amount'] for item in
+                      ShoppingCartService.iter_ingredients(user)}
+            self.assertEqual(stored, expected)
+
+    def test_existing_prefix_is_rejected(self):
+        User.objects.create_user(
+            email='synthetic_0@example.com', username='synthetic_0')
+
+        with self.assertRaisesMessage(CommandError, 'already exist'):
+            call_command('generate_synthetic_data', '--users', '1',
+                         '--recipes', '0', stdout=io.StringIO())
+
+
+class LoadTestTests(APITransactionTestCase):
+    def setUp(self):
+        user = User.objects.create_user(
+            email='user@user.co', username='user')
+        tag = Tag.objects.create(name='tag', color='#000000', slug='tag')
+        Ingredient.objects.create(name='potato', measurement_unit='g')
+        # Enough recipes for the third page the scenario may ask for.
+        recipes = Recipe.objects.bulk_create(
+            Recipe(author=user, name=f'recipe {i}', text='text',
+                   cooking_time=1, image='recipes/test.jpg')
+            for i in range(18))
+        RecipeTag.objects.bulk_create(
+            RecipeTag(recipe=recipe, tag=tag) for recipe in recipes)
+        self.report_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.report_dir)
+
+    def test_load_test_reports_per_route_stats(self):
+        report_file = os.path.join(self.report_dir, 'report.json')
+
+        call_command('load_test', '--requests', '12', '--concurrency', '2',
+                     '--output', report_file, stdout=io.StringIO())
+
+        with open(report_file) as report_file:
+            report = json.load(report_file)
+        self.assertEqual(report['requests'], 12)
+        self.assertEqual(
+            sum(stats['requests'] for stats in report['scenarios'].values()),
+            12)
+        self.assertLessEqual(
+            set(report['scenarios']),
+            {'recipes', 'subscriptions', 'ingredients', 'download'})
+        for scenario, stats in report['scenarios'].items():
+            with self.subTest(scenario=scenario):
+                self.assertEqual(stats['errors'], 0)
+                self.assertLessEqual(stats['p50_ms'], stats['p99_ms'])
+                self.assertGreater(stats['max_queries'], 0)
+
+    def test_load_test_rejects_unknown_scenario(self):
+        with self.assertRaisesMessage(CommandError, 'Unknown scenario'):
+            call_command('load_test', '--mix', 'missing=1',
+                         stdout=io.StringIO())
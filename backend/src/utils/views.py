@@ -0,0 +1,31 @@
+import hmac
+import ipaddress
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+from .metrics import render_metrics
+
+
+def is_metrics_client(request):
+    """Allows a bearer METRICS['TOKEN'] or an address in ALLOWED_IPS."""
+    options = settings.METRICS
+    token = options.get('TOKEN')
+    if token:
+        header = request.META.get('HTTP_AUTHORIZATION', '')
+        if hmac.compare_digest(header.encode(), f'Bearer {token}'.encode()):
+            return True
+    try:
+        address = ipaddress.ip_address(request.META.get('REMOTE_ADDR', ''))
+    except ValueError:
+        return False
+    return any(
+        address in ipaddress.ip_network(network.strip(), strict=False)
+        for network in options.get('ALLOWED_IPS', ()) if network.strip())
+
+
+def metrics_view(request):
+    if not is_metrics_client(request):
+        return HttpResponseForbidden()
+    content, content_type = render_metrics()
+    return HttpResponse(content, content_type=content_type)